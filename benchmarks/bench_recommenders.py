@@ -0,0 +1,315 @@
+"""
+
+    Recommender benchmark suite.
+
+    Author: Explore Data Science Academy.
+
+    Description: Measures what a Recommend click costs. For each catalogue
+    scale, a synthetic dataset is derived from `movies.csv`/`ratings.csv`
+    (subsampled below 1.0, replicated with fresh movie and user ids above
+    1.0) and the offline artifacts are built for it. Every benchmark
+    target (`content_model`, `collab_model`, `prediction_item`,
+    `pred_movies`) then runs in its own fresh process over a fixed set of
+    seed lists, reporting:
+
+        - cold start: artifact loading plus the first call,
+        - p50/p95/p99 latency and throughput of the following calls,
+        - peak resident set size of the process.
+
+    The recommendation result cache and the pre-rendered results are
+    disabled so that every call is computed. Results are written as JSON; passing a previous run as
+    `--baseline` makes the script exit non-zero when latency or memory
+    regress by more than `--tolerance`.
+
+    Run from the root of the repository:
+
+        python benchmarks/bench_recommenders.py --scales 0.25 1 2 \
+            --output bench.json
+
+"""
+# Script dependencies
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+# Data handling dependencies
+import numpy as np
+import pandas as pd
+
+TARGETS = ('content_model', 'collab_model', 'prediction_item', 'pred_movies')
+
+# Metrics compared against a baseline run, lower is better
+REGRESSION_METRICS = ('cold_start_s', 'p95_ms', 'peak_rss_mb')
+
+def make_dataset(scale, out_dir, movies_path, ratings_path):
+    """Write a catalogue scaled by `scale` to `out_dir`.
+
+    Parameters
+    ----------
+    scale : float
+        Catalogue size relative to `movies.csv`.
+    out_dir : str
+        Directory receiving `movies.csv` and `ratings.csv`.
+    movies_path, ratings_path : str
+        Source datasets.
+
+    Returns
+    -------
+    dict
+        Number of movies and ratings written.
+
+    """
+    movies = pd.read_csv(movies_path)
+    ratings = pd.read_csv(ratings_path)
+    copies = max(1, int(np.ceil(scale)))
+    movie_offset = int(movies['movieId'].max()) + 1
+    user_offset = int(ratings['userId'].max()) + 1
+    movie_parts, rating_parts = [], []
+    for copy in range(copies):
+        # Each copy is a disjoint catalogue with its own audience
+        part = movies.copy()
+        part['movieId'] += copy * movie_offset
+        if copy:
+            part['title'] = part['title'] + f' [{copy}]'
+        movie_parts.append(part)
+        part = ratings.copy()
+        part['movieId'] += copy * movie_offset
+        part['userId'] += copy * user_offset
+        rating_parts.append(part)
+    movies = pd.concat(movie_parts, ignore_index=True)
+    ratings = pd.concat(rating_parts, ignore_index=True)
+    # Deterministic subsample down to the requested size
+    n_movies = int(round(len(movies) * scale / copies)) if scale < copies else len(movies)
+    movies = movies.sample(n=n_movies, random_state=0).sort_index()
+    ratings = ratings[ratings['movieId'].isin(movies['movieId'])]
+    os.makedirs(out_dir, exist_ok=True)
+    movies.to_csv(os.path.join(out_dir, 'movies.csv'), index=False)
+    ratings.to_csv(os.path.join(out_dir, 'ratings.csv'), index=False)
+    return {'n_movies': len(movies), 'n_ratings': len(ratings)}
+
+def _configure(data_dir):
+    # Point every artifact of the app at the benchmark dataset
+    from utils import registry
+    from utils.quantisation import fingerprint_paths
+    from utils.result_cache import recommendation_cache, prerendered_results
+    import recommenders.content_based as content_based
+    import recommenders.collaborative_based as collaborative_based
+    import utils.movie_filters as movie_filters
+    moved = {}
+
+    def repoint(module, name, path):
+        moved.update(zip(fingerprint_paths(getattr(module, name)), fingerprint_paths(path)))
+        setattr(module, name, path)
+
+    repoint(registry, 'MOVIES_PATH', os.path.join(data_dir, 'movies.csv'))
+    repoint(registry, 'RATINGS_PATH', os.path.join(data_dir, 'ratings.csv'))
+    repoint(registry, 'RATINGS_DELTA_PATH', os.path.join(data_dir, 'ratings_delta.csv'))
+    repoint(registry, 'TAGS_PATH', os.path.join(data_dir, 'tags.csv'))
+    repoint(registry, 'MERGED_RATINGS_PATH', os.path.join(data_dir, 'df_new.csv'))
+    repoint(registry, 'SVD_MODEL_PATH', os.path.join(data_dir, 'SVD.pkl'))
+    repoint(content_based, 'CONTENT_INDEX_PATH', os.path.join(data_dir, 'content_index.npz'))
+    repoint(collaborative_based, 'ITEM_SIMILARITY_PATH',
+            os.path.join(data_dir, 'item_similarity.npz'))
+    moved[os.path.join(collaborative_based.SVD_ARTIFACT_DIR, 'LATEST')] = \
+        os.path.join(data_dir, 'svd', 'LATEST')
+    repoint(collaborative_based, 'SVD_ARTIFACT_DIR', os.path.join(data_dir, 'svd'))
+    repoint(collaborative_based, 'POPULARITY_PATH', os.path.join(data_dir, 'popularity.npz'))
+    repoint(movie_filters, 'FILTER_INDEX_PATH', os.path.join(data_dir, 'movie_filters.npz'))
+    # The cached recommenders fingerprint (and reload) the benchmark's files
+    for recommender in (content_based.content_model, collaborative_based.collab_model):
+        recommender.artifacts = [moved.get(path, path) for path in recommender.artifacts]
+        recommender.reload = {moved.get(path, path): names
+                              for path, names in recommender.reload.items()}
+    # Every call is computed: no cached nor pre-rendered results
+    recommendation_cache.maxsize = 0
+    prerendered_results.path = os.path.join(data_dir, 'prerendered.pkl')
+    return content_based, collaborative_based
+
+def _prepare(data_dir, svd_factors, svd_epochs):
+    # Offline artifacts: content index, item similarity store and SVD
+    content_based, collaborative_based = _configure(data_dir)
+    from utils import registry
+    timings = {}
+    start = time.perf_counter()
+    content_based.build_content_index(content_based.CONTENT_INDEX_PATH,
+                                      store_dir=os.path.join(data_dir, 'features'))
+    timings['build_content_index_s'] = time.perf_counter() - start
+    start = time.perf_counter()
+    collaborative_based.build_item_similarity(collaborative_based.ITEM_SIMILARITY_PATH)
+    timings['build_item_similarity_s'] = time.perf_counter() - start
+    import pickle
+    from surprise import SVD, Dataset, Reader
+    ratings = registry.get('ratings')[['userId', 'movieId', 'rating']]
+    reader = Reader(rating_scale=(ratings['rating'].min(), ratings['rating'].max()))
+    start = time.perf_counter()
+    model = SVD(n_factors=svd_factors, n_epochs=svd_epochs, random_state=0)
+    model.fit(Dataset.load_from_df(ratings, reader).build_full_trainset())
+    timings['train_svd_s'] = time.perf_counter() - start
+    with open(registry.SVD_MODEL_PATH, 'wb') as f:
+        pickle.dump(model, f)
+    # The factor export is what the collaborative targets score from
+    from utils.svd_scoring import extract_factors, export_factors
+    export_factors(collaborative_based.SVD_ARTIFACT_DIR, extract_factors(model),
+                   {'params': {'n_factors': svd_factors, 'n_epochs': svd_epochs},
+                    'n_ratings': int(len(ratings))})
+    return timings
+
+def _seed_lists(data_dir, n_lists, seed=42):
+    # Seeds are drawn from rated movies so that every target has signal
+    movies = pd.read_csv(os.path.join(data_dir, 'movies.csv'))
+    ratings = pd.read_csv(os.path.join(data_dir, 'ratings.csv'), usecols=['movieId'])
+    counts = ratings['movieId'].value_counts()
+    rated = movies[movies['movieId'].isin(counts.index[:500])]
+    rng = random.Random(seed)
+    rows = [rated.sample(n=3, random_state=rng.randrange(1 << 30)) for _ in range(n_lists)]
+    return ([row['title'].tolist() for row in rows],
+            [row['movieId'].tolist() for row in rows])
+
+def _run_target(data_dir, target, iterations, n_lists):
+    # Measures one target in a fresh process; returns its metrics
+    content_based, collaborative_based = _configure(data_dir)
+    title_lists, id_lists = _seed_lists(data_dir, n_lists)
+    calls = {'content_model': lambda i: content_based.content_model(title_lists[i % n_lists], 10),
+             'collab_model': lambda i: collaborative_based.collab_model(title_lists[i % n_lists], 10),
+             'prediction_item': lambda i: collaborative_based.prediction_item(id_lists[i % n_lists][0]),
+             'pred_movies': lambda i: collaborative_based.pred_movies(id_lists[i % n_lists])}
+    call = calls[target]
+
+    start = time.perf_counter()
+    call(0)
+    cold_start = time.perf_counter() - start
+    latencies = []
+    start = time.perf_counter()
+    for i in range(1, iterations + 1):
+        call_start = time.perf_counter()
+        call(i)
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    latencies = np.asarray(latencies) * 1000
+    return {'cold_start_s': cold_start,
+            'iterations': iterations,
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'mean_ms': float(latencies.mean()),
+            'throughput_rps': iterations / elapsed,
+            # ru_maxrss is reported in kilobytes on Linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+def _subprocess(args):
+    # Runs this script in worker mode and parses its JSON report
+    output = subprocess.run([sys.executable, os.path.abspath(__file__)] + args,
+                            cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def run_benchmarks(scales, targets, iterations, n_lists, work_dir, svd_factors, svd_epochs):
+    """Benchmark every target at every catalogue scale.
+
+    Returns
+    -------
+    list (dict)
+        One record per (scale, target).
+
+    """
+    results = []
+    for scale in scales:
+        data_dir = os.path.join(work_dir, f'scale_{scale:g}')
+        sizes = make_dataset(scale, data_dir,
+                             os.path.join(ROOT, 'resources/data/movies.csv'),
+                             os.path.join(ROOT, 'resources/data/ratings.csv'))
+        print(f'... scale {scale:g}: {sizes}', file=sys.stderr)
+        build = _subprocess(['--worker', 'prepare', '--data-dir', data_dir,
+                             '--svd-factors', str(svd_factors), '--svd-epochs', str(svd_epochs)])
+        for target in targets:
+            print(f'... scale {scale:g}: {target}', file=sys.stderr)
+            metrics = _subprocess(['--worker', target, '--data-dir', data_dir,
+                                   '--iterations', str(iterations), '--seed-lists', str(n_lists)])
+            results.append({'scale': scale, 'target': target, **sizes, **build, **metrics})
+    return results
+
+def compare(results, baseline, tolerance):
+    """Regressions of `results` against a baseline report.
+
+    Returns
+    -------
+    list (str)
+        One message per metric that grew by more than `tolerance`.
+
+    """
+    previous = {(r['scale'], r['target']): r for r in baseline['results']}
+    regressions = []
+    for record in results:
+        before = previous.get((record['scale'], record['target']))
+        if before is None:
+            continue
+        for metric in REGRESSION_METRICS:
+            if before.get(metric) and record[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{record['target']} @ scale {record['scale']:g}: {metric} "
+                                   f"{before[metric]:.4g} -> {record[metric]:.4g}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the movie recommenders.')
+    parser.add_argument('--scales', type=float, nargs='+', default=[0.25, 1.0])
+    parser.add_argument('--targets', nargs='+', default=list(TARGETS), choices=TARGETS)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed-lists', type=int, default=50)
+    parser.add_argument('--svd-factors', type=int, default=50)
+    parser.add_argument('--svd-epochs', type=int, default=10)
+    parser.add_argument('--work-dir', help='where scaled datasets are written (default: temporary)')
+    parser.add_argument('--output', help='JSON report path (default: stdout)')
+    parser.add_argument('--baseline', help='previous JSON report to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative growth of a metric before failing')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # Worker modes print a single JSON line; library logging goes to stderr
+        stdout, sys.stdout = sys.stdout, sys.stderr
+        if args.worker == 'prepare':
+            report = _prepare(args.data_dir, args.svd_factors, args.svd_epochs)
+        else:
+            report = _run_target(args.data_dir, args.worker, args.iterations, args.seed_lists)
+        print(json.dumps(report), file=stdout)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run_benchmarks(args.scales, args.targets, args.iterations, args.seed_lists,
+                                 args.work_dir or tmp, args.svd_factors, args.svd_epochs)
+    report = {'meta': {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'pandas': pd.__version__,
+                       'machine': platform.machine(),
+                       'cpus': os.cpu_count(),
+                       'args': {k: v for k, v in vars(args).items() if k not in ('worker', 'data_dir')}},
+              'results': results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f'REGRESSION {message}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -34,8 +34,10 @@ import numpy as np
 
 # Custom Libraries
 from utils.data_loader import load_movie_titles
-from recommenders.collaborative_based import collab_model
-from recommenders.content_based import content_model
+from recommenders.engine import get_engine
+from utils import registry, instrumentation
+from utils.worker_pool import PoolBusy, recommendation_pool, submit_recommendation
+from utils.movie_filters import make_filter
 
 # Pickle dependencies
 import pickle
@@ -45,22 +47,72 @@ from PIL import Image
 
 # Data Loading
 title_list = load_movie_titles('resources/data/movies.csv')
+title_index = registry.get('title_index')
+movie_filters = registry.get('movie_filters')
+
+# Recommendations are computed in-process, or by the recommendation API
+# when RECOMMENDER_API_URL is set
+engine = get_engine()
 
 
 st.markdown('<style>body{background-color: #E5E0E0;}</style>',unsafe_allow_html=True)
 
 #Simple Generic Title Tag function Generator
-st.cache(suppress_st_warning=True,allow_output_mutation=True)
 def title_tag(title):
 	html_temp = """<div style="background-color:{};padding:10px;border-radius:10px; margin-bottom:15px;"><h2 style="color:white;text-align:center;">"""+title+"""</h2></div>"""
 	st.markdown(html_temp, unsafe_allow_html=True)
 
 #Simple Subheading style function
-st.cache(suppress_st_warning=True,allow_output_mutation=True)
 def subheading(title):
 	html_temp = """<div style="background-color:{};padding:10px;margin-bottom:10px;"><h3 style="color:white;text-align:center;">"""+title+"""</h3></div>"""
 	st.markdown(html_temp, unsafe_allow_html=True)
 
+#Type-ahead movie selector over the whole catalogue
+def movie_selector(label, default):
+	query = st.text_input('Search: '+label, '', key='search_'+label)
+	options = title_index.search(query) if query.strip() else [default]
+	if not options:
+		st.warning('No movies match "'+query+'"')
+		options = [default]
+	return st.selectbox(label, options)
+
+#Stage breakdown of the most recent recommendation computed in this process
+def debug_panel():
+	trace = instrumentation.last_trace()
+	with st.sidebar.expander('Last request', expanded=True):
+		if trace is None:
+			st.write('No recommendation computed in this process yet.')
+			return
+		st.write(trace['algorithm']+' ('+trace['status']+'): '+
+				 '{:.2f} ms'.format(trace['seconds']*1000))
+		if trace['memory_bytes'] is not None:
+			st.write('Memory delta: {:.1f} MB'.format(trace['memory_bytes']/2**20))
+		stages = pd.DataFrame.from_dict(trace['stages'], orient='index')
+		if not stages.empty:
+			stages['ms'] = stages.pop('seconds')*1000
+			st.table(stages)
+		if trace['counters']:
+			st.write(trace['counters'])
+		if trace['profile']:
+			st.write('Profile: '+trace['profile'])
+
+#Genre and release year filters applied while recommending
+def filter_options():
+	with st.expander('Filter recommendations'):
+		genres = st.multiselect('Genres', movie_filters.genres)
+		first, last = movie_filters.years
+		year_from, year_to = st.slider('Released between', first, last, (first, last))
+	# The full range also keeps movies without a known release year
+	if (year_from, year_to) == (first, last):
+		year_from = year_to = None
+	return make_filter(genres, year_from, year_to)
+
+#Recommendations computed on the shared worker pool: sessions asking for
+#the same seeds at the same time share a single computation
+def pooled_recommendations(algorithm, movie_list, top_n=10, filters=None):
+	future = submit_recommendation(engine, algorithm, movie_list, top_n, filters=filters)
+	return recommendation_pool.result(future)
+
 # App declaration
 def main():
 	 
@@ -92,25 +144,32 @@ def main():
 		# Recommender System algorithm selection
 		sys = st.radio("Select an algorithm",
 					   ('Content Based Filtering',
-						'Collaborative Based Filtering'))
+						'Collaborative Based Filtering',
+						'Hybrid Filtering'))
 
 		# User-based preferences
 		st.write('### Enter Your Three Favorite Movies')
-		movie_1 = st.selectbox('Fisrt Option',title_list[14930:15200])
-		movie_2 = st.selectbox('Second Option',title_list[25055:25255])
-		movie_3 = st.selectbox('Third Option',title_list[21100:21200])
+		movie_1 = movie_selector('Fisrt Option',title_list[14930])
+		movie_2 = movie_selector('Second Option',title_list[25055])
+		movie_3 = movie_selector('Third Option',title_list[21100])
 		fav_movies = [movie_1,movie_2,movie_3]
+		filters = filter_options()
 
 		# Perform top-10 movie recommendation generation
 		if sys == 'Content Based Filtering':
 			if st.button("Recommend"):
 				try:
 					with st.spinner('Crunching the numbers...'):
-						top_recommendations = content_model(movie_list=fav_movies,
-															top_n=10)
+						top_recommendations = pooled_recommendations('content',
+																	  movie_list=fav_movies,
+																	  top_n=10,
+																	  filters=filters)
 					st.title("We think you'll like:")
 					for i,j in enumerate(top_recommendations):
 						st.subheader(str(i+1)+'. '+j)
+				except (PoolBusy, TimeoutError):
+					st.warning("We're serving a lot of movie lovers right now.\
+								Please try again in a moment!")
 				except:
 					st.error("Oops! Looks like this algorithm does't work.\
 							  We'll need to fix it!")
@@ -120,11 +179,35 @@ def main():
 			if st.button("Recommend"):
 				try:
 					with st.spinner('Crunching the numbers...'):
-						top_recommendations = collab_model(movie_list=fav_movies,
-														   top_n=10)
+						top_recommendations = pooled_recommendations('collaborative',
+																	  movie_list=fav_movies,
+																	  top_n=10,
+																	  filters=filters)
 					st.title("We think you'll like:")
 					for i,j in enumerate(top_recommendations):
 						st.subheader(str(i+1)+'. '+j)
+				except (PoolBusy, TimeoutError):
+					st.warning("We're serving a lot of movie lovers right now.\
+								Please try again in a moment!")
+				except:
+					st.error("Oops! Looks like this algorithm does't work.\
+							  We'll need to fix it!")
+
+
+		if sys == 'Hybrid Filtering':
+			if st.button("Recommend"):
+				try:
+					with st.spinner('Crunching the numbers...'):
+						top_recommendations = pooled_recommendations('hybrid',
+																	  movie_list=fav_movies,
+																	  top_n=10,
+																	  filters=filters)
+					st.title("We think you'll like:")
+					for i,j in enumerate(top_recommendations):
+						st.subheader(str(i+1)+'. '+j)
+				except (PoolBusy, TimeoutError):
+					st.warning("We're serving a lot of movie lovers right now.\
+								Please try again in a moment!")
 				except:
 					st.error("Oops! Looks like this algorithm does't work.\
 							  We'll need to fix it!")
@@ -133,6 +216,11 @@ def main():
 	# -------------------------------------------------------------------
 
 	# ------------- SAFE FOR ALTERING/EXTENSION -------------------
+	#Debug panel of the Recommender System page
+	if page_selection == "Recommender System":
+		if st.sidebar.checkbox('Show debug panel'):
+			debug_panel()
+
 	#Home Page
 	#if page_selection == "Home": 
 	
@@ -0,0 +1,321 @@
+"""
+
+    Headless HTTP recommendation API.
+
+    Author: Explore Data Science Academy.
+
+    Description: A lightweight asyncio HTTP/1.1 server (standard library
+    only) exposing the recommenders as JSON endpoints, independently of
+    the Streamlit user interface. Models are loaded once per process
+    through the artifact registry and requests are computed concurrently
+    on a thread pool, so the event loop keeps accepting connections while
+    recommendations are being scored.
+
+    Endpoints:
+
+        GET  /health                   Liveness plus artifact and cache stats.
+        GET  /metrics                  Prometheus text metrics, see
+                                       `utils.instrumentation`.
+        POST /recommend/content        {"movies": [...], "top_n": 10}
+        POST /recommend/collaborative  {"movies": [...], "top_n": 10}
+        POST /recommend/hybrid         {"movies": [...], "top_n": 10}
+        POST /recommend/user           {"user_id": 1, "top_n": 10}, from the
+                                       personalised top-N export.
+        POST /recommend/batch          {"algorithm": "content", "top_n": 10,
+                                        "requests": [{"movies": [...]}, ...]}
+
+    Recommendation requests may add a filter on genres (any of) and an
+    inclusive release year range, e.g.
+
+        "filters": {"genres": ["Comedy"], "year_from": 2000, "year_to": null}
+
+    Start the server from the root of the repository with:
+
+        python -m recommenders.api --port 8000
+
+    and load-test it locally with the bundled client:
+
+        python -m recommenders.api --loadtest http://localhost:8000 \
+            --requests 2000 --concurrency 32
+
+"""
+# Script dependencies
+import json
+import time
+import random
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from recommenders.engine import ALGORITHMS, LocalEngine
+from utils import registry, instrumentation
+from utils.result_cache import recommendation_cache
+from utils.movie_filters import make_filter
+
+MAX_BODY_BYTES = 1 << 20
+
+class HttpError(Exception):
+    """An error reported to the client with the given status code."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _parse_seeds(payload):
+    if not isinstance(payload, dict):
+        raise HttpError(HTTPStatus.BAD_REQUEST, 'Expected a JSON object')
+    movies = payload.get('movies')
+    if not isinstance(movies, list) or not movies or not all(isinstance(m, str) for m in movies):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "'movies' must be a non-empty list of titles")
+    top_n = payload.get('top_n', 10)
+    if not isinstance(top_n, int) or not 0 < top_n <= 100:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "'top_n' must be an integer between 1 and 100")
+    return movies, top_n
+
+def _parse_filters(payload):
+    filters = payload.get('filters')
+    if filters is None:
+        return None
+    if not isinstance(filters, dict):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "'filters' must be a JSON object")
+    genres = filters.get('genres') or []
+    if not isinstance(genres, list) or not all(isinstance(genre, str) for genre in genres):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "'genres' must be a list of genres")
+    years = [filters.get('year_from'), filters.get('year_to')]
+    if not all(year is None or (isinstance(year, int) and not isinstance(year, bool))
+               for year in years):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "'year_from' and 'year_to' must be integers")
+    return make_filter(genres, *years)
+
+class RecommendationServer:
+    """Routes HTTP requests to an in-process recommendation engine.
+
+    Parameters
+    ----------
+    workers : int
+        Size of the thread pool scoring recommendations.
+
+    """
+
+    def __init__(self, workers=8):
+        self.engine = LocalEngine()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='recommend')
+        self.requests_served = 0
+
+    def preload(self):
+        """Load every model artifact before accepting traffic."""
+        self.engine.warm_up()
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    async def _recommend(self, algorithm, payload):
+        movies, top_n = _parse_seeds(payload)
+        filters = _parse_filters(payload)
+        try:
+            recommendations = await self._run(self.engine.recommend, algorithm, movies, top_n,
+                                              filters)
+        except ValueError as error:
+            raise HttpError(HTTPStatus.BAD_REQUEST, str(error))
+        return {'algorithm': algorithm, 'recommendations': recommendations}
+
+    async def _recommend_user(self, payload):
+        user_id = payload.get('user_id') if isinstance(payload, dict) else None
+        if not isinstance(user_id, int) or isinstance(user_id, bool):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "'user_id' must be an integer")
+        top_n = payload.get('top_n', 10)
+        if not isinstance(top_n, int) or not 0 < top_n <= 100:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "'top_n' must be an integer between 1 and 100")
+        try:
+            recommendations = await self._run(self.engine.recommend_user, user_id, top_n)
+        except ValueError as error:
+            raise HttpError(HTTPStatus.BAD_REQUEST, str(error))
+        except FileNotFoundError as error:
+            raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE, str(error))
+        return {'user_id': user_id, 'recommendations': recommendations}
+
+    async def _recommend_batch(self, payload):
+        if not isinstance(payload, dict) or payload.get('algorithm') not in ALGORITHMS:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"'algorithm' must be one of {list(ALGORITHMS)}")
+        requests = payload.get('requests')
+        if not isinstance(requests, list):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "'requests' must be a list")
+        default_top_n = payload.get('top_n', 10)
+
+        async def one(request):
+            try:
+                if isinstance(request, dict):
+                    request = {'top_n': default_top_n, 'filters': payload.get('filters'), **request}
+                return await self._recommend(payload['algorithm'], request)
+            except HttpError as error:
+                return {'error': str(error)}
+        # Seed lists of a batch are scored concurrently
+        return {'results': await asyncio.gather(*(one(request) for request in requests))}
+
+    async def route(self, method, path, payload):
+        """Dispatch a parsed request and return its JSON response body
+        (or a string, sent as plain text)."""
+        if path == '/health':
+            if method != 'GET':
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, 'Use GET')
+            return {'status': 'ok',
+                    'requests_served': self.requests_served,
+                    'artifacts': registry.stats(),
+                    'cache': recommendation_cache.stats(),
+                    'last_request': instrumentation.last_trace()}
+        if path == '/metrics':
+            if method != 'GET':
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, 'Use GET')
+            # Plain text rather than JSON
+            return instrumentation.render_metrics()
+        if path.startswith('/recommend/'):
+            if method != 'POST':
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, 'Use POST')
+            algorithm = path[len('/recommend/'):]
+            if algorithm == 'batch':
+                return await self._recommend_batch(payload)
+            if algorithm == 'user':
+                return await self._recommend_user(payload)
+            if algorithm in ALGORITHMS:
+                return await self._recommend(algorithm, payload)
+        raise HttpError(HTTPStatus.NOT_FOUND, f'No route for {path}')
+
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one (keep-alive) connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                    length = int(headers.get('content-length', 0))
+                    if length > MAX_BODY_BYTES:
+                        raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'Request body too large')
+                    body = await reader.readexactly(length) if length else b''
+                    try:
+                        payload = json.loads(body) if body else None
+                    except ValueError:
+                        raise HttpError(HTTPStatus.BAD_REQUEST, 'Request body is not valid JSON')
+                    status, response = HTTPStatus.OK, await self.route(method, target.split('?')[0], payload)
+                except HttpError as error:
+                    status, response = error.status, {'error': str(error)}
+                except ValueError:
+                    status, response = HTTPStatus.BAD_REQUEST, {'error': 'Malformed request'}
+                    version = 'HTTP/1.0'
+                except Exception as error:
+                    status, response = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': repr(error)}
+                self.requests_served += 1
+
+                keep_alive = (version == 'HTTP/1.1'
+                              and headers.get('connection', '').lower() != 'close')
+                if isinstance(response, str):
+                    data, content_type = response.encode('utf-8'), 'text/plain; version=0.0.4'
+                else:
+                    data, content_type = json.dumps(response).encode('utf-8'), 'application/json'
+                writer.write((f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                              f'Content-Type: {content_type}\r\n'
+                              f'Content-Length: {len(data)}\r\n'
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+                             .encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        """Accept connections until cancelled."""
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f'... Recommendation API listening on http://{host}:{port}')
+        async with server:
+            await server.serve_forever()
+
+async def _load_test(base_url, seed_lists, requests, concurrency, algorithm):
+    # Each client holds a keep-alive connection and issues requests back to back
+    host, _, port = base_url.split('://', 1)[-1].rstrip('/').partition(':')
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(host, int(port or 80))
+        for _ in remaining:
+            body = json.dumps({'movies': random.choice(seed_lists), 'top_n': 10}).encode('utf-8')
+            start = time.perf_counter()
+            writer.write((f'POST /recommend/{algorithm} HTTP/1.1\r\nHost: {host}\r\n'
+                          f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n')
+                         .encode('latin-1') + body)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            errors += status != 200
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    percentile = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    return {'requests': len(latencies),
+            'errors': errors,
+            'seconds': elapsed,
+            'throughput_rps': len(latencies) / elapsed,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless recommendation API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=8,
+                        help='threads scoring recommendations')
+    parser.add_argument('--no-preload', action='store_true',
+                        help='load models on first request instead of at startup')
+    parser.add_argument('--loadtest', metavar='URL',
+                        help='run the load-test client against a running API instead')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--algorithm', default='content', choices=ALGORITHMS)
+    args = parser.parse_args()
+
+    if args.loadtest:
+        titles = registry.get('movies')['title'].astype(str).tolist()[:2000]
+        rng = random.Random(42)
+        seed_lists = [rng.sample(titles, 3) for _ in range(200)]
+        report = asyncio.run(_load_test(args.loadtest, seed_lists, args.requests,
+                                        args.concurrency, args.algorithm))
+        print(json.dumps(report, indent=2))
+        return
+
+    server = RecommendationServer(workers=args.workers)
+    if not args.no_preload:
+        server.preload()
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -28,24 +28,432 @@
 """
 
 # Script dependencies
+import os
 import pandas as pd
 import numpy as np
 import pickle
 import copy
 import scipy as sp
-from surprise import Reader, Dataset
+from surprise import Reader, Dataset, Prediction
 from surprise import SVD, NormalPredictor, BaselineOnly, KNNBasic, NMF
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.feature_extraction.text import CountVectorizer
+from utils import registry, instrumentation
+from utils.result_cache import cached_recommender
+from utils.neighbour_index import build_topk_index, update_topk_index, save_index, load_index, merge_neighbours
+from utils.svd_scoring import (extract_factors, load_factors, latest_factors_path, export_factors,
+                               fold_in, score_items, top_k, is_quantised)
+from utils.quantisation import FULL_PRECISION, MODEL_PRECISION, resolve_path, fingerprint_paths
+from utils.factor_index import FactorIndex, combine_vectors
+from utils.ratings_ingest import ensure_ingested, load_rating_matrix, load_stats
+from utils.popularity import POPULARITY_PATH, build_popularity, PopularityTable
+from utils.user_topn import USER_TOPN_DIR, UserTopN
+# Registers the 'movie_filters' artifact
+import utils.movie_filters
 
-# Importing data
-movies_df = pd.read_csv('resources/data/movies.csv',sep = ',',delimiter=',')
-ratings_df = pd.read_csv('resources/data/ratings.csv')
-ratings_df.drop(['timestamp'], axis=1,inplace=True)
-movies = pd.read_csv('resources/data/df_new.csv',sep = ',',delimiter=',')
-# We make use of an SVD model trained on a subset of the MovieLens 10k dataset.
-print('... Loading the Pickled Model')
-model=pickle.load(open('resources/models/SVD.pkl', 'rb'))
+# Precomputed top-k item-item similarity store, see `build_item_similarity`
+ITEM_SIMILARITY_PATH = 'resources/models/item_similarity.npz'
+# Versioned SVD factor exports, see `resources/models/train_pipeline.py`
+SVD_ARTIFACT_DIR = 'resources/models/svd'
+# Neighbours are taken from the item-item similarity store ('similarity')
+# or searched for among the SVD item factors ('factors')
+COLLAB_BACKEND = os.environ.get('RECOMMENDER_COLLAB_BACKEND', 'similarity')
+# Factors of movies with fewer ratings are too noisy to recommend from
+MIN_FACTOR_RATINGS = 10
+# Files the recommendations of each backend are computed from
+COLLAB_ARTIFACTS = {'similarity': [*fingerprint_paths(ITEM_SIMILARITY_PATH), POPULARITY_PATH,
+                                   registry.MOVIES_PATH, registry.RATINGS_PATH,
+                                   registry.RATINGS_DELTA_PATH],
+                    'factors': [registry.SVD_MODEL_PATH, os.path.join(SVD_ARTIFACT_DIR, 'LATEST'),
+                                POPULARITY_PATH, registry.MOVIES_PATH, registry.RATINGS_PATH,
+                                registry.RATINGS_DELTA_PATH]}
+# Registry entries loaded from each of those files, reloaded when it changes
+SVD_ENTRIES = ['svd_factors', 'factor_index', 'factor_positions']
+COLLAB_ENTRIES = {**dict.fromkeys(fingerprint_paths(ITEM_SIMILARITY_PATH), ['item_similarity']),
+                  registry.SVD_MODEL_PATH: ['svd_model', *SVD_ENTRIES],
+                  os.path.join(SVD_ARTIFACT_DIR, 'LATEST'): SVD_ENTRIES,
+                  POPULARITY_PATH: ['popularity'],
+                  **registry.DATASET_ENTRIES,
+                  # Only movies rated often enough are searchable
+                  registry.RATINGS_PATH: ['ratings', 'factor_index', 'factor_positions'],
+                  registry.RATINGS_DELTA_PATH: ['ratings', 'factor_index', 'factor_positions']}
+
+def _load_svd_factors(precision=MODEL_PRECISION):
+    # The SVD parameters as NumPy arrays, for batch scoring. An exported
+    # factor artifact avoids unpickling the full surprise model, and its
+    # reduced-precision variant (see `utils.quantisation`) saves memory.
+    path = latest_factors_path(SVD_ARTIFACT_DIR, precision)
+    if path is not None:
+        return load_factors(path)
+    return extract_factors(registry.get('svd_model'))
+
+registry.register('svd_factors', _load_svd_factors)
+
+def _load_factor_index():
+    # Only sufficiently rated movies with a known title are searchable
+    factors = registry.get('svd_factors')
+    counts = registry.get('ratings')['movieId'].value_counts()
+    searchable = ((counts.reindex(factors['item_index']).fillna(0).values >= MIN_FACTOR_RATINGS)
+                  & factors['item_index'].isin(registry.get('movies')['movieId']))
+    rows = np.flatnonzero(searchable)
+    return FactorIndex(factors['qi'][rows]), np.asarray(factors['item_index'][rows])
+
+registry.register('factor_index', _load_factor_index)
+# movieId -> factor index position lookup, hashed once per process
+registry.register('factor_positions', lambda: pd.Index(registry.get('factor_index')[1]))
+
+def svd_available():
+    """Whether trained SVD factors (exported or pickled) exist."""
+    return (latest_factors_path(SVD_ARTIFACT_DIR) is not None
+            or os.path.exists(registry.SVD_MODEL_PATH))
+
+def _factor_query(seed_ids):
+    # Combined unit query vector of the seeds known to the SVD model
+    factors = registry.get('svd_factors')
+    rows = factors['item_index'].get_indexer(list(seed_ids))
+    rows = rows[rows >= 0]
+    if len(rows) == 0:
+        return None
+    return combine_vectors(factors['qi'][rows])
+
+def rating_matrix(ratings):
+    """Arrange a ratings table as a sparse item x user matrix.
+
+    Parameters
+    ----------
+    ratings : Pandas DataFrame
+        Ratings with `userId`, `movieId` and `rating` columns.
+
+    Returns
+    -------
+    tuple (scipy.sparse.csr_matrix, numpy.ndarray, numpy.ndarray)
+        The rating matrix, and the movieId and userId of each of its
+        rows and columns respectively.
+
+    """
+    item_codes, item_ids = pd.factorize(ratings['movieId'], sort=True)
+    user_codes, user_ids = pd.factorize(ratings['userId'], sort=True)
+    matrix = sp.sparse.csr_matrix((ratings['rating'].values.astype(np.float32),
+                                   (item_codes, user_codes)),
+                                  shape=(len(item_ids), len(user_ids)))
+    return matrix, np.asarray(item_ids), np.asarray(user_ids)
+
+def normalise_ratings(matrix):
+    """Centre and scale the ratings of each item.
+
+    Every stored rating `r` of an item becomes `(r - mean) / (max - min)`
+    over that item's ratings. Items whose ratings are all equal carry no
+    signal and are zeroed. Unrated cells stay implicit zeros.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        Item x user rating matrix.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Normalised copy of the matrix.
+
+    """
+    matrix = sp.sparse.csr_matrix(matrix, dtype=np.float32, copy=True)
+    counts = np.diff(matrix.indptr)
+    rows = np.repeat(np.arange(matrix.shape[0]), counts)
+    rated = counts > 0
+    mean = np.bincount(rows, weights=matrix.data, minlength=matrix.shape[0]) / np.maximum(counts, 1)
+    spread = np.zeros(matrix.shape[0])
+    if rated.any():
+        starts = matrix.indptr[:-1][rated]
+        spread[rated] = (np.maximum.reduceat(matrix.data, starts)
+                         - np.minimum.reduceat(matrix.data, starts))
+    scale = np.divide(1.0, spread, out=np.zeros_like(spread), where=spread > 0)
+    matrix.data = ((matrix.data - mean[rows]) * scale[rows]).astype(np.float32)
+    matrix.eliminate_zeros()
+    return matrix
+
+def titled_rating_matrix(normalised=False):
+    """Rating matrix of the rated movies with a known title.
+
+    The matrix is streamed from the ratings files (base and delta log)
+    with bounded memory by the chunked ingestion, see
+    `utils.ratings_ingest`, which is re-run when the files have changed.
+
+    Parameters
+    ----------
+    normalised : bool
+        Return the ratings normalised as by `normalise_ratings`.
+
+    Returns
+    -------
+    tuple (scipy.sparse.csr_matrix, numpy.ndarray, numpy.ndarray)
+        The item x user matrix, and the movieId and userId of each of
+        its rows and columns respectively.
+
+    """
+    store = ensure_ingested([registry.RATINGS_PATH, registry.RATINGS_DELTA_PATH])
+    matrix, item_ids, user_ids = load_rating_matrix(store, normalised=normalised)
+    titled = np.isin(item_ids, registry.get('movies')['movieId'])
+    return matrix[titled], item_ids[titled], user_ids
+
+def build_item_similarity(save_path=ITEM_SIMILARITY_PATH, k=50, matrix=None, item_ids=None):
+    """Build the top-k item-item similarity store from the ratings.
+
+    Parameters
+    ----------
+    save_path : str
+        Location to write the `.npz` store.
+    k : int
+        Number of neighbours stored for each movie.
+    matrix : scipy.sparse.csr_matrix, optional
+        Item x user rating matrix. Defaults to the ratings of movies
+        with a known title, see `titled_rating_matrix`.
+    item_ids : numpy.ndarray, optional
+        movieId of each row of `matrix`.
+
+    """
+    if matrix is None:
+        # Normalised while ingesting
+        with instrumentation.stage('pivot'):
+            matrix_norm, item_ids, _ = titled_rating_matrix(normalised=True)
+    else:
+        print('... Normalizing the rating matrix')
+        with instrumentation.stage('normalise'):
+            matrix_norm = normalise_ratings(matrix)
+    print('... Building the item similarity store')
+    with instrumentation.stage('similarity'):
+        neighbours = build_topk_index(matrix_norm, k=k)
+    save_index(save_path, neighbours, item_ids)
+
+def _load_item_similarity():
+    # Build the store on first use if the offline step has not been run
+    if not os.path.exists(ITEM_SIMILARITY_PATH):
+        build_item_similarity(ITEM_SIMILARITY_PATH)
+    return load_index(resolve_path(ITEM_SIMILARITY_PATH))
+
+registry.register('item_similarity', _load_item_similarity)
+
+def build_popularity_table(save_path=POPULARITY_PATH):
+    """Build the popularity rankings used for cold-start recommendations.
+
+    Parameters
+    ----------
+    save_path : str
+        Location to write the `.npz` table.
+
+    """
+    print('... Ranking movies by popularity')
+    store = ensure_ingested([registry.RATINGS_PATH, registry.RATINGS_DELTA_PATH])
+    build_popularity(load_stats(store, 'item'), registry.get('movies'), save_path)
+
+def _load_popularity():
+    # Build the table on first use if the offline step has not been run
+    if not os.path.exists(POPULARITY_PATH):
+        build_popularity_table(POPULARITY_PATH)
+    return PopularityTable(POPULARITY_PATH)
+
+registry.register('popularity', _load_popularity)
+
+def popular_movies(top_n=10, genre=None, decade=None, exclude=None, filters=None):
+    """Most popular movies by Bayesian-average rating.
+
+    Parameters
+    ----------
+    top_n : int
+        Number of movies.
+    genre : str, optional
+        Only movies of this genre.
+    decade : int, optional
+        Only movies released in this decade.
+    exclude : list (int), optional
+        MovieLens Movie IDs which may not appear.
+    filters : MovieFilter, optional
+        Genres and release years the movies must match, see
+        `utils.movie_filters.make_filter`.
+
+    Returns
+    -------
+    list (str)
+        Titles of the most popular movies.
+
+    """
+    titles = registry.get('title_index')
+    popularity = registry.get('popularity')
+    if filters is None:
+        movie_ids = popularity.top(top_n, genre=genre, decade=decade, exclude=exclude)
+    else:
+        ranked = popularity.by_rating
+        ranked = ranked[registry.get('movie_filters').mask_for(ranked, filters)]
+        if genre is not None or decade is not None:
+            ranked = ranked[np.isin(ranked, popularity.top(len(popularity.by_rating), genre=genre,
+                                                           decade=decade))]
+        if exclude is not None and len(exclude):
+            ranked = ranked[:top_n + len(exclude)]
+            ranked = ranked[~np.isin(ranked, exclude)]
+        movie_ids = ranked[:top_n]
+    return [titles.title(movie_id) for movie_id in movie_ids.tolist()]
+
+# Personalised top-N of every user, see `resources/models/export_user_topn.py`
+registry.register('user_topn', lambda: UserTopN(USER_TOPN_DIR))
+
+def user_recommendations(user_id, top_n=10):
+    """Precomputed personalised recommendations of a MovieLens user.
+
+    Parameters
+    ----------
+    user_id : int
+        A MovieLens user ID.
+    top_n : int
+        Number of recommendations, at most the exported number.
+
+    Returns
+    -------
+    list (str)
+        Titles of the user's top-n unseen movies.
+
+    """
+    table = registry.get('user_topn')
+    if table.is_stale():
+        # a new export was published; the old version stays readable until released
+        registry.unload('user_topn')
+        table = registry.get('user_topn')
+    if user_id not in table:
+        raise ValueError(f'User {user_id} has no precomputed recommendations')
+    with instrumentation.stage('lookup'):
+        movie_ids, _ = table.top(user_id, top_n)
+    titles = registry.get('title_index')
+    return [titles.title(movie_id) for movie_id in movie_ids.tolist()]
+
+def update_item_similarity(movie_ids, save_path=ITEM_SIMILARITY_PATH, k=50):
+    """Patch the item similarity store for movies with new ratings.
+
+    Only the rows of the given movies are recomputed, plus their entries
+    in the rows of other movies, see `update_topk_index`. Movies rated
+    for the first time are added to the store.
+
+    Parameters
+    ----------
+    movie_ids : list (int)
+        MovieLens Movie IDs whose ratings changed.
+    save_path : str
+        Location of the `.npz` store, which is rewritten.
+    k : int
+        Number of neighbours stored for each movie.
+
+    """
+    matrix_norm, item_ids, _ = titled_rating_matrix(normalised=True)
+    old, old_ids = load_index(save_path)
+    # Store positions follow the sorted movieIds, so new movies shift them
+    moved = pd.Index(item_ids).get_indexer(old_ids)
+    old = old.tocoo()
+    neighbours = sp.sparse.coo_matrix((old.data, (moved[old.row], moved[old.col])),
+                                      shape=(len(item_ids), len(item_ids)))
+    positions = pd.Index(item_ids).get_indexer(list(movie_ids))
+    neighbours = update_topk_index(neighbours, matrix_norm, positions[positions >= 0], k=k)
+    save_index(save_path, neighbours, item_ids)
+
+def update_svd_factors(new_ratings, metadata=None):
+    """Fold users and movies with new ratings into the SVD factors.
+
+    The complete rating history of every user in `new_ratings`, and of
+    every movie unknown to the model, is fitted against the frozen
+    factors of the other users and movies (see `fold_in`), and the result
+    is exported as a new version under `SVD_ARTIFACT_DIR`.
+
+    Parameters
+    ----------
+    new_ratings : Pandas DataFrame
+        Ratings received since the factors were last updated.
+    metadata : dict, optional
+        Extra fields recorded in the version's `metadata.json`.
+
+    Returns
+    -------
+    str
+        Directory of the new version.
+
+    """
+    factors = registry.get('svd_factors')
+    if is_quantised(factors):
+        # Folded in at full precision, as the model was trained
+        factors = _load_svd_factors(FULL_PRECISION)
+    ratings = registry.get('ratings')
+    new_items = pd.Index(new_ratings['movieId'].unique()).difference(factors['item_index'])
+    # Every user fitted needs their complete history, including the users
+    # who rated a new movie before this update; their histories hold
+    # every rating of the new movies
+    users = pd.Index(new_ratings['userId'].unique()).union(
+        ratings.loc[ratings['movieId'].isin(new_items), 'userId'].unique())
+    affected = ratings['userId'].isin(users)
+    updated = fold_in(factors, ratings.loc[affected, ['userId', 'movieId', 'rating']])
+    return export_factors(SVD_ARTIFACT_DIR, updated,
+                          {'incremental': True,
+                           'n_new_ratings': int(len(new_ratings)),
+                           'n_users': len(updated['user_index']),
+                           'n_items': len(updated['item_index']),
+                           **(metadata or {})})
+
+def factor_neighbours(seed_ids, k=10, filters=None):
+    """Find the movies closest to a set of seeds in SVD factor space.
+
+    The seeds' item factors are combined into one query vector, which
+    is searched for in the approximate nearest-neighbour index.
+
+    Parameters
+    ----------
+    seed_ids : list (int)
+        MovieLens Movie IDs of the seed movies.
+    k : int
+        Number of neighbours to return.
+    filters : MovieFilter, optional
+        Genres and release years the neighbours must match, see
+        `utils.movie_filters.make_filter`.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        Movie IDs of the neighbours, excluding the seeds, and their
+        cosine similarity to the query, most similar first.
+
+    """
+    index, item_ids = registry.get('factor_index')
+    query = _factor_query(seed_ids)
+    if query is None:
+        return item_ids[:0], np.empty(0, dtype=np.float32)
+    allowed = None
+    if filters is not None:
+        with instrumentation.stage('filter'):
+            allowed = registry.get('movie_filters').mask_for(item_ids, filters)
+    positions, scores = index.search(query, k, exclude=np.flatnonzero(np.isin(item_ids, seed_ids)),
+                                     allowed=allowed)
+    return item_ids[positions], scores
+
+def factor_similarity(seed_ids, movie_ids):
+    """Score given movies against a set of seeds in SVD factor space.
+
+    Parameters
+    ----------
+    seed_ids : list (int)
+        MovieLens Movie IDs of the seed movies.
+    movie_ids : list (int)
+        MovieLens Movie IDs of the movies to score.
+
+    Returns
+    -------
+    numpy.ndarray
+        Cosine similarity of each movie to the combined seeds, NaN for
+        movies outside the factor index. All NaN when no seed is known
+        to the SVD model.
+
+    """
+    scores = np.full(len(movie_ids), np.nan, dtype=np.float32)
+    query = _factor_query(seed_ids)
+    if query is None:
+        return scores
+    index, _ = registry.get('factor_index')
+    positions = registry.get('factor_positions').get_indexer(list(movie_ids))
+    known = positions >= 0
+    scores[known] = index.vectors[positions[known]] @ query
+    return scores
 
 def prediction_item(item_id):
     """Map a given favourite movie to users within the
@@ -62,14 +470,20 @@ def prediction_item(item_id):
         User IDs of users with similar high ratings for the given movie.
 
     """
-    # Data preprosessing
-    reader = Reader(rating_scale=(ratings_df['rating'].min(), ratings_df['rating'].max()))
-    load_df = Dataset.load_from_df(ratings_df,reader)
-    a_train = load_df.build_full_trainset()
+    # Model parameters are extracted once per process by the registry
+    factors = registry.get('svd_factors')
+    with instrumentation.stage('score'):
+        scores = score_items(factors, [item_id])[0]
 
+    # Same details as `SVD.predict`: every user is known, the item may not
+    # be, and only an unbiased SVD cannot estimate unknown items
+    if factors['biased'] or item_id in factors['item_index']:
+        details = {'was_impossible': False}
+    else:
+        details = {'was_impossible': True, 'reason': 'User and item are unknown.'}
     predictions = []
-    for ui in a_train.all_users():
-        predictions.append(model.predict(iid=item_id,uid=ui, verbose = False))
+    for uid, est in zip(factors['user_index'], scores):
+        predictions.append(Prediction(uid, item_id, None, est, dict(details)))
     return predictions
 
 def pred_movies(movie_list):
@@ -87,25 +501,80 @@ def pred_movies(movie_list):
         User-ID's of users with similar high ratings for each movie.
 
     """
-    # Store the id of users
-    id_store=[]
-    # For each movie selected by a user of the app,
-    # predict a corresponding user within the dataset with the highest rating
-    print('Iterating through the movie list')
-    for i in movie_list:
-        print('Prediction for movie',i)
-        predictions = prediction_item(item_id = i)
-        print('sorting the predictions')
-        predictions.sort(key=lambda x: x.est, reverse=True)
+    factors = registry.get('svd_factors')
+    # For each movie selected by a user of the app, predict the ratings of
+    # every user in the dataset with a single matrix product
+    with instrumentation.stage('score'):
+        scores = score_items(factors, movie_list)
         # Take the top 10 user id's from each movie with highest rankings
-        print('taking top 10 movies')
-        for pred in predictions[:10]:
-            id_store.append(pred.uid)
+        top_users = top_k(scores, 10)
     # Return a list of user id's
-    return id_store
+    return list(factors['user_index'][top_users.ravel()])
+
+def collab_recommendations(movie_list, top_n=10, filters=None):
+    """Collaborative filtering recommendations for a list of movies.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Titles of the seed movies.
+    top_n : int
+        Number of recommendations.
+    filters : MovieFilter, optional
+        Genres and release years the recommendations must match, see
+        `utils.movie_filters.make_filter`. Too few matching neighbours
+        are topped up with the most popular matching movies.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n recommendations, excluding the seeds.
+
+    """
+    titles = registry.get('title_index')
+    with instrumentation.stage('resolve'):
+        seed_ids = [movie_id for title in movie_list for movie_id in titles.resolve(title)]
+    if COLLAB_BACKEND == 'factors':
+        # Nearest neighbours of the combined seeds in SVD factor space
+        with instrumentation.stage('similarity'):
+            candidate_ids, _ = factor_neighbours(seed_ids, top_n + len(movie_list), filters)
+    else:
+        neighbours, item_ids = registry.get('item_similarity')
+        allowed = None
+        if filters is not None:
+            with instrumentation.stage('filter'):
+                allowed = registry.get('movie_filters').mask_for(item_ids, filters)
+        with instrumentation.stage('similarity'):
+            positions = pd.Series(np.arange(len(item_ids)), index=item_ids)
+            # Seed movies which have never been rated are unknown to the store
+            seeds = positions.reindex(seed_ids).dropna().astype(int).values
+            # Merging the precomputed neighbours of the seed movies
+            candidates, _ = merge_neighbours(neighbours, seeds, exclude=seeds, allowed=allowed)
+            candidate_ids = item_ids[candidates]
+
+    if len(candidate_ids) == 0:
+        # Cold start: none of the seeds has been rated
+        instrumentation.count('popularity_fallback')
+        with instrumentation.stage('rank'):
+            recommended_movies = popular_movies(top_n, exclude=seed_ids, filters=filters)
+    else:
+        with instrumentation.stage('rank'):
+            recommended_movies = [titles.title(movie_id) for movie_id in candidate_ids.tolist()]
+            recommended_movies = [title for title in recommended_movies if title not in movie_list]
+            recommended_movies=recommended_movies[0:top_n]
+            if filters is not None and len(recommended_movies) < top_n:
+                # Few neighbours match the filters: top up with popular matches
+                instrumentation.count('filter_popularity_fill')
+                shown = set(recommended_movies) | set(movie_list)
+                fill = popular_movies(top_n + len(shown), exclude=seed_ids, filters=filters)
+                recommended_movies += [title for title in fill if title not in shown]
+                recommended_movies = recommended_movies[:top_n]
+    return recommended_movies
 
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.  
+@cached_recommender(f'collaborative-{COLLAB_BACKEND}', COLLAB_ARTIFACTS[COLLAB_BACKEND],
+                    filtered=collab_recommendations, reload=COLLAB_ENTRIES)
 def collab_model(movie_list,top_n=10):
     """Performs Collaborative filtering based upon a list of movies supplied
        by the app user.
@@ -123,57 +592,4 @@ def collab_model(movie_list,top_n=10):
         Titles of the top-n movie recommendations to the user.
 
     """
-    #print('...merging tables')
-    #movies = pd.merge(ratings_df, movies_df,on='movieId',how='inner')
-    #movies = movies.sample(50000)
-    #Create pivot table
-    print('... Pivoting the merged table')
-    matrix = movies.pivot_table(index=['title'],columns=['userId'],values='rating')
-    print('... Normalizing the matrix')
-    matrix_norm = matrix.apply(lambda i: (i-np.mean(i))/(np.max(i)-np.min(i)), axis = 1)
-    # Fill missing values with zeros
-    print('...Fill missing values with zeros')
-    matrix_norm.fillna(0, inplace=True)
-    # Transpose the matrix
-    print('... Transpose the matrix')
-    matrix_norm = matrix_norm.T
-    matrix_norm = matrix_norm.loc[:,(matrix_norm !=0).any(axis=0)]
-    #Create a sparse matrix
-    print('... Create a sparse matrix')
-    matrix_sparse = sp.sparse.csr_matrix(matrix_norm.values)
-    # Calculate the cosine similarity matrix
-    print('Calculate the cosine similarity matrix')
-    similarity_score = cosine_similarity(matrix_sparse.T)
-    print('creating s simmar score data frame')
-    df_sim_movies = pd.DataFrame(similarity_score,index=matrix_norm.columns,columns=matrix_norm.columns)
-     
-    if movie_list[0] not in df_sim_movies.columns:
-        first_op = pd.DataFrame()
-    else:
-        first_op = pd.DataFrame(df_sim_movies[movie_list[0]])
-        first_op = first_op.reset_index()
-        first_op['similarity'] = first_op[movie_list[0]]
-        first_op = pd.DataFrame(first_op,columns=['title','similarity'])
-    if movie_list[1] not in df_sim_movies.columns:
-        second_op = pd.DataFrame()
-    else:
-        second_op = pd.DataFrame(df_sim_movies[movie_list[1]])
-        second_op = second_op.reset_index()
-        second_op['similarity'] = second_op[movie_list[1]]
-        second_op = pd.DataFrame(second_op,columns=['title','similarity'])
-    if movie_list[2] not in df_sim_movies.columns:
-        third_op = pd.DataFrame()
-    else:
-        third_op = pd.DataFrame(df_sim_movies[movie_list[2]])
-        third_op = third_op.reset_index()
-        third_op['similarity'] = third_op[movie_list[2]]
-        third_op = pd.DataFrame(third_op,columns=['title','similarity'])
-    options_movies = pd.concat([first_op,second_op,third_op])
-    if options_movies.empty:
-        reco = movies.groupby('title').mean().sort_values(by='rating', ascending=False).index[:top_n].to_list()
-        recommended_movies=random.sample(reco,top_n)
-    else:
-        recommended_movies = options_movies.sort_values('similarity',ascending=False)
-        recommended_movies = recommended_movies[~(recommended_movies['title'].isin(movie_list))]
-        recommended_movies=list(recommended_movies[0:top_n]['title'])
-    return recommended_movies
\ No newline at end of file
+    return collab_recommendations(movie_list, top_n)
\ No newline at end of file
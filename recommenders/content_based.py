@@ -1,112 +1,210 @@
-"""
-
-    Content-based filtering for item recommendation.
-
-    Author: Explore Data Science Academy.
-
-    Note:
-    ---------------------------------------------------------------------
-    Please follow the instructions provided within the README.md file
-    located within the root of this repository for guidance on how to use
-    this script correctly.
-
-    NB: You are required to extend this baseline algorithm to enable more
-    efficient and accurate computation of recommendations.
-
-    !! You must not change the name and signature (arguments) of the
-    prediction function, `content_model` !!
-
-    You must however change its contents (i.e. add your own content-based
-    filtering algorithm), as well as altering/adding any other functions
-    as part of your improvement.
-
-    ---------------------------------------------------------------------
-
-    Description: Provided within this file is a baseline content-based
-    filtering algorithm for rating predictions on Movie data.
-
-"""
-
-# Script dependencies
-import os
-import pandas as pd
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
-
-# Importing data
-movies = pd.read_csv('resources/data/movies.csv', sep = ',',delimiter=',')
-ratings = pd.read_csv('resources/data/ratings.csv')
-movies.dropna(inplace=True)
-
-def data_preprocessing(subset_size):
-    """Prepare data for use within Content filtering algorithm.
-
-    Parameters
-    ----------
-    subset_size : int
-        Number of movies to use within the algorithm.
-
-    Returns
-    -------
-    Pandas Dataframe
-        Subset of movies selected for content-based filtering.
-
-    """
-    # Split genre data into individual words.
-    movies['keyWords'] = movies['genres'].str.replace('|', ' ')
-    # Subset of the data
-    movies_subset = movies[:subset_size]
-    return movies_subset
-
-# !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
-# You are, however, encouraged to change its content.  
-def content_model(movie_list,top_n=10):
-    """Performs Content filtering based upon a list of movies supplied
-       by the app user.
-
-    Parameters
-    ----------
-    movie_list : list (str)
-        Favorite movies chosen by the app user.
-    top_n : type
-        Number of top recommendations to return to the user.
-
-    Returns
-    -------
-    list (str)
-        Titles of the top-n movie recommendations to the user.
-
-    """
-    # Initializing the empty list of recommended movies
-    recommended_movies = []
-    data = data_preprocessing(27000)
-    # Instantiating and generating the count matrix
-    count_vec = CountVectorizer()
-    count_matrix = count_vec.fit_transform(data['keyWords'])
-    indices = pd.Series(data['title'])
-    cosine_sim = cosine_similarity(count_matrix, count_matrix)
-    # Getting the index of the movie that matches the title
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-    # Creating a Series with the similarity scores in descending order
-    rank_1 = cosine_sim[idx_1]
-    rank_2 = cosine_sim[idx_2]
-    rank_3 = cosine_sim[idx_3]
-    # Calculating the scores
-    score_series_1 = pd.Series(rank_1).sort_values(ascending = False)
-    score_series_2 = pd.Series(rank_2).sort_values(ascending = False)
-    score_series_3 = pd.Series(rank_3).sort_values(ascending = False)
-    # Getting the indexes of the 10 most similar movies
-    listings = score_series_1.append(score_series_1).append(score_series_3).sort_values(ascending = False)
-
-    # Store movie names
-    recommended_movies = []
-    # Appending the names of movies
-    top_50_indexes = list(listings.iloc[1:50].index)
-    # Removing chosen movies
-    top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-    for i in top_indexes[:top_n]:
-        recommended_movies.append(list(movies['title'])[i])
-    return recommended_movies
+"""
+
+    Content-based filtering for item recommendation.
+
+    Author: Explore Data Science Academy.
+
+    Note:
+    ---------------------------------------------------------------------
+    Please follow the instructions provided within the README.md file
+    located within the root of this repository for guidance on how to use
+    this script correctly.
+
+    NB: You are required to extend this baseline algorithm to enable more
+    efficient and accurate computation of recommendations.
+
+    !! You must not change the name and signature (arguments) of the
+    prediction function, `content_model` !!
+
+    You must however change its contents (i.e. add your own content-based
+    filtering algorithm), as well as altering/adding any other functions
+    as part of your improvement.
+
+    ---------------------------------------------------------------------
+
+    Description: Provided within this file is a baseline content-based
+    filtering algorithm for rating predictions on Movie data.
+
+"""
+
+# Script dependencies
+import os
+import pandas as pd
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+from utils import registry, instrumentation
+from utils.result_cache import cached_recommender
+from utils.feature_store import FEATURE_STORE_DIR, FeatureStore, build_feature_store, missing_blocks
+from utils.neighbour_index import build_topk_index, save_index, load_index, fuse_neighbours
+from utils.quantisation import resolve_path, fingerprint_paths
+# Registers the 'movie_filters' artifact
+import utils.movie_filters
+
+# Precomputed top-k content neighbour index, see `build_content_index`
+CONTENT_INDEX_PATH = 'resources/models/content_index.npz'
+# How the similarities to several seed movies are combined, see
+# `utils.neighbour_index.fuse_neighbours`
+FUSION_METHOD = 'sum'
+# Registry entries loaded from each file the recommendations are
+# computed from, reloaded when it changes
+CONTENT_ENTRIES = {**dict.fromkeys(fingerprint_paths(CONTENT_INDEX_PATH),
+                                   ['content_index', 'content_positions', 'content_features']),
+                   registry.MOVIES_PATH: registry.DATASET_ENTRIES[registry.MOVIES_PATH]}
+
+def data_preprocessing(subset_size):
+    """Prepare data for use within Content filtering algorithm.
+
+    Parameters
+    ----------
+    subset_size : int
+        Number of movies to use within the algorithm.
+
+    Returns
+    -------
+    Pandas Dataframe
+        Subset of movies selected for content-based filtering.
+
+    """
+    movies = registry.get('movies')
+    # Subset of the data
+    movies_subset = movies[:subset_size].copy()
+    # Split genre data into individual words.
+    movies_subset['keyWords'] = movies_subset['genres'].str.replace('|', ' ')
+    return movies_subset
+
+def build_content_index(save_path=CONTENT_INDEX_PATH, k=50, store_dir=FEATURE_STORE_DIR):
+    """Build the top-k content neighbour index over the full movie catalogue.
+
+    Movies are compared on the combined blocks of the feature store
+    (genres, tags, title words and release year), and any missing
+    block is built first.
+
+    Parameters
+    ----------
+    save_path : str
+        Location to write the `.npz` index file.
+    k : int
+        Number of neighbours stored for each movie.
+    store_dir : str
+        Directory of the feature store.
+
+    """
+    movies = registry.get('movies')
+    build_feature_store(movies, store_dir, missing_blocks(movies, store_dir))
+    store = FeatureStore(store_dir)
+    print('... Building the content neighbour index')
+    with instrumentation.stage('similarity'):
+        neighbours = build_topk_index(store.matrix(), k=k)
+    save_index(save_path, neighbours, store.item_ids)
+
+def _load_content_index():
+    # Build the index on first use if the offline step has not been run
+    if not os.path.exists(CONTENT_INDEX_PATH):
+        build_content_index(CONTENT_INDEX_PATH)
+    # A reduced-precision variant when one was exported, see `utils.quantisation`
+    return load_index(resolve_path(CONTENT_INDEX_PATH))
+
+registry.register('content_index', _load_content_index)
+# movieId -> index position lookup, hashed once per process
+registry.register('content_positions', lambda: pd.Index(registry.get('content_index')[1]))
+
+def _load_content_features():
+    # Unit-length feature rows in index order, to score filtered queries exactly
+    store = FeatureStore(FEATURE_STORE_DIR)
+    rows = pd.Index(store.item_ids).get_indexer(registry.get('content_index')[1])
+    return normalize(store.matrix(), norm='l2', axis=1)[rows]
+
+registry.register('content_features', _load_content_features)
+
+def _score_allowed(allowed, seeds, seed_weights, method, top_n):
+    # Exact similarity of every allowed movie to the seeds, best first
+    candidates = np.flatnonzero(allowed)
+    candidates = candidates[~np.isin(candidates, seeds)]
+    features = registry.get('content_features')
+    scores = (features[candidates] @ features[seeds].T).toarray()
+    if method == 'sum':
+        scores = scores @ seed_weights
+    else:
+        scores = (scores * seed_weights).max(axis=1, initial=0)
+    order = np.lexsort((candidates, -scores))[:top_n]
+    return candidates[order]
+
+def similar_movies(movie_list, top_n=10, weights=None, method=FUSION_METHOD, filters=None):
+    """Movies most similar in content to any number of seed movies.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Titles of the seed movies.
+    top_n : int
+        Number of recommendations.
+    weights : list (float), optional
+        Weight of each seed movie, in the order of `movie_list`. Seeds
+        count equally when omitted.
+    method : str
+        'sum' or 'max' fusion of the seeds' similarity scores.
+    filters : MovieFilter, optional
+        Genres and release years the recommendations must match, see
+        `utils.movie_filters.make_filter`.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n recommendations, excluding the seeds.
+
+    """
+    titles = registry.get('title_index')
+    neighbours, item_ids = registry.get('content_index')
+    if weights is None:
+        weights = np.ones(len(movie_list))
+    with instrumentation.stage('resolve'):
+        matches = [titles.resolve(title) for title in movie_list]
+        counts = np.array([len(ids) for ids in matches])
+        seeds = registry.get('content_positions').get_indexer(
+            [movie_id for ids in matches for movie_id in ids])
+    # A title listed more than once in the catalogue shares its weight
+    seed_weights = np.repeat(np.asarray(weights, dtype=np.float64) / np.maximum(counts, 1), counts)
+    seed_weights = seed_weights[seeds >= 0]
+    seeds = seeds[seeds >= 0]
+    if len(seeds) == 0:
+        raise ValueError(f'None of the movies {movie_list} are in the catalogue')
+    allowed = None
+    if filters is not None:
+        with instrumentation.stage('filter'):
+            allowed = registry.get('movie_filters').mask_for(item_ids, filters)
+    with instrumentation.stage('similarity'):
+        candidates, _ = fuse_neighbours(neighbours, seeds, seed_weights, method=method,
+                                        k=top_n, exclude=seeds, allowed=allowed)
+        if allowed is not None and len(candidates) < top_n:
+            # Too few of the stored neighbours match: score every match
+            instrumentation.count('filter_exact_scoring')
+            candidates = _score_allowed(allowed, seeds, seed_weights, method, top_n)
+    with instrumentation.stage('rank'):
+        return [titles.title(movie_id) for movie_id in item_ids[candidates].tolist()]
+
+# !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
+# You are, however, encouraged to change its content.  
+@cached_recommender('content', [*fingerprint_paths(CONTENT_INDEX_PATH), registry.MOVIES_PATH],
+                    filtered=similar_movies, reload=CONTENT_ENTRIES)
+def content_model(movie_list,top_n=10):
+    """Performs Content filtering based upon a list of movies supplied
+       by the app user.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : type
+        Number of top recommendations to return to the user.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    """
+    # Fusing the precomputed neighbours of every chosen movie,
+    # excluding the chosen movies themselves
+    return similar_movies(movie_list, top_n)
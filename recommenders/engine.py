@@ -0,0 +1,181 @@
+"""
+
+    Recommendation engines.
+
+    Author: Explore Data Science Academy.
+
+    Description: A common interface over the recommender algorithms, so
+    that callers such as the Streamlit app do not need to know whether
+    recommendations are computed in-process or by the HTTP recommendation
+    API (see `recommenders/api.py`). Both engines expose:
+
+        recommend(algorithm, movie_list, top_n)
+        recommend_batch(algorithm, seed_lists, top_n)
+        recommend_user(user_id, top_n)
+
+    `get_engine` returns an HTTP engine when the `RECOMMENDER_API_URL`
+    environment variable is set, and the in-process engine otherwise.
+
+"""
+# Script dependencies
+import os
+import json
+import urllib.error
+import urllib.request
+
+def _algorithms():
+    # Imported lazily so that an HTTP-only client never loads the models
+    from recommenders.content_based import content_model
+    from recommenders.collaborative_based import collab_model
+    from recommenders.hybrid_based import hybrid_model
+    return {'content': content_model,
+            'collaborative': collab_model,
+            'hybrid': hybrid_model}
+
+ALGORITHMS = ('content', 'collaborative', 'hybrid')
+
+class LocalEngine:
+    """Computes recommendations in the current process."""
+
+    def warm_up(self):
+        """Load the algorithms and their model artifacts ahead of traffic."""
+        from utils import registry
+        from recommenders.collaborative_based import COLLAB_BACKEND, svd_available
+        _algorithms()
+        collaborative = 'factor_index' if COLLAB_BACKEND == 'factors' else 'item_similarity'
+        for name in ('movies', 'title_index', 'content_index', 'content_positions', collaborative):
+            registry.get(name)
+        if svd_available():
+            # Used by the hybrid recommender
+            for name in ('factor_index', 'factor_positions'):
+                registry.get(name)
+
+    def recommend(self, algorithm, movie_list, top_n=10, filters=None):
+        """Top-n recommendations for one list of seed movies.
+
+        Parameters
+        ----------
+        algorithm : str
+            One of `ALGORITHMS`.
+        movie_list : list (str)
+            Favourite movie titles.
+        top_n : int
+            Number of recommendations.
+        filters : MovieFilter, optional
+            Genres and release years the recommendations must match, see
+            `utils.movie_filters.make_filter`.
+
+        Returns
+        -------
+        list (str)
+            Recommended movie titles.
+
+        """
+        from utils import instrumentation
+        algorithms = _algorithms()
+        if algorithm not in algorithms:
+            raise ValueError(f"Unknown algorithm '{algorithm}'")
+        options = {} if filters is None else {'filters': filters}
+        with instrumentation.request(algorithm, movie_list, top_n):
+            return algorithms[algorithm](movie_list=list(movie_list), top_n=top_n, **options)
+
+    def recommend_batch(self, algorithm, seed_lists, top_n=10):
+        """Top-n recommendations for many lists of seed movies.
+
+        Returns
+        -------
+        list
+            One list of titles per seed list, or `None` for seed lists
+            none of whose movies are in the catalogue.
+
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown algorithm '{algorithm}'")
+        results = []
+        for movie_list in seed_lists:
+            try:
+                results.append(self.recommend(algorithm, movie_list, top_n))
+            except ValueError:
+                results.append(None)
+        return results
+
+    def recommend_user(self, user_id, top_n=10):
+        """Precomputed top-n recommendations of a MovieLens user.
+
+        Raises
+        ------
+        ValueError
+            When the user has no exported recommendations.
+
+        """
+        from utils import instrumentation
+        from recommenders.collaborative_based import user_recommendations
+        with instrumentation.request('user', [], top_n):
+            return user_recommendations(user_id, top_n)
+
+class HttpEngine:
+    """Fetches recommendations from a running recommendation API.
+
+    Parameters
+    ----------
+    base_url : str
+        Root URL of the API, e.g. "http://localhost:8000".
+    timeout : float
+        Seconds to wait for a response.
+
+    """
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def _post(self, path, payload):
+        request = urllib.request.Request(self.base_url + path,
+                                         data=json.dumps(payload).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'},
+                                         method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            # Proxies and gateways answer errors with HTML or plain text
+            try:
+                message = json.loads(error.read()).get('error', error.reason)
+            except (ValueError, AttributeError):
+                message = error.reason
+            if error.code == 400:
+                raise ValueError(message) from error
+            raise RuntimeError(f'Recommendation API error {error.code}: {message}') from error
+
+    def recommend(self, algorithm, movie_list, top_n=10, filters=None):
+        """Top-n recommendations for one list of seed movies."""
+        payload = {'movies': list(movie_list), 'top_n': top_n}
+        if filters is not None:
+            payload['filters'] = {'genres': list(filters.genres), 'year_from': filters.year_from,
+                                  'year_to': filters.year_to}
+        response = self._post(f'/recommend/{algorithm}', payload)
+        return response['recommendations']
+
+    def recommend_batch(self, algorithm, seed_lists, top_n=10):
+        """Top-n recommendations for many lists of seed movies.
+
+        Failed seed lists yield `None`, as for `LocalEngine`.
+
+        """
+        response = self._post('/recommend/batch',
+                              {'algorithm': algorithm,
+                               'top_n': top_n,
+                               'requests': [{'movies': list(movie_list)} for movie_list in seed_lists]})
+        return [result.get('recommendations') for result in response['results']]
+
+    def recommend_user(self, user_id, top_n=10):
+        """Precomputed top-n recommendations of a MovieLens user."""
+        response = self._post('/recommend/user', {'user_id': user_id, 'top_n': top_n})
+        return response['recommendations']
+
+def get_engine():
+    """The engine selected by the `RECOMMENDER_API_URL` environment variable."""
+    base_url = os.environ.get('RECOMMENDER_API_URL')
+    if base_url:
+        return HttpEngine(base_url)
+    return LocalEngine()
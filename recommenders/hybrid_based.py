@@ -0,0 +1,138 @@
+"""
+
+    Hybrid content and collaborative filtering for item recommendation.
+
+    Author: Explore Data Science Academy.
+
+    Description: Recommends movies in a single candidate-generation and
+    rerank pass. Candidates are retrieved from both the content neighbour
+    index and the SVD item factors; every candidate is then scored by
+    both models, each score is rescaled to [0, 1] over the candidates,
+    and the two are blended with tunable weights. When none of the seed
+    movies is known to the collaborative model (or no SVD model has been
+    trained), the ranking falls back to content similarity alone.
+    Genre and release year filters are applied to the candidates of
+    both models before reranking, and the most popular matching movies
+    top up a short list.
+
+"""
+# Script dependencies
+import os
+import pandas as pd
+import numpy as np
+from utils import registry, instrumentation
+from utils.result_cache import cached_recommender
+from utils.neighbour_index import fuse_neighbours
+from utils.quantisation import fingerprint_paths
+from utils.popularity import POPULARITY_PATH
+from recommenders.content_based import CONTENT_INDEX_PATH, CONTENT_ENTRIES, FUSION_METHOD
+from recommenders.collaborative_based import (SVD_ARTIFACT_DIR, COLLAB_ENTRIES, svd_available,
+                                              popular_movies, factor_neighbours, factor_similarity)
+
+# Relative weight of each model in the blended score
+CONTENT_WEIGHT = 0.5
+COLLABORATIVE_WEIGHT = 0.5
+# Candidates retrieved from each model before reranking
+N_CANDIDATES = 100
+
+def _rescale(scores):
+    # Non-negative scores divided by their maximum, so both models share [0, 1]
+    scores = np.clip(np.nan_to_num(scores, nan=0.0), 0, None)
+    top = scores.max() if len(scores) else 0
+    return scores / top if top > 0 else scores
+
+def hybrid_recommendations(movie_list, top_n=10, content_weight=CONTENT_WEIGHT,
+                           collaborative_weight=COLLABORATIVE_WEIGHT, n_candidates=N_CANDIDATES,
+                           filters=None):
+    """Blend content and collaborative similarity to the seed movies.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Titles of the seed movies.
+    top_n : int
+        Number of recommendations.
+    content_weight : float
+        Weight of the content similarity in the blended score.
+    collaborative_weight : float
+        Weight of the SVD factor similarity in the blended score.
+    n_candidates : int
+        Number of candidates retrieved from each model.
+    filters : MovieFilter, optional
+        Genres and release years the recommendations must match, see
+        `utils.movie_filters.make_filter`.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n recommendations, excluding the seeds.
+
+    """
+    titles = registry.get('title_index')
+    neighbours, item_ids = registry.get('content_index')
+    with instrumentation.stage('resolve'):
+        seed_ids = [movie_id for title in movie_list for movie_id in titles.resolve(title)]
+        seeds = registry.get('content_positions').get_indexer(seed_ids)
+    seeds = seeds[seeds >= 0]
+    if len(seeds) == 0:
+        raise ValueError(f'None of the movies {movie_list} are in the catalogue')
+
+    allowed = None
+    if filters is not None:
+        with instrumentation.stage('filter'):
+            allowed = registry.get('movie_filters').mask_for(item_ids, filters)
+
+    # Candidate generation from both models
+    with instrumentation.stage('similarity'):
+        positions, content_scores = fuse_neighbours(neighbours, seeds, method=FUSION_METHOD,
+                                                    exclude=seeds, allowed=allowed)
+        content_ids = item_ids[positions]
+        collaborative_ids = np.empty(0, dtype=content_ids.dtype)
+        if svd_available() and collaborative_weight > 0:
+            collaborative_ids, _ = factor_neighbours(seed_ids, n_candidates, filters)
+        candidates = pd.unique(np.concatenate([content_ids[:n_candidates], collaborative_ids]))
+
+    # Rerank every candidate on both models
+    with instrumentation.stage('rank'):
+        content = pd.Series(content_scores, index=content_ids).reindex(candidates).to_numpy()
+        if len(collaborative_ids):
+            collaborative = factor_similarity(seed_ids, candidates)
+        else:
+            # No seed is known to the collaborative model: content only
+            instrumentation.count('content_only')
+            collaborative = np.zeros(len(candidates))
+        blended = content_weight * _rescale(content) + collaborative_weight * _rescale(collaborative)
+        # Ties keep the retrieval order, content candidates first
+        order = np.argsort(-blended, kind='stable')[:top_n]
+        recommended = [titles.title(movie_id) for movie_id in candidates[order].tolist()]
+        if filters is not None and len(recommended) < top_n:
+            # Few neighbours match the filters: top up with popular matches
+            instrumentation.count('filter_popularity_fill')
+            fill = popular_movies(top_n, exclude=[*seed_ids, *candidates.tolist()],
+                                  filters=filters)
+            recommended = (recommended + fill)[:top_n]
+        return recommended
+
+@cached_recommender('hybrid', [*fingerprint_paths(CONTENT_INDEX_PATH), registry.SVD_MODEL_PATH,
+                               os.path.join(SVD_ARTIFACT_DIR, 'LATEST'), POPULARITY_PATH,
+                               registry.MOVIES_PATH, registry.RATINGS_PATH,
+                               registry.RATINGS_DELTA_PATH],
+                    filtered=hybrid_recommendations, reload={**COLLAB_ENTRIES, **CONTENT_ENTRIES})
+def hybrid_model(movie_list, top_n=10):
+    """Performs hybrid filtering based upon a list of movies supplied
+       by the app user.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of top recommendations to return to the user.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    """
+    return hybrid_recommendations(movie_list, top_n)
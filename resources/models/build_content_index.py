@@ -0,0 +1,24 @@
+"""
+
+    Content-based neighbour index builder.
+
+    Author: Explore Data Science Academy.
+
+    Description: Simple script to precompute the top-k content neighbour
+    index used by `recommenders.content_based.content_model`, building
+    any missing block of the item feature store first. Run from the root
+    of the repository:
+
+        python resources/models/build_content_index.py
+
+"""
+# Script dependencies
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from recommenders.content_based import build_content_index, CONTENT_INDEX_PATH
+
+if __name__ == '__main__':
+    build_content_index(CONTENT_INDEX_PATH)
+    print(f"Index built. Saved to: {CONTENT_INDEX_PATH}")
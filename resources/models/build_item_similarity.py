@@ -0,0 +1,23 @@
+"""
+
+    Collaborative item-item similarity store builder.
+
+    Author: Explore Data Science Academy.
+
+    Description: Simple script to precompute the top-k item-item
+    similarity store used by `recommenders.collaborative_based.collab_model`.
+    Run from the root of the repository:
+
+        python resources/models/build_item_similarity.py
+
+"""
+# Script dependencies
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from recommenders.collaborative_based import build_item_similarity, ITEM_SIMILARITY_PATH
+
+if __name__ == '__main__':
+    build_item_similarity(ITEM_SIMILARITY_PATH)
+    print(f"Similarity store built. Saved to: {ITEM_SIMILARITY_PATH}")
@@ -0,0 +1,249 @@
+"""
+
+    Offline recommendation quality evaluation.
+
+    Author: Explore Data Science Academy.
+
+    Description: Measures the quality and speed of every recommender on
+    held-out ratings. Each user's most recent ratings (or a random share
+    of them) are held out; the collaborative artifacts (item similarity
+    store, SVD factors and popularity table) are rebuilt from the
+    remaining training ratings only, in a scratch directory. Then, on a
+    process pool, chunks of test users are given:
+
+        - by each app algorithm (content, collaborative, hybrid), the
+          recommendations for their top-rated training movies as seeds,
+          exactly as the app would compute them,
+        - by the SVD model, their highest-scoring unrated movies, and
+          predictions of their held-out ratings.
+
+    Precision, recall, NDCG and MAP at k, catalogue coverage, RMSE/MAE
+    (SVD) and the compute time per user are reported, and written as
+    JSON with `--output`, so that a faster engine can be compared with
+    the current one before shipping it. See `utils.evaluation` for the
+    metrics. Run from the root of the repository:
+
+        python resources/models/evaluate.py --workers 4 --output evaluation.json
+
+"""
+# Script dependencies
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, ROOT)
+
+# Data handling dependencies
+import numpy as np
+import pandas as pd
+import surprise
+from surprise import SVD
+
+from utils import registry
+from utils.evaluation import split_ratings, ranking_metrics, coverage, rating_errors
+from utils.svd_scoring import extract_factors, export_factors, score_items, predict_ratings, top_k
+from utils.user_topn import rated_mask
+import recommenders.engine as engine
+import recommenders.collaborative_based as collaborative_based
+
+ALGORITHMS = engine.ALGORITHMS + ('svd',)
+
+# Training ratings of the users of one worker process, as a sparse
+# user x item mask in SVD factor order
+_train_mask = None
+
+def _configure(work_dir):
+    # Point the collaborative artifacts at the training split
+    registry.RATINGS_PATH = os.path.join(work_dir, 'ratings.csv')
+    registry.RATINGS_DELTA_PATH = os.path.join(work_dir, 'ratings_delta.csv')
+    registry.MERGED_RATINGS_PATH = os.path.join(work_dir, 'df_new.csv')
+    registry.SVD_MODEL_PATH = os.path.join(work_dir, 'SVD.pkl')
+    collaborative_based.ITEM_SIMILARITY_PATH = os.path.join(work_dir, 'item_similarity.npz')
+    collaborative_based.SVD_ARTIFACT_DIR = os.path.join(work_dir, 'svd')
+    collaborative_based.POPULARITY_PATH = os.path.join(work_dir, 'popularity.npz')
+    registry.unload()
+
+def prepare(work_dir, train, svd_params, seed=0):
+    """Build the collaborative artifacts from the training ratings."""
+    os.makedirs(work_dir, exist_ok=True)
+    train.to_csv(os.path.join(work_dir, 'ratings.csv'), index=False)
+    _configure(work_dir)
+    collaborative_based.build_item_similarity(collaborative_based.ITEM_SIMILARITY_PATH)
+    collaborative_based.build_popularity_table(collaborative_based.POPULARITY_PATH)
+    print(f'... Training the SVD model with {svd_params}')
+    ratings = train[['userId', 'movieId', 'rating']]
+    reader = surprise.Reader(rating_scale=(ratings['rating'].min(), ratings['rating'].max()))
+    model = SVD(random_state=seed, **svd_params)
+    model.fit(surprise.Dataset.load_from_df(ratings, reader).build_full_trainset())
+    export_factors(collaborative_based.SVD_ARTIFACT_DIR, extract_factors(model),
+                   {'params': svd_params, 'n_ratings': int(len(ratings))})
+
+def seed_titles(train, users, n_seeds=3):
+    """Each user's top-rated (then most recent) training movies, as titles."""
+    titles = registry.get('title_index')
+    top = (train[train['userId'].isin(users) & train['movieId'].isin(titles.movie_ids)]
+           .sort_values(['userId', 'rating', 'timestamp'], ascending=[True, False, False])
+           .groupby('userId', sort=False).head(n_seeds))
+    seeds = top.groupby('userId')['movieId'].agg(list).reindex(users)
+    return [[titles.title(movie_id) for movie_id in movie_ids] if isinstance(movie_ids, list) else []
+            for movie_ids in seeds]
+
+def _init_worker(work_dir):
+    global _train_mask
+    _configure(work_dir)
+    engine.LocalEngine().warm_up()
+    _train_mask = rated_mask(registry.get('svd_factors'), registry.get('ratings'))
+
+def _recommend_titles(algorithm, seed_lists, k):
+    # The app's recommender, without the result caches
+    recommender = engine._algorithms()[algorithm].__wrapped__
+    titles = registry.get('title_index')
+    recommended = np.full((len(seed_lists), k), -1, dtype=np.int64)
+    for row, seeds in enumerate(seed_lists):
+        if not seeds:
+            continue
+        try:
+            result = recommender(sorted(set(seeds)), k)
+        except ValueError:
+            continue
+        movie_ids = [titles.lookup(title)[0] for title in result[:k] if title in titles]
+        recommended[row, :len(movie_ids)] = movie_ids
+    return recommended
+
+def _recommend_svd(users, k):
+    # Highest estimated ratings among each user's unrated movies
+    factors = registry.get('svd_factors')
+    scores = score_items(factors, factors['item_index'], users).T
+    rows = factors['user_index'].get_indexer(users)
+    mask = _train_mask[np.maximum(rows, 0)].toarray() & (rows >= 0)[:, None]
+    scores[mask] = -np.inf
+    return np.asarray(factors['item_index'])[top_k(scores, k)]
+
+def evaluate_chunk(users, seed_lists, test_pairs, algorithms, k):
+    """Recommendations of every algorithm for a chunk of test users.
+
+    Returns
+    -------
+    dict
+        Per algorithm, the (users x k) recommended movie IDs and the
+        seconds spent computing them, and the SVD predictions of the
+        held-out ratings in `test_pairs`.
+
+    """
+    results = {}
+    for algorithm in algorithms:
+        start = time.perf_counter()
+        if algorithm == 'svd':
+            recommended = _recommend_svd(users, k)
+        else:
+            recommended = _recommend_titles(algorithm, seed_lists, k)
+        results[algorithm] = (recommended, time.perf_counter() - start)
+    if 'svd' in algorithms:
+        results['predictions'] = predict_ratings(registry.get('svd_factors'),
+                                                 test_pairs[0], test_pairs[1])
+    return results
+
+def evaluate(ratings, movies, k=10, threshold=4.0, split='time', test_fraction=0.2,
+             min_ratings=5, n_seeds=3, n_users=None, algorithms=ALGORITHMS,
+             svd_params=None, workers=None, chunk_size=64, work_dir=None, seed=0):
+    """Evaluate the recommenders on held-out ratings.
+
+    Returns
+    -------
+    dict
+        The evaluation settings and, per algorithm, its metrics and
+        compute time per user.
+
+    """
+    svd_params = svd_params or {'n_factors': 100, 'n_epochs': 20}
+    train, test = split_ratings(ratings, test_fraction, split, min_ratings, seed)
+    users = np.sort(test['userId'].unique())
+    if n_users is not None and n_users < len(users):
+        users = np.sort(np.random.default_rng(seed).choice(users, n_users, replace=False))
+    test = test[test['userId'].isin(users)]
+    print(f'... {len(train)} training and {len(test)} held-out ratings of {len(users)} users')
+
+    scratch = work_dir or tempfile.mkdtemp(prefix='evaluation-')
+    try:
+        start = time.perf_counter()
+        prepare(scratch, train, svd_params, seed)
+        prepare_seconds = time.perf_counter() - start
+        seeds = seed_titles(train, users, n_seeds)
+        chunks = [slice(i, i + chunk_size) for i in range(0, len(users), chunk_size)]
+        test_by_user = test.set_index('userId')
+        print(f'... Evaluating {len(chunks)} chunks of users')
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(scratch,)) as pool:
+            futures = []
+            for chunk in chunks:
+                pairs = test_by_user.loc[users[chunk], 'movieId']
+                futures.append(pool.submit(evaluate_chunk, users[chunk], seeds[chunk],
+                                           (pairs.index.to_numpy(), pairs.to_numpy()),
+                                           algorithms, k))
+            results = [future.result() for future in futures]
+    finally:
+        if work_dir is None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {'settings': {'k': k, 'threshold': threshold, 'split': split,
+                           'test_fraction': test_fraction, 'min_ratings': min_ratings,
+                           'seeds': n_seeds, 'users': int(len(users)),
+                           'train_ratings': int(len(train)), 'test_ratings': int(len(test)),
+                           'svd_params': svd_params, 'prepare_seconds': prepare_seconds},
+              'algorithms': {}}
+    for algorithm in algorithms:
+        recommended = np.vstack([result[algorithm][0] for result in results])
+        seconds = sum(result[algorithm][1] for result in results)
+        metrics = ranking_metrics(recommended, users, test, k, threshold)
+        metrics['coverage'] = coverage(recommended, len(movies))
+        metrics['ms_per_user'] = seconds / len(users) * 1000
+        if algorithm == 'svd':
+            # Chunks are in user order, as is `test_by_user`
+            predictions = np.concatenate([result['predictions'] for result in results])
+            metrics.update(rating_errors(predictions, test_by_user.loc[users, 'rating']))
+        report['algorithms'][algorithm] = metrics
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate the recommenders on held-out ratings.')
+    parser.add_argument('-k', type=int, default=10, help='cut-off rank of the metrics')
+    parser.add_argument('--threshold', type=float, default=4.0,
+                        help='minimum held-out rating of a relevant movie')
+    parser.add_argument('--split', choices=('time', 'random'), default='time')
+    parser.add_argument('--test-fraction', type=float, default=0.2)
+    parser.add_argument('--min-ratings', type=int, default=5)
+    parser.add_argument('--seeds', type=int, default=3, help='seed movies per user')
+    parser.add_argument('--users', type=int, help='evaluate a random sample of test users')
+    parser.add_argument('--algorithms', nargs='+', default=list(ALGORITHMS), choices=ALGORITHMS)
+    parser.add_argument('--n-factors', type=int, default=100)
+    parser.add_argument('--n-epochs', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=64)
+    parser.add_argument('--work-dir', help='keep the training artifacts in this directory')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args()
+
+    ratings = registry.get('ratings')
+    movies = registry.get('movies')
+    report = evaluate(ratings, movies, args.k, args.threshold, args.split, args.test_fraction,
+                      args.min_ratings, args.seeds, args.users, tuple(args.algorithms),
+                      {'n_factors': args.n_factors, 'n_epochs': args.n_epochs},
+                      args.workers, args.chunk_size, args.work_dir, args.seed)
+
+    columns = ['users', 'precision', 'recall', 'ndcg', 'map', 'coverage', 'rmse', 'mae', 'ms_per_user']
+    table = pd.DataFrame(report['algorithms']).T.reindex(columns=columns)
+    print(table.to_string(float_format=lambda value: f'{value:.4f}'))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Evaluation written to: {args.output}")
+
+if __name__ == '__main__':
+    main()
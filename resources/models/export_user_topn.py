@@ -0,0 +1,52 @@
+"""
+
+    Personalised top-N export.
+
+    Author: Explore Data Science Academy.
+
+    Description: Batch job computing, with the current SVD model, the
+    top-N unseen movies of every user in the ratings, sharded across a
+    process pool (see `utils.user_topn`). The result is a memory-mapped
+    table served by `collaborative_based.user_recommendations` and the
+    API's `POST /recommend/user` endpoint. Run from the root of the
+    repository, after every model update:
+
+        python resources/models/export_user_topn.py --top-n 50 --workers 4
+
+"""
+# Script dependencies
+import os
+import sys
+import argparse
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, ROOT)
+
+from utils import registry
+from utils.svd_scoring import latest_factors_path
+from utils.user_topn import USER_TOPN_DIR, export_user_topn
+import recommenders.collaborative_based as collaborative_based
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the top-N movies of every user.')
+    parser.add_argument('--top-n', type=int, default=50)
+    parser.add_argument('--block-size', type=int, default=512, help='users per matrix product')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output-dir', default=USER_TOPN_DIR)
+    args = parser.parse_args()
+
+    factors = registry.get('svd_factors')
+    ratings = registry.get('ratings')
+    missing = ratings.loc[~ratings['userId'].isin(factors['user_index']), 'userId'].nunique()
+    if missing:
+        print(f'... {missing} users are unknown to the model; run update_models.py update first')
+    print(f"... Scoring {len(factors['user_index'])} users against {len(factors['item_index'])} movies")
+    source = latest_factors_path(collaborative_based.SVD_ARTIFACT_DIR) or registry.SVD_MODEL_PATH
+    version_dir = export_user_topn(factors, ratings, args.output_dir, args.top_n,
+                                   allowed_items=registry.get('movies')['movieId'],
+                                   block_size=args.block_size, workers=args.workers,
+                                   metadata={'model': source})
+    print(f"Recommendations exported. Saved to: {version_dir}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+
+    Recommendation pre-rendering job.
+
+    Author: Explore Data Science Academy.
+
+    Description: Recommendations are a pure function of the seed set, so
+    those of the most common requests can be computed ahead of time. This
+    job takes the most rated movies of the popularity table, enumerates
+    every combination of up to three of them (the app asks for three
+    favourites; repeated choices collapse to fewer seeds) and computes
+    the top-n recommendations of every algorithm for each combination on
+    a process pool. The results are written to the pre-rendered store
+    (see `utils.result_cache.PrerenderedResults`), which the recommenders
+    consult before running any model.
+
+    Entries are keyed by model version, so the job should be re-run
+    whenever a model is rebuilt, e.g. right after a deploy:
+
+        python resources/models/prerender.py --movies 20 --workers 4
+
+"""
+# Script dependencies
+import os
+import sys
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, ROOT)
+
+from utils import registry
+from utils.result_cache import RecommendationCache, PrerenderedResults, model_version, prerendered_results
+import recommenders.engine as engine
+# Registers the popularity table
+import recommenders.collaborative_based
+
+# Seed combinations computed by one task
+CHUNK_SIZE = 200
+
+def popular_titles(n):
+    """Titles of the `n` most rated movies."""
+    titles = registry.get('title_index')
+    return [titles.title(movie_id) for movie_id in registry.get('popularity').by_count[:n].tolist()]
+
+def seed_combinations(titles, max_seeds=3):
+    """Every combination of one to `max_seeds` of the titles."""
+    for size in range(1, max_seeds + 1):
+        yield from itertools.combinations(sorted(titles), size)
+
+def _init_worker():
+    # Each worker loads the models once (a no-op when forked after warm-up)
+    engine.LocalEngine().warm_up()
+
+def render(algorithm, seed_lists, top_n):
+    """Compute recommendations bypassing the caches.
+
+    Returns
+    -------
+    list
+        One list of titles per seed list, or `None` for seed lists none
+        of whose movies are in the catalogue.
+
+    """
+    recommender = engine._algorithms()[algorithm].__wrapped__
+    results = []
+    for movie_list in seed_lists:
+        try:
+            results.append(recommender(list(movie_list), top_n))
+        except ValueError:
+            results.append(None)
+    return results
+
+def prerender(n_movies=20, max_seeds=3, top_n=10, algorithms=engine.ALGORITHMS,
+              workers=None, path=None):
+    """Pre-render the recommendations of popular seed combinations.
+
+    Parameters
+    ----------
+    n_movies : int
+        Number of most rated movies the seeds are drawn from.
+    max_seeds : int
+        Largest number of seeds per combination.
+    top_n : int
+        Number of recommendations per combination.
+    algorithms : list (str)
+        Algorithms to pre-render, see `recommenders.engine.ALGORITHMS`.
+    workers : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    path : str, optional
+        Store to write. Defaults to the store the recommenders consult.
+
+    Returns
+    -------
+    int
+        Number of entries written.
+
+    """
+    path = path or prerendered_results.path
+    # Built (if missing) and loaded before forking, so that the workers
+    # share the models and every result is keyed by the same version
+    engine.LocalEngine().warm_up()
+    combinations = list(seed_combinations(popular_titles(n_movies), max_seeds))
+    recommenders = engine._algorithms()
+    versions = {algorithm: model_version(recommenders[algorithm].artifacts)
+                for algorithm in algorithms}
+    entries = {}
+    print(f'... Pre-rendering {len(combinations)} seed combinations x {len(algorithms)} algorithms')
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {}
+        for algorithm in algorithms:
+            for i in range(0, len(combinations), CHUNK_SIZE):
+                chunk = combinations[i:i + CHUNK_SIZE]
+                futures[pool.submit(render, algorithm, chunk, top_n)] = (algorithm, chunk)
+        for future in as_completed(futures):
+            algorithm, chunk = futures[future]
+            for movie_list, recommendations in zip(chunk, future.result()):
+                if recommendations is not None:
+                    key = RecommendationCache.make_key(recommenders[algorithm].algorithm,
+                                                       movie_list, top_n, versions[algorithm])
+                    entries[key] = recommendations
+    PrerenderedResults.save(entries, path)
+    print(f'... {len(entries)} entries rendered ({time.perf_counter() - start:.1f}s)')
+    return len(entries)
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-render recommendations of popular seeds.')
+    parser.add_argument('--movies', type=int, default=20,
+                        help='number of most rated movies to combine')
+    parser.add_argument('--max-seeds', type=int, default=3)
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--algorithms', nargs='+', default=list(engine.ALGORITHMS),
+                        choices=engine.ALGORITHMS)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', help='store location (default: RECOMMENDER_PRERENDERED_PATH)')
+    args = parser.parse_args()
+
+    prerender(args.movies, args.max_seeds, args.top_n, args.algorithms, args.workers, args.output)
+    print(f"Recommendations pre-rendered. Saved to: {args.output or prerendered_results.path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+
+    Reduced-precision model export.
+
+    Author: Explore Data Science Academy.
+
+    Description: Writes float32 and int8 variants of the latest SVD factor
+    export and int8 variants of the item similarity store and the content
+    neighbour index, next to the full-precision artifacts (see
+    `utils.quantisation`), and reports what the precision costs:
+
+        - memory held by each artifact,
+        - SVD: RMSE on the ratings and its change from full precision,
+          the largest change of an estimate, and the overlap of every
+          sampled user's top-k unrated movies with the full-precision one,
+        - neighbour stores: the overlap of the top-k recommendations for
+          sampled seed sets, and the largest change of a stored score.
+          Content scores tie heavily at the cut-off, so there the overlap
+          mostly reflects how the ties are broken.
+
+    Serving processes pick the variants up when started with
+    `RECOMMENDER_MODEL_PRECISION=int8` (or float32). Re-run after every
+    model rebuild; outdated variants are ignored. From the root of the
+    repository:
+
+        python resources/models/quantise_models.py --report quantisation.json
+
+"""
+# Script dependencies
+import os
+import sys
+import json
+import argparse
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, ROOT)
+
+# Data handling dependencies
+import numpy as np
+import pandas as pd
+
+from utils import registry
+from utils.quantisation import FULL_PRECISION, precision_path, overlap_at_k
+from utils.neighbour_index import save_index, load_index, fuse_neighbours
+from utils.svd_scoring import (extract_factors, export_factors, save_factors, load_factors,
+                               latest_factors_path, predict_ratings)
+from utils.user_topn import rated_mask, score_users
+import recommenders.collaborative_based as collaborative_based
+import recommenders.content_based as content_based
+
+FACTOR_PRECISIONS = ('float32', 'int8')
+
+def _factor_bytes(factors):
+    return int(sum(factors[name].nbytes for name in ('pu', 'qi', 'bu', 'bi')))
+
+def _index_bytes(neighbours):
+    return int(sum(getattr(neighbours, part).nbytes
+                   for part in ('data', 'indices', 'indptr', 'scales') if hasattr(neighbours, part)))
+
+def quantise_factors(n_users=200, k=10, seed=0):
+    """Export reduced-precision variants of the latest SVD factors.
+
+    Returns
+    -------
+    dict
+        Per precision, the memory, RMSE and ranking agreement report.
+
+    """
+    path = latest_factors_path(collaborative_based.SVD_ARTIFACT_DIR)
+    if path is None:
+        # Only the pickled model exists: export its parameters first
+        version_dir = export_factors(collaborative_based.SVD_ARTIFACT_DIR,
+                                     extract_factors(registry.get('svd_model')),
+                                     {'source': registry.SVD_MODEL_PATH})
+        path = os.path.join(version_dir, 'factors.npz')
+    full = load_factors(path)
+    ratings = registry.get('ratings')
+    rated = rated_mask(full, ratings)
+    rows = np.sort(np.random.default_rng(seed).choice(len(full['user_index']),
+                                                      min(n_users, len(full['user_index'])),
+                                                      replace=False))
+
+    def evaluate(factors):
+        estimates = predict_ratings(factors, ratings['userId'], ratings['movieId'])
+        top, _ = score_users(factors, rows, k, rated)
+        return estimates, top
+
+    full_estimates, full_top = evaluate(full)
+    actual = ratings['rating'].to_numpy(dtype=np.float64)
+    full_rmse = float(np.sqrt(np.mean((full_estimates - actual) ** 2)))
+    report = {FULL_PRECISION: {'path': path, 'bytes': _factor_bytes(full), 'rmse': full_rmse}}
+    for precision in FACTOR_PRECISIONS:
+        variant = precision_path(path, precision)
+        save_factors(variant, full, precision)
+        factors = load_factors(variant)
+        estimates, top = evaluate(factors)
+        rmse = float(np.sqrt(np.mean((estimates - actual) ** 2)))
+        report[precision] = {'path': variant,
+                             'bytes': _factor_bytes(factors),
+                             'rmse': rmse,
+                             'rmse_change': rmse - full_rmse,
+                             'max_estimate_change': float(np.abs(estimates - full_estimates).max()),
+                             f'top{k}_overlap': overlap_at_k(full_top, top, k)}
+        print(f'... SVD factors at {precision}: {variant}')
+    return report
+
+def quantise_index(path, n_queries=500, n_seeds=3, k=10, seed=0):
+    """Export the int8 variant of a neighbour store.
+
+    Returns
+    -------
+    dict
+        Memory and ranking agreement of both precisions.
+
+    """
+    full, item_ids = load_index(path)
+    variant = precision_path(path, 'int8')
+    save_index(variant, full, item_ids, 'int8')
+    quantised, _ = load_index(variant)
+
+    rng = np.random.default_rng(seed)
+    queries = rng.integers(0, full.shape[0], size=(n_queries, n_seeds))
+    rankings = {'full': np.full((n_queries, k), -1), 'int8': np.full((n_queries, k), -1)}
+    for row, positions in enumerate(queries):
+        for name, neighbours in (('full', full), ('int8', quantised)):
+            top, _ = fuse_neighbours(neighbours, positions, k=k, exclude=positions)
+            rankings[name][row, :len(top)] = top
+    error = np.abs(quantised.tocsr().data - full.data).max(initial=0)
+    print(f'... {os.path.basename(path)} at int8: {variant}')
+    return {'float32': {'path': path, 'bytes': _index_bytes(full)},
+            'int8': {'path': variant,
+                     'bytes': _index_bytes(quantised),
+                     'max_score_change': float(error),
+                     f'top{k}_overlap': overlap_at_k(rankings['full'], rankings['int8'], k)}}
+
+def main():
+    parser = argparse.ArgumentParser(description='Export reduced-precision model artifacts.')
+    parser.add_argument('-k', type=int, default=10, help='cut-off rank of the agreement')
+    parser.add_argument('--users', type=int, default=200, help='users sampled for agreement')
+    parser.add_argument('--queries', type=int, default=500, help='seed sets sampled for agreement')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', help='write the report as JSON')
+    args = parser.parse_args()
+
+    # Build the neighbour stores on first use
+    for path, build in ((collaborative_based.ITEM_SIMILARITY_PATH, collaborative_based.build_item_similarity),
+                        (content_based.CONTENT_INDEX_PATH, content_based.build_content_index)):
+        if not os.path.exists(path):
+            build(path)
+    report = {'svd': quantise_factors(args.users, args.k, args.seed),
+              'item_similarity': quantise_index(collaborative_based.ITEM_SIMILARITY_PATH,
+                                                args.queries, k=args.k, seed=args.seed),
+              'content_index': quantise_index(content_based.CONTENT_INDEX_PATH,
+                                              args.queries, k=args.k, seed=args.seed)}
+
+    rows = {(artifact, precision): values
+            for artifact, precisions in report.items() for precision, values in precisions.items()}
+    table = pd.DataFrame(rows).T.drop(columns='path')
+    table['MB'] = table.pop('bytes') / 2**20
+    print(table.to_string(float_format=lambda value: f'{value:.4f}', na_rep=''))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Quantisation report written to: {args.report}")
+
+if __name__ == '__main__':
+    main()
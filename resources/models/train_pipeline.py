@@ -0,0 +1,235 @@
+"""
+
+    Parallel, resumable SVD training pipeline.
+
+    Author: Explore Data Science Academy.
+
+    Description: Cross-validated hyperparameter sweep for the surprise SVD
+    model used by the collaborative recommender. Every configuration of
+    the grid is evaluated with k-fold cross-validation on a process pool.
+    Results (fit time, RMSE and MAE per configuration) are checkpointed
+    to one JSON file each as soon as they finish, so an interrupted sweep
+    picks up where it stopped. The best configuration is then scored on a
+    held-out validation split, refitted on all ratings and exported as a
+    versioned artifact:
+
+        <output-dir>/<version>/factors.npz    pu, qi, bu, bi and id maps
+        <output-dir>/<version>/metadata.json  params, scores, data hash
+        <output-dir>/LATEST                   name of the newest version
+
+    The app loads `factors.npz` directly (see `utils.svd_scoring`) rather
+    than unpickling a full surprise model. Run from the root of the
+    repository:
+
+        python resources/models/train_pipeline.py --workers 4
+
+"""
+# Script dependencies
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, ROOT)
+
+# Data handling dependencies
+import numpy as np
+import surprise
+from surprise import SVD
+from surprise.model_selection import KFold
+
+from utils.ratings_ingest import ensure_ingested, load_ratings_table, matrix_dir
+from utils.svd_scoring import extract_factors, export_factors
+
+# Hyperparameter grid swept by default
+DEFAULT_GRID = {'n_factors': [50, 100, 200],
+                'n_epochs': [20, 40],
+                'lr_all': [0.005, 0.01],
+                'reg_all': [0.02, 0.05]}
+
+# Ratings shared by the tasks of one worker process
+_worker_data = None
+
+def load_ratings(path):
+    """Ratings with the columns expected by surprise.
+
+    The columns are memory-mapped from the chunked ingestion store, so
+    the worker processes share a single copy of them.
+
+    """
+    return load_ratings_table(ensure_ingested([path], store_dir(path)))[['userId', 'movieId', 'rating']]
+
+def store_dir(path):
+    """Ingestion store of the training ratings.
+
+    The app ingests the ratings together with the delta log into
+    `matrix_dir(path)`; training keeps its own store so that neither
+    keeps rebuilding the other's.
+
+    """
+    return f'{matrix_dir(path)}_training'
+
+def _dataset(ratings):
+    reader = surprise.Reader(rating_scale=(float(ratings['rating'].min()),
+                                           float(ratings['rating'].max())))
+    return surprise.Dataset.load_from_df(ratings, reader)
+
+def _split(ratings, validation_fraction, seed):
+    # Deterministic hold-out split, identical in every process
+    rng = np.random.default_rng(seed)
+    holdout = rng.random(len(ratings)) < validation_fraction
+    return ratings[~holdout], ratings[holdout]
+
+def _init_worker(ratings_path, validation_fraction, seed):
+    global _worker_data
+    train, _ = _split(load_ratings(ratings_path), validation_fraction, seed)
+    _worker_data = _dataset(train)
+
+def config_key(params):
+    """Stable short identifier of a configuration."""
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+def evaluate_config(params, folds, seed):
+    """Cross-validate one configuration on the worker's training ratings.
+
+    Returns
+    -------
+    dict
+        The parameters with per-fold and mean RMSE, MAE and fit time.
+
+    """
+    rmse, mae, fit_times = [], [], []
+    for trainset, testset in KFold(n_splits=folds, random_state=seed).split(_worker_data):
+        start = time.perf_counter()
+        model = SVD(random_state=seed, **params).fit(trainset)
+        fit_times.append(time.perf_counter() - start)
+        predictions = model.test(testset)
+        errors = np.array([p.r_ui - p.est for p in predictions])
+        rmse.append(float(np.sqrt(np.mean(errors ** 2))))
+        mae.append(float(np.mean(np.abs(errors))))
+    return {'params': params,
+            'rmse': float(np.mean(rmse)),
+            'mae': float(np.mean(mae)),
+            'fit_seconds': float(np.mean(fit_times)),
+            'fold_rmse': rmse}
+
+def _write_json(path, data):
+    # Atomic, so an interrupted run never leaves a truncated checkpoint
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+def file_hash(path):
+    """SHA-1 of a file, identifying the data a sweep was run on."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def sweep(ratings_path, grid, folds, workers, checkpoint_dir, validation_fraction, seed):
+    """Evaluate every configuration of a grid, resuming from checkpoints.
+
+    Returns
+    -------
+    list (dict)
+        Cross-validation results of every configuration.
+
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    configs = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    results, pending = [], []
+    for params in configs:
+        path = os.path.join(checkpoint_dir, f'{config_key(params)}.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                results.append(json.load(f))
+        else:
+            pending.append(params)
+    print(f'... {len(results)} configurations checkpointed, {len(pending)} to run')
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(ratings_path, validation_fraction, seed)) as pool:
+        futures = {pool.submit(evaluate_config, params, folds, seed): params for params in pending}
+        for future in as_completed(futures):
+            result = future.result()
+            _write_json(os.path.join(checkpoint_dir, f"{config_key(result['params'])}.json"), result)
+            results.append(result)
+            print(f"... {result['params']} RMSE {result['rmse']:.4f} "
+                  f"({result['fit_seconds']:.1f}s per fit)")
+    return results
+
+def export(ratings_path, params, cv_result, output_dir, validation_fraction, seed, data_hash):
+    """Validate, refit and export the winning configuration.
+
+    Returns
+    -------
+    str
+        Directory of the exported version.
+
+    """
+    ratings = load_ratings(ratings_path)
+    train, holdout = _split(ratings, validation_fraction, seed)
+    model = SVD(random_state=seed, **params).fit(_dataset(train).build_full_trainset())
+    predictions = model.test(list(holdout.itertuples(index=False, name=None)))
+    holdout_rmse = float(np.sqrt(np.mean([(p.r_ui - p.est) ** 2 for p in predictions])))
+    print(f'... Hold-out RMSE of the winner: {holdout_rmse:.4f}')
+
+    # The exported model is refitted on every rating, as train_colbased does
+    start = time.perf_counter()
+    model = SVD(random_state=seed, **params).fit(_dataset(ratings).build_full_trainset())
+    fit_seconds = time.perf_counter() - start
+
+    return export_factors(output_dir, extract_factors(model),
+                          {'params': params,
+                           'cv_rmse': cv_result['rmse'],
+                           'cv_mae': cv_result['mae'],
+                           'holdout_rmse': holdout_rmse,
+                           'fit_seconds': fit_seconds,
+                           'n_ratings': int(len(ratings)),
+                           'n_users': int(model.trainset.n_users),
+                           'n_items': int(model.trainset.n_items),
+                           'ratings_sha1': data_hash})
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep, validate and export SVD models.')
+    parser.add_argument('--ratings', default=os.path.join(ROOT, 'resources/data/ratings.csv'))
+    parser.add_argument('--grid', help='JSON object mapping SVD parameters to value lists')
+    parser.add_argument('--folds', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--validation-fraction', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output-dir', default=os.path.join(ROOT, 'resources/models/svd'))
+    parser.add_argument('--checkpoint-dir',
+                        help='defaults to <output-dir>/checkpoints/<data hash>')
+    args = parser.parse_args()
+
+    grid = json.loads(args.grid) if args.grid else DEFAULT_GRID
+    data_hash = file_hash(args.ratings)
+    # Ingested once, before the workers start
+    ensure_ingested([args.ratings], store_dir(args.ratings))
+    # Checkpoints are only valid for the same data, split and folds
+    run_key = f'{data_hash[:12]}-f{args.folds}-v{args.validation_fraction:g}-s{args.seed}'
+    checkpoint_dir = args.checkpoint_dir or os.path.join(args.output_dir, 'checkpoints', run_key)
+
+    results = sweep(args.ratings, grid, args.folds, args.workers, checkpoint_dir,
+                    args.validation_fraction, args.seed)
+    configs = {config_key(dict(zip(grid, values)))
+               for values in itertools.product(*grid.values())}
+    results = [r for r in results if config_key(r['params']) in configs]
+    best = min(results, key=lambda r: r['rmse'])
+    _write_json(os.path.join(checkpoint_dir, 'summary.json'),
+                sorted(results, key=lambda r: r['rmse']))
+    print(f"... Best configuration {best['params']} with CV RMSE {best['rmse']:.4f}")
+    version_dir = export(args.ratings, best['params'], best, args.output_dir,
+                         args.validation_fraction, args.seed, data_hash)
+    print(f'Training completed. Model exported to: {version_dir}')
+
+if __name__ == '__main__':
+    main()
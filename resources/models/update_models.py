@@ -0,0 +1,141 @@
+"""
+
+    Incremental model updates.
+
+    Author: Explore Data Science Academy.
+
+    Description: Keeps the collaborative models fresh between full
+    retrains. New ratings are appended to the ratings delta log, and an
+    update folds the users and movies they touch into the SVD factors,
+    patches the affected rows of the item similarity store and re-ranks
+    the popularity table. A compaction periodically merges the log into
+    `ratings.csv`, rebuilds the similarity store and popularity table and
+    retrains the SVD from scratch.
+
+    Run from the root of the repository, e.g. hourly and nightly:
+
+        python resources/models/update_models.py append new_ratings.csv
+        python resources/models/update_models.py update
+        python resources/models/update_models.py compact
+
+"""
+# Script dependencies
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+# Data handling dependencies
+import pandas as pd
+import surprise
+from surprise import SVD
+
+from utils import registry
+from utils.ratings_log import append_ratings, read_delta, compact
+from utils.svd_scoring import extract_factors, export_factors, latest_factors_path
+import recommenders.collaborative_based as collaborative_based
+
+# Number of delta log entries already folded into the models
+STATE_PATH = 'resources/models/incremental_state.json'
+# Parameters of resources/models/train_colbased.py, used when no trained
+# version records its own
+DEFAULT_PARAMS = {'n_factors': 200, 'lr_all': 0.005, 'reg_all': 0.02,
+                  'n_epochs': 40, 'init_std_dev': 0.05}
+
+def _read_state():
+    if not os.path.exists(STATE_PATH):
+        return {'applied_rows': 0}
+    with open(STATE_PATH) as f:
+        return json.load(f)
+
+def _write_state(state):
+    with open(f'{STATE_PATH}.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(f'{STATE_PATH}.tmp', STATE_PATH)
+
+def update():
+    """Fold the ratings logged since the last update into the models."""
+    state = _read_state()
+    delta = read_delta(start=state['applied_rows'])
+    if delta.empty:
+        print('... No new ratings to apply')
+        return
+    print(f'... Applying {len(delta)} new ratings')
+    start = time.perf_counter()
+    version_dir = collaborative_based.update_svd_factors(
+        delta, {'delta_rows': state['applied_rows'] + len(delta)})
+    print(f'... Factors folded in ({time.perf_counter() - start:.1f}s): {version_dir}')
+    start = time.perf_counter()
+    if os.path.exists(collaborative_based.ITEM_SIMILARITY_PATH):
+        collaborative_based.update_item_similarity(delta['movieId'].unique())
+    else:
+        collaborative_based.build_item_similarity()
+    print(f'... Item similarity store patched ({time.perf_counter() - start:.1f}s)')
+    collaborative_based.build_popularity_table()
+    _write_state({'applied_rows': state['applied_rows'] + len(delta)})
+
+def _latest_params():
+    # Hyperparameters of the most recent trained (not folded-in) version:
+    # versions are walked back from LATEST, past the folded-in ones
+    path = latest_factors_path(collaborative_based.SVD_ARTIFACT_DIR)
+    if path is None:
+        return DEFAULT_PARAMS
+    latest = os.path.basename(os.path.dirname(path))
+    versions = sorted((name for name in os.listdir(collaborative_based.SVD_ARTIFACT_DIR)
+                       if name.startswith('v') and name <= latest), reverse=True)
+    for version in versions:
+        metadata_path = os.path.join(collaborative_based.SVD_ARTIFACT_DIR, version, 'metadata.json')
+        if not os.path.exists(metadata_path):
+            continue
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        if 'params' in metadata:
+            return metadata['params']
+    return DEFAULT_PARAMS
+
+def compact_models(retrain=True):
+    """Merge the delta log into the ratings and rebuild the models."""
+    print(f'... Compacted {compact()} logged ratings into {registry.RATINGS_PATH}')
+    _write_state({'applied_rows': 0})
+    registry.unload()
+    print('... Rebuilding the item similarity store')
+    collaborative_based.build_item_similarity()
+    collaborative_based.build_popularity_table()
+    if retrain:
+        params = _latest_params()
+        print(f'... Retraining the SVD model with {params}')
+        ratings = registry.get('ratings')[['userId', 'movieId', 'rating']]
+        reader = surprise.Reader(rating_scale=(ratings['rating'].min(), ratings['rating'].max()))
+        start = time.perf_counter()
+        model = SVD(**params).fit(surprise.Dataset.load_from_df(ratings, reader).build_full_trainset())
+        version_dir = export_factors(collaborative_based.SVD_ARTIFACT_DIR, extract_factors(model),
+                                     {'params': params,
+                                      'fit_seconds': time.perf_counter() - start,
+                                      'n_ratings': int(len(ratings)),
+                                      'n_users': int(model.trainset.n_users),
+                                      'n_items': int(model.trainset.n_items)})
+        print(f'... Exported {version_dir}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Incrementally update the collaborative models.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    append = commands.add_parser('append', help='log new ratings from a CSV file')
+    append.add_argument('path', help='CSV with userId, movieId, rating (and timestamp) columns')
+    commands.add_parser('update', help='fold logged ratings into the models')
+    compaction = commands.add_parser('compact', help='merge the log and rebuild the models')
+    compaction.add_argument('--no-retrain', action='store_true',
+                            help='keep the folded-in SVD factors instead of retraining')
+    args = parser.parse_args()
+
+    if args.command == 'append':
+        print(f'... {append_ratings(pd.read_csv(args.path))} ratings logged')
+    elif args.command == 'update':
+        update()
+    else:
+        compact_models(retrain=not args.no_retrain)
+
+if __name__ == '__main__':
+    main()
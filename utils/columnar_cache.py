@@ -0,0 +1,239 @@
+"""
+
+    Compact columnar binary cache for the MovieLens CSV files.
+
+    Author: Explore Data Science Academy.
+
+    Description: Converts a CSV table once into a directory of `.npy`
+    column files using compact dtypes (int32 ids, float32 ratings) and
+    dictionary-encoded string columns (integer codes plus a UTF-8 blob of
+    the distinct values). Loading memory-maps the numeric columns, so that
+    several app worker processes share the same page-cache pages instead
+    of each parsing the CSV into private int64/float64/object arrays.
+
+    A table is rewritten into a fresh sibling directory which then
+    replaces the old one atomically (see `publish_dir`), so files that
+    running processes have memory-mapped are never modified in place.
+
+    To (re)build the cache for the default datasets, run from the root of
+    the repository:
+
+        python -m utils.columnar_cache
+
+"""
+# Script dependencies
+import os
+import json
+import shutil
+import tempfile
+
+# Data handling dependencies
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = 'resources/data/cache'
+
+# Compact dtypes of the known MovieLens columns. Columns of dtype 'category'
+# are dictionary-encoded.
+COLUMN_DTYPES = {'movieId': np.int32,
+                 'userId': np.int32,
+                 'rating': np.float32,
+                 'timestamp': np.int64,
+                 'title': 'category',
+                 'genres': 'category',
+                 'tag': 'category'}
+
+def _table_dir(name, cache_dir):
+    return os.path.join(cache_dir, name)
+
+def _source_signature(csv_path):
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+def staging_dir(target_dir):
+    """Create an empty directory next to `target_dir` to build into."""
+    parent = os.path.dirname(os.path.abspath(target_dir))
+    os.makedirs(parent, exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix=f'{os.path.basename(target_dir)}.', dir=parent)
+    os.chmod(build_dir, 0o755)
+    return build_dir
+
+def publish_dir(build_dir, target_dir):
+    """Atomically make a completely written directory live at `target_dir`.
+
+    `target_dir` is a symbolic link to the current build, switched with a
+    single `os.replace`: readers see either the old or the new contents,
+    never a mix. The previous build is then removed; files already
+    memory-mapped from it stay valid until they are unmapped.
+
+    Parameters
+    ----------
+    build_dir : str
+        Directory from `staging_dir`, with every file written.
+    target_dir : str
+        Path readers open.
+
+    """
+    previous = None
+    if os.path.islink(target_dir):
+        previous = os.path.realpath(target_dir)
+    elif os.path.isdir(target_dir):
+        # A directory written before builds were swapped in: moved aside once
+        previous = f'{target_dir}.{os.getpid()}.old'
+        os.replace(target_dir, previous)
+    link = f'{target_dir}.{os.getpid()}.link'
+    os.symlink(os.path.basename(build_dir), link)
+    os.replace(link, target_dir)
+    if previous and previous != os.path.realpath(build_dir):
+        shutil.rmtree(previous, ignore_errors=True)
+
+def _smallest_code_dtype(n_categories):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+def convert_csv(csv_path, name, cache_dir=CACHE_DIR, chunksize=1000000):
+    """Convert a CSV table into the columnar cache format.
+
+    Parameters
+    ----------
+    csv_path : str
+        Source CSV file.
+    name : str
+        Name of the cached table (its sub-directory within `cache_dir`).
+    cache_dir : str
+        Root directory of the cache.
+    chunksize : int
+        Number of CSV rows parsed at a time.
+
+    """
+    table_dir = _table_dir(name, cache_dir)
+    # Written aside and swapped in: serving processes map the live files
+    build_dir = staging_dir(table_dir)
+    header = pd.read_csv(csv_path, nrows=0).columns
+    dtypes = {column: COLUMN_DTYPES.get(column, 'category') for column in header}
+    read_dtypes = {column: ('str' if dtype == 'category' else dtype)
+                   for column, dtype in dtypes.items()}
+
+    # Parse in chunks so that large rating files never exist as one frame
+    numeric = {column: [] for column, dtype in dtypes.items() if dtype != 'category'}
+    strings = {column: [] for column, dtype in dtypes.items() if dtype == 'category'}
+    for chunk in pd.read_csv(csv_path, dtype=read_dtypes, chunksize=chunksize):
+        for column in numeric:
+            numeric[column].append(chunk[column].to_numpy(dtype=dtypes[column]))
+        for column in strings:
+            # Interning per chunk keeps only the distinct values alive
+            codes, uniques = pd.factorize(chunk[column])
+            strings[column].append((codes, uniques))
+
+    columns = {}
+    for column, parts in numeric.items():
+        values = np.concatenate(parts) if parts else np.empty(0, dtype=dtypes[column])
+        if column == 'timestamp' and len(values) and values.max() < np.iinfo(np.int32).max:
+            values = values.astype(np.int32)
+        np.save(os.path.join(build_dir, f'{column}.npy'), values)
+        columns[column] = 'numeric'
+    for column, parts in strings.items():
+        categories = pd.Index(pd.unique(np.concatenate([uniques for _, uniques in parts])
+                                        if parts else np.empty(0, dtype=object)))
+        code_dtype = _smallest_code_dtype(len(categories))
+        # Missing values keep the code -1
+        codes = np.concatenate([np.where(codes >= 0, categories.get_indexer(uniques)[codes], -1)
+                                .astype(code_dtype)
+                                for codes, uniques in parts]) if parts else np.empty(0, code_dtype)
+        encoded = [value.encode('utf-8') for value in categories]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(value) for value in encoded])
+        np.save(os.path.join(build_dir, f'{column}.codes.npy'), codes)
+        np.save(os.path.join(build_dir, f'{column}.offsets.npy'), offsets)
+        np.save(os.path.join(build_dir, f'{column}.strings.npy'),
+                np.frombuffer(b''.join(encoded), dtype=np.uint8))
+        columns[column] = 'category'
+
+    meta = {'columns': [column for column in header],
+            'kinds': columns,
+            'source': _source_signature(csv_path)}
+    with open(os.path.join(build_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    publish_dir(build_dir, table_dir)
+
+def is_fresh(csv_path, name, cache_dir=CACHE_DIR):
+    """Whether a cached table exists and matches its source CSV.
+
+    A cache whose source CSV is absent is considered fresh, so that a
+    deployment may ship the cache alone.
+
+    """
+    meta_path = os.path.join(_table_dir(name, cache_dir), 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    if not os.path.exists(csv_path):
+        return True
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return meta['source'] == _source_signature(csv_path)
+
+def load_cached(name, cache_dir=CACHE_DIR):
+    """Load a cached table, memory-mapping its numeric columns.
+
+    Parameters
+    ----------
+    name : str
+        Name of the cached table.
+    cache_dir : str
+        Root directory of the cache.
+
+    Returns
+    -------
+    Pandas DataFrame
+        The table. Numeric columns are read-only views onto the cache
+        files. String columns are categoricals.
+
+    """
+    table_dir = _table_dir(name, cache_dir)
+    with open(os.path.join(table_dir, 'meta.json')) as f:
+        meta = json.load(f)
+    data = {}
+    for column in meta['columns']:
+        if meta['kinds'][column] == 'numeric':
+            data[column] = np.load(os.path.join(table_dir, f'{column}.npy'), mmap_mode='r')
+        else:
+            offsets = np.load(os.path.join(table_dir, f'{column}.offsets.npy'))
+            blob = np.load(os.path.join(table_dir, f'{column}.strings.npy')).tobytes()
+            categories = [blob[start:stop].decode('utf-8')
+                          for start, stop in zip(offsets[:-1], offsets[1:])]
+            codes = np.load(os.path.join(table_dir, f'{column}.codes.npy'), mmap_mode='r')
+            data[column] = pd.Categorical.from_codes(codes, categories=pd.Index(categories, dtype=object))
+    # copy=False keeps each numeric column backed by its memory map
+    return pd.DataFrame(data, copy=False)
+
+def load_table(csv_path, name, cache_dir=CACHE_DIR):
+    """Load a table from the columnar cache, falling back to its CSV.
+
+    Parameters
+    ----------
+    csv_path : str
+        Source CSV file.
+    name : str
+        Name of the cached table.
+    cache_dir : str
+        Root directory of the cache.
+
+    Returns
+    -------
+    Pandas DataFrame
+        The table.
+
+    """
+    if is_fresh(csv_path, name, cache_dir):
+        return load_cached(name, cache_dir)
+    return pd.read_csv(csv_path)
+
+if __name__ == '__main__':
+    from utils import registry
+    for csv_path, name in ((registry.MOVIES_PATH, 'movies'),
+                           (registry.RATINGS_PATH, 'ratings')):
+        print(f'... Converting {csv_path}')
+        convert_csv(csv_path, name)
+    print(f"Cache built. Saved to: {CACHE_DIR}")
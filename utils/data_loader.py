@@ -5,9 +5,13 @@
     Author: Explore Data Science Academy.
 
 """
+# Script dependencies
+import os
+
 # Data handling dependencies
 import pandas as pd
 import numpy as np
+from utils import registry
 
 def load_movie_titles(path_to_movies):
     """Load movie titles from database records.
@@ -24,6 +28,9 @@ def load_movie_titles(path_to_movies):
         Movie titles.
 
     """
+    # The default movie database is shared through the artifact registry
+    if os.path.abspath(path_to_movies) == os.path.abspath(registry.MOVIES_PATH):
+        return registry.get('movies')['title'].to_list()
     df = pd.read_csv(path_to_movies)
     df = df.dropna()
     movie_list = df['title'].to_list()
@@ -0,0 +1,152 @@
+"""
+
+    Offline evaluation metrics.
+
+    Author: Explore Data Science Academy.
+
+    Description: Held-out splitting of the ratings and vectorised ranking
+    and rating-prediction metrics. Recommendations for many users are
+    evaluated at once, as a (users x k) array of recommended movie IDs
+    (padded with -1), against the held-out ratings of those users:
+
+        precision@k  share of the k recommendations that are relevant,
+        recall@k     share of the relevant movies that are recommended,
+        NDCG@k       discounted gain of the hits over the ideal ranking,
+        MAP@k        mean average precision, normalised by min(k, relevant),
+        coverage     share of the catalogue recommended to anyone,
+        RMSE / MAE   error of predicted ratings.
+
+    Held-out movies rated at least `threshold` are relevant. Ranking
+    metrics are averaged over the users with at least one relevant movie.
+    See `resources/models/evaluate.py` for the full evaluation run.
+
+"""
+# Data handling dependencies
+import numpy as np
+import pandas as pd
+
+def split_ratings(ratings, test_fraction=0.2, method='time', min_ratings=5, seed=0):
+    """Hold out part of every user's ratings.
+
+    Parameters
+    ----------
+    ratings : Pandas DataFrame
+        `userId`, `movieId`, `rating` and (for `method='time'`)
+        `timestamp` columns.
+    test_fraction : float
+        Share of each user's ratings held out, rounded up.
+    method : str
+        'time' holds out each user's most recent ratings, 'random' a
+        random sample of them.
+    min_ratings : int
+        Users with fewer ratings are kept entirely for training.
+    seed : int
+        Seed of the random split.
+
+    Returns
+    -------
+    tuple (Pandas DataFrame, Pandas DataFrame)
+        The training and test ratings.
+
+    """
+    users = ratings['userId'].to_numpy()
+    if method == 'time':
+        order = np.lexsort((ratings['movieId'].to_numpy(), ratings['timestamp'].to_numpy(), users))
+    elif method == 'random':
+        order = np.lexsort((np.random.default_rng(seed).random(len(ratings)), users))
+    else:
+        raise ValueError(f"Unknown split method '{method}'")
+    sorted_users = users[order]
+    starts = np.flatnonzero(np.r_[True, sorted_users[1:] != sorted_users[:-1]])
+    counts = np.diff(np.r_[starts, len(order)])
+    # Rank of each rating within its user, and the user's rating count
+    rank = np.arange(len(order)) - np.repeat(starts, counts)
+    count = np.repeat(counts, counts)
+    n_test = np.ceil(count * test_fraction).astype(np.int64)
+    held_out = np.zeros(len(ratings), dtype=bool)
+    held_out[order] = (count >= min_ratings) & (rank >= count - n_test)
+    return ratings[~held_out], ratings[held_out]
+
+def hit_matrix(recommended, users, test):
+    """Flag the recommendations that are relevant held-out movies.
+
+    Parameters
+    ----------
+    recommended : numpy.ndarray
+        Array of shape (n_users, k) of recommended movie IDs, -1 padded.
+    users : numpy.ndarray
+        User ID of each row of `recommended`.
+    test : Pandas DataFrame
+        Relevant held-out ratings, with `userId` and `movieId` columns.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean array of the shape of `recommended`.
+
+    """
+    rows = pd.Index(users).get_indexer(test['userId'])
+    movie_ids = test['movieId'].to_numpy(dtype=np.int64)
+    known = rows >= 0
+    stride = max(int(recommended.max(initial=0)), int(movie_ids.max(initial=0))) + 1
+    # One integer key per (user row, movie) pair
+    relevant = rows[known].astype(np.int64) * stride + movie_ids[known]
+    keys = np.arange(len(users), dtype=np.int64)[:, None] * stride + recommended
+    return np.isin(keys, relevant) & (recommended >= 0)
+
+def ranking_metrics(recommended, users, test, k=10, threshold=4.0):
+    """Precision, recall, NDCG and MAP at k of many users' recommendations.
+
+    Parameters
+    ----------
+    recommended : numpy.ndarray
+        Array of shape (n_users, >= k) of recommended movie IDs, best
+        first, padded with -1.
+    users : numpy.ndarray
+        User ID of each row of `recommended`.
+    test : Pandas DataFrame
+        Held-out ratings.
+    k : int
+        Cut-off rank.
+    threshold : float
+        Minimum held-out rating of a relevant movie.
+
+    Returns
+    -------
+    dict
+        The mean metrics, and the number of users they are averaged over.
+
+    """
+    recommended = np.asarray(recommended)[:, :k]
+    relevant = test[test['rating'] >= threshold]
+    n_relevant = relevant['userId'].value_counts().reindex(users).fillna(0).to_numpy()
+    evaluated = n_relevant > 0
+    hits = hit_matrix(recommended, users, relevant)[evaluated].astype(np.float64)
+    n_relevant = n_relevant[evaluated]
+    if not len(hits):
+        return {'users': 0, 'precision': 0.0, 'recall': 0.0, 'ndcg': 0.0, 'map': 0.0}
+
+    n_hits = hits.sum(axis=1)
+    discount = 1 / np.log2(np.arange(2, k + 2))
+    dcg = hits @ discount[:hits.shape[1]]
+    ideal = np.cumsum(discount)[np.minimum(n_relevant, k).astype(np.int64) - 1]
+    precision_at = np.cumsum(hits, axis=1) / np.arange(1, hits.shape[1] + 1)
+    average_precision = (precision_at * hits).sum(axis=1) / np.minimum(n_relevant, k)
+    return {'users': int(len(hits)),
+            'precision': float(np.mean(n_hits / k)),
+            'recall': float(np.mean(n_hits / n_relevant)),
+            'ndcg': float(np.mean(dcg / ideal)),
+            'map': float(np.mean(average_precision))}
+
+def coverage(recommended, n_items):
+    """Share of a catalogue of `n_items` movies recommended to anyone."""
+    recommended = np.asarray(recommended)
+    return float(len(np.unique(recommended[recommended >= 0])) / n_items) if n_items else 0.0
+
+def rating_errors(predicted, actual):
+    """RMSE and MAE of predicted ratings."""
+    errors = np.asarray(predicted, dtype=np.float64) - np.asarray(actual, dtype=np.float64)
+    if not len(errors):
+        return {'rmse': float('nan'), 'mae': float('nan')}
+    return {'rmse': float(np.sqrt(np.mean(errors ** 2))),
+            'mae': float(np.mean(np.abs(errors)))}
@@ -0,0 +1,279 @@
+"""
+
+    Approximate nearest-neighbour search over item embeddings.
+
+    Author: Explore Data Science Academy.
+
+    Description: An inverted-file (IVF) index over dense item vectors,
+    such as the `qi` latent factors of a trained SVD model. Vectors are
+    L2-normalised and clustered with spherical k-means; each cluster keeps
+    its members in one contiguous block. A query is scored against the
+    cluster centroids first and only the members of the `n_probe` closest
+    clusters are scored exactly, so a lookup touches a small fraction of
+    the catalogue. Exact (brute-force) search is available for small
+    catalogues, as a fallback when too few candidates are probed, and as
+    the reference for `recall_at_k`.
+
+    Measure recall and latency of the index over the current SVD factors
+    from the root of the repository with:
+
+        python -m utils.factor_index
+
+"""
+# Script dependencies
+import time
+
+# Data handling dependencies
+import numpy as np
+
+# Below this size a brute-force scan is as fast as probing clusters
+EXACT_SEARCH_MAX_ITEMS = 20000
+
+def _normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+def _top_k(positions, scores, k):
+    # Best k by score, ties broken by position, most similar first. Ties
+    # with the k-th score all reach the sort, which breaks them
+    if len(scores) > k:
+        kth = -np.partition(-scores, k - 1)[k - 1]
+        keep = np.flatnonzero(scores >= kth)
+        positions, scores = positions[keep], scores[keep]
+    order = np.lexsort((positions, -scores))[:k]
+    return positions[order], scores[order]
+
+def combine_vectors(vectors, weights=None):
+    """Combine several item vectors into a single unit query vector.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        Vectors of the seed items, one per row.
+    weights : list (float), optional
+        Relative weight of each seed. Seeds count equally when omitted.
+
+    Returns
+    -------
+    numpy.ndarray
+        Normalised weighted mean of the normalised seed vectors.
+
+    """
+    return _normalise(np.average(_normalise(vectors), axis=0, weights=weights))
+
+def spherical_kmeans(vectors, n_clusters, n_iter=10, sample_size=None, seed=0, block_size=8192):
+    """Cluster unit vectors by cosine similarity.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        L2-normalised vectors, one per row.
+    n_clusters : int
+        Number of clusters.
+    n_iter : int
+        Number of Lloyd iterations.
+    sample_size : int, optional
+        Number of vectors the centroids are trained on. Every vector is
+        used when omitted.
+    seed : int
+        Seed of the initialisation and sampling.
+    block_size : int
+        Number of vectors assigned at once.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        Unit centroids, and the cluster of every vector.
+
+    """
+    rng = np.random.default_rng(seed)
+    n_vectors = len(vectors)
+    train = vectors
+    if sample_size is not None and sample_size < n_vectors:
+        train = vectors[np.sort(rng.choice(n_vectors, sample_size, replace=False))]
+    centroids = train[rng.choice(len(train), n_clusters, replace=False)].copy()
+
+    def assign(data):
+        labels = np.empty(len(data), dtype=np.int32)
+        for start in range(0, len(data), block_size):
+            labels[start:start + block_size] = np.argmax(
+                data[start:start + block_size] @ centroids.T, axis=1)
+        return labels
+
+    for _ in range(n_iter):
+        labels = assign(train)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, train)
+        counts = np.bincount(labels, minlength=n_clusters)
+        # Empty clusters are restarted on random vectors
+        empty = counts == 0
+        sums[empty] = train[rng.choice(len(train), int(empty.sum()))]
+        centroids = _normalise(sums)
+    return centroids, assign(vectors)
+
+class FactorIndex:
+    """IVF index for cosine-similarity search over item vectors.
+
+    Parameters
+    ----------
+    vectors : array-like
+        Item vectors, one row per item (e.g. SVD `qi`).
+    n_lists : int, optional
+        Number of clusters. Defaults to about `sqrt(n_items)`; catalogues
+        of fewer than `EXACT_SEARCH_MAX_ITEMS` items are searched exactly.
+    n_probe : int, optional
+        Number of clusters scored per query. Defaults to a quarter of
+        `n_lists`.
+    seed : int
+        Seed of the clustering.
+
+    """
+
+    def __init__(self, vectors, n_lists=None, n_probe=None, seed=0):
+        self.vectors = _normalise(vectors)
+        n_items = len(self.vectors)
+        if n_lists is None:
+            n_lists = int(np.sqrt(n_items)) if n_items >= EXACT_SEARCH_MAX_ITEMS else 0
+        self.n_lists = min(n_lists, n_items)
+        self.n_probe = n_probe or max(1, self.n_lists // 4)
+        if self.n_lists:
+            # Centroids are trained on a sample, every item is then assigned
+            self.centroids, labels = spherical_kmeans(self.vectors, self.n_lists,
+                                                      sample_size=64 * self.n_lists, seed=seed)
+            # Members of a cluster are stored contiguously
+            self.order = np.argsort(labels, kind='stable')
+            self.offsets = np.searchsorted(labels[self.order], np.arange(self.n_lists + 1))
+            self.list_vectors = self.vectors[self.order]
+        else:
+            self.centroids = np.empty((0, self.vectors.shape[1]), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def query_vector(self, positions, weights=None):
+        """Query vector combining the indexed items at `positions`."""
+        return combine_vectors(self.vectors[np.asarray(positions)], weights)
+
+    def search_exact(self, query, k=10, exclude=None, allowed=None):
+        """Brute-force top-k search over every item.
+
+        Only the items of `allowed`, a boolean mask over the positions,
+        are scored when it is given.
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray)
+            Positions of the k most similar items and their cosine
+            similarity, most similar first.
+
+        """
+        if allowed is None:
+            positions = np.arange(len(self.vectors))
+            scores = self.vectors @ _normalise(query)
+        else:
+            positions = np.flatnonzero(allowed)
+            scores = self.vectors[positions] @ _normalise(query)
+        if exclude is not None:
+            keep = ~np.isin(positions, exclude)
+            positions, scores = positions[keep], scores[keep]
+        return _top_k(positions, scores, k)
+
+    def search(self, query, k=10, exclude=None, n_probe=None, allowed=None):
+        """Approximate top-k search.
+
+        Parameters
+        ----------
+        query : numpy.ndarray
+            Query vector, e.g. from `query_vector`.
+        k : int
+            Number of results.
+        exclude : array-like, optional
+            Positions which may not appear in the result (typically the
+            seeds).
+        n_probe : int, optional
+            Number of clusters scored, overriding the index default.
+        allowed : numpy.ndarray, optional
+            Boolean mask of the positions which may appear in the result
+            (see `utils.movie_filters`). Other items are dropped before
+            they are scored.
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray)
+            Positions of the k most similar items found and their cosine
+            similarity, most similar first.
+
+        """
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        if n_probe == 0 or n_probe == self.n_lists:
+            return self.search_exact(query, k, exclude, allowed)
+        query = _normalise(query)
+        probed = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        slices = [slice(self.offsets[c], self.offsets[c + 1]) for c in probed]
+        positions = np.concatenate([self.order[s] for s in slices])
+        vectors = np.concatenate([self.list_vectors[s] for s in slices])
+        if allowed is not None:
+            keep = allowed[positions]
+            positions, vectors = positions[keep], vectors[keep]
+        scores = vectors @ query
+        if exclude is not None:
+            keep = ~np.isin(positions, exclude)
+            positions, scores = positions[keep], scores[keep]
+        if len(positions) < k:
+            # Too few candidates in the probed clusters
+            return self.search_exact(query, k, exclude, allowed)
+        return _top_k(positions, scores, k)
+
+    def recall_at_k(self, queries, k=10, n_probe=None):
+        """Mean fraction of the exact top-k found by `search`.
+
+        Parameters
+        ----------
+        queries : numpy.ndarray
+            Query vectors, one per row.
+        k : int
+            Number of results compared.
+        n_probe : int, optional
+            Number of clusters scored, overriding the index default.
+
+        Returns
+        -------
+        float
+            Recall@k averaged over the queries.
+
+        """
+        found = 0
+        for query in queries:
+            exact, _ = self.search_exact(query, k)
+            approximate, _ = self.search(query, k, n_probe=n_probe)
+            found += len(np.intersect1d(exact, approximate))
+        return found / (k * len(queries))
+
+if __name__ == '__main__':
+    from utils import registry
+    import recommenders.collaborative_based
+
+    factors = registry.get('svd_factors')
+    start = time.perf_counter()
+    n_items = len(factors['qi'])
+    # Cluster even a small catalogue so that the trade-off can be measured
+    index = FactorIndex(factors['qi'], n_lists=int(np.sqrt(n_items)))
+    print(f'... Built {index.n_lists} lists over {len(index)} items '
+          f'in {time.perf_counter() - start:.2f}s')
+    rng = np.random.default_rng(0)
+    seeds = rng.integers(len(index), size=(200, 3))
+    queries = np.stack([index.query_vector(s) for s in seeds])
+    for n_probe in sorted({1, 4, index.n_probe, index.n_lists // 4}):
+        if not 0 < n_probe <= index.n_lists:
+            continue
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query, 10, n_probe=n_probe)
+        latency = (time.perf_counter() - start) / len(queries) * 1000
+        print(f'n_probe={n_probe}: recall@10 {index.recall_at_k(queries, 10, n_probe):.3f}, '
+              f'{latency:.3f} ms/query')
+    start = time.perf_counter()
+    for query in queries:
+        index.search_exact(query, 10)
+    print(f'exact: {(time.perf_counter() - start) / len(queries) * 1000:.3f} ms/query')
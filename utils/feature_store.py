@@ -0,0 +1,223 @@
+"""
+
+    Persistent sparse item feature store.
+
+    Author: Explore Data Science Academy.
+
+    Description: Content features of every movie, kept as separate TF-IDF
+    blocks which are fitted once offline and saved with their vocabulary:
+
+        genres  the pipe-separated genres,
+        tags    free-text tags given by users (when `tags.csv` exists),
+        title   words of the normalised title,
+        year    decade and half-decade of release, so that nearby years
+                share a feature.
+
+    Each block is written to its own files, so a block can be added or
+    refitted without recomputing the others. `FeatureStore.matrix` stacks
+    the L2-normalised blocks, each scaled by the square root of its
+    weight, so that the cosine similarity of two movies is the weighted
+    sum of their per-block similarities. Further blocks are added with
+    `register_block`.
+
+    To (re)build every block, run from the root of the repository:
+
+        python -m utils.feature_store
+
+"""
+# Script dependencies
+import os
+import json
+
+# Data handling dependencies
+import numpy as np
+import pandas as pd
+import scipy.sparse as sps
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from utils.title_index import normalise_title, release_year
+
+FEATURE_STORE_DIR = 'resources/models/features'
+
+_blocks = {}
+
+def register_block(name, documents, weight=1.0, **vectorizer_options):
+    """Register a feature block.
+
+    Parameters
+    ----------
+    name : str
+        Name of the block.
+    documents : callable
+        Function of the movie catalogue returning one text document per
+        movie, in catalogue order.
+    weight : float
+        Relative contribution of the block to movie similarity.
+    **vectorizer_options
+        Passed on to `sklearn.feature_extraction.text.TfidfVectorizer`.
+
+    """
+    _blocks[name] = {'documents': documents,
+                     'weight': weight,
+                     'options': vectorizer_options}
+
+def missing_blocks(movies, store_dir=FEATURE_STORE_DIR):
+    """Registered blocks not yet built for this movie catalogue."""
+    ids_path = os.path.join(store_dir, 'item_ids.npy')
+    if not os.path.exists(ids_path) or not np.array_equal(np.load(ids_path), movies['movieId'].values):
+        return list(_blocks)
+    return [name for name in _blocks if not os.path.exists(_block_path(store_dir, name, 'npz'))]
+
+def _genre_documents(movies):
+    genres = movies['genres'].astype(str).str.replace('(no genres listed)', '', regex=False)
+    return genres.str.replace('|', ' ', regex=False).tolist()
+
+def _tag_documents(movies):
+    from utils import registry
+    tags = registry.get('tags')
+    if tags.empty:
+        return [''] * len(movies)
+    text = tags.dropna(subset=['tag']).groupby('movieId', observed=True)['tag'].agg(
+        lambda values: ' '.join(map(str, values)))
+    return text.reindex(movies['movieId']).fillna('').tolist()
+
+def _title_documents(movies):
+    return [normalise_title(title) for title in movies['title'].astype(str)]
+
+def _year_documents(movies):
+    documents = []
+    for title in movies['title'].astype(str):
+        year = release_year(title)
+        documents.append('' if year is None else f'decade{year // 10 * 10} half{year // 5 * 5}')
+    return documents
+
+register_block('genres', _genre_documents, weight=1.0,
+               token_pattern=r'[^\s]+', lowercase=False)
+register_block('tags', _tag_documents, weight=0.5,
+               stop_words='english', min_df=2)
+register_block('title', _title_documents, weight=0.3,
+               stop_words='english', min_df=2)
+register_block('year', _year_documents, weight=0.3)
+
+def _block_path(store_dir, name, suffix):
+    return os.path.join(store_dir, f'{name}.{suffix}')
+
+def build_block(name, movies, store_dir=FEATURE_STORE_DIR):
+    """Fit and save one feature block over a movie catalogue.
+
+    Parameters
+    ----------
+    name : str
+        Name of a registered block.
+    movies : Pandas DataFrame
+        Movie catalogue with `movieId`, `title` and `genres` columns.
+    store_dir : str
+        Directory of the feature store.
+
+    Returns
+    -------
+    int
+        Number of features of the block.
+
+    """
+    block = _blocks[name]
+    os.makedirs(store_dir, exist_ok=True)
+    item_ids = np.asarray(movies['movieId'])
+    ids_path = os.path.join(store_dir, 'item_ids.npy')
+    if not os.path.exists(ids_path) or not np.array_equal(np.load(ids_path), item_ids):
+        # A different catalogue invalidates every existing block
+        for path in os.listdir(store_dir):
+            os.remove(os.path.join(store_dir, path))
+        np.save(ids_path, item_ids)
+
+    vectorizer = TfidfVectorizer(dtype=np.float32, **block['options'])
+    documents = block['documents'](movies)
+    try:
+        matrix = vectorizer.fit_transform(documents).tocsr()
+        vocabulary = {term: int(column) for term, column in vectorizer.vocabulary_.items()}
+        idf = vectorizer.idf_.tolist()
+    except ValueError:
+        # No document holds any term (e.g. no tags available)
+        matrix = sps.csr_matrix((len(documents), 0), dtype=np.float32)
+        vocabulary, idf = {}, []
+    with open(_block_path(store_dir, name, 'npz'), 'wb') as f:
+        np.savez(f, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+                 shape=np.asarray(matrix.shape))
+    with open(_block_path(store_dir, name, 'vocab.json'), 'w') as f:
+        json.dump({'vocabulary': vocabulary, 'idf': idf}, f)
+    return matrix.shape[1]
+
+def build_feature_store(movies, store_dir=FEATURE_STORE_DIR, blocks=None):
+    """Fit and save feature blocks.
+
+    Parameters
+    ----------
+    movies : Pandas DataFrame
+        Movie catalogue.
+    store_dir : str
+        Directory of the feature store.
+    blocks : list (str), optional
+        Blocks to (re)build. Every registered block when omitted.
+
+    """
+    for name in list(_blocks) if blocks is None else blocks:
+        print(f'... Building the {name} feature block')
+        n_features = build_block(name, movies, store_dir)
+        print(f'... {n_features} {name} features')
+
+class FeatureStore:
+    """Read access to the saved feature blocks.
+
+    Parameters
+    ----------
+    store_dir : str
+        Directory of the feature store.
+
+    """
+
+    def __init__(self, store_dir=FEATURE_STORE_DIR):
+        self.store_dir = store_dir
+        self.item_ids = np.load(os.path.join(store_dir, 'item_ids.npy'))
+        self.blocks = {}
+        for name in _blocks:
+            path = _block_path(store_dir, name, 'npz')
+            if os.path.exists(path):
+                with np.load(path) as f:
+                    self.blocks[name] = sps.csr_matrix((f['data'], f['indices'], f['indptr']),
+                                                       shape=tuple(f['shape']))
+
+    def vocabulary(self, name):
+        """Feature names of a block, in column order."""
+        with open(_block_path(self.store_dir, name, 'vocab.json')) as f:
+            vocabulary = json.load(f)['vocabulary']
+        return sorted(vocabulary, key=vocabulary.get)
+
+    def matrix(self, weights=None):
+        """Weighted concatenation of the blocks, one row per movie.
+
+        Parameters
+        ----------
+        weights : dict, optional
+            Weight of each block, overriding the registered weights. A
+            block with weight 0 is left out.
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+            The combined feature matrix.
+
+        """
+        parts = []
+        for name, block in self.blocks.items():
+            weight = (weights or {}).get(name, _blocks[name]['weight'])
+            if weight > 0 and block.shape[1]:
+                parts.append(normalize(block, norm='l2', axis=1) * np.float32(np.sqrt(weight)))
+        if not parts:
+            return sps.csr_matrix((len(self.item_ids), 0), dtype=np.float32)
+        return sps.hstack(parts, format='csr', dtype=np.float32)
+
+if __name__ == '__main__':
+    from utils import registry
+    build_feature_store(registry.get('movies'))
+    print(f"Feature store built. Saved to: {FEATURE_STORE_DIR}")
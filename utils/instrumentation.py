@@ -0,0 +1,347 @@
+"""
+
+    Recommendation pipeline instrumentation.
+
+    Author: Explore Data Science Academy.
+
+    Description: Lightweight, dependency-free instrumentation of the
+    recommendation hot path:
+
+        - `request` traces one recommendation: its total time, the change
+          in resident memory, and the time spent in each stage,
+        - `stage` times a named stage (e.g. load, resolve, similarity,
+          rank), attributed to the current request when there is one,
+        - `count` increments a named event counter (e.g. cache_hit).
+
+    Every finished request is emitted as one JSON log line on the
+    `recommenders` logger, and is kept as `last_trace` for the Streamlit
+    debug panel. Counters and latency histograms are aggregated per
+    process and rendered in the Prometheus text format by
+    `render_metrics`, served by the API under `GET /metrics`.
+
+    Behaviour is configured through environment variables:
+
+        RECOMMENDER_LOG_LEVEL    Emit the JSON logs to stderr at this level
+                                 (INFO logs every request; default off).
+        RECOMMENDER_PROFILE      'cprofile' or 'tracemalloc' to dump a
+                                 profile of every request (default off).
+                                 tracemalloc also records the memory
+                                 allocated by each stage.
+        RECOMMENDER_PROFILE_DIR  Directory of the profile dumps (default
+                                 `resources/profiles`).
+
+"""
+# Script dependencies
+import os
+import json
+import time
+import bisect
+import logging
+import cProfile
+import itertools
+import threading
+import tracemalloc
+import contextvars
+from contextlib import contextmanager
+
+PROFILE_MODE = os.environ.get('RECOMMENDER_PROFILE', '').lower()
+PROFILE_DIR = os.environ.get('RECOMMENDER_PROFILE_DIR', 'resources/profiles')
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger('recommenders')
+
+class JsonFormatter(logging.Formatter):
+    """Formats a log record, and its structured fields, as one JSON line."""
+
+    def format(self, record):
+        event = {'time': round(record.created, 3),
+                 'level': record.levelname,
+                 'event': record.getMessage()}
+        event.update(getattr(record, 'fields', {}))
+        return json.dumps(event, default=str)
+
+def configure_logging(level='INFO', stream=None):
+    """Emit the structured logs as JSON lines.
+
+    Parameters
+    ----------
+    level : str
+        Minimum level of the emitted records.
+    stream : file-like, optional
+        Destination. Defaults to stderr.
+
+    """
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    logger.handlers[:] = [handler]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+if os.environ.get('RECOMMENDER_LOG_LEVEL'):
+    configure_logging(os.environ['RECOMMENDER_LOG_LEVEL'])
+
+def log_event(event, level=logging.INFO, **fields):
+    """Log a structured event with arbitrary JSON-serialisable fields."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
+
+# ------------------------------------------------------------------------
+# Process-wide metrics
+# ------------------------------------------------------------------------
+
+_lock = threading.Lock()
+_metrics = {}
+_counters = {}
+_histograms = {}
+_gauges = []
+
+def describe(name, kind, description):
+    """Declare a metric's Prometheus type ('counter', 'histogram' or
+    'gauge') and help text."""
+    _metrics[name] = (kind, description)
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+def increment(name, value=1, **labels):
+    """Add to a counter."""
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, **labels):
+    """Record a value (in seconds) in a histogram."""
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0]
+        histogram[0][bisect.bisect_left(BUCKETS, value)] += 1
+        histogram[1] += value
+
+def register_gauge(name, description, callback):
+    """Register a gauge whose values are read when metrics are rendered.
+
+    Parameters
+    ----------
+    name : str
+        Metric name.
+    description : str
+        Help text.
+    callback : callable
+        Zero-argument function returning a dict which maps label dicts,
+        given as tuples of (label, value) pairs, to numbers.
+
+    """
+    describe(name, 'gauge', description)
+    _gauges.append((name, callback))
+
+def _format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+def render_metrics():
+    """Every metric in the Prometheus text exposition format.
+
+    Returns
+    -------
+    str
+        The metrics, one sample per line.
+
+    """
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (list(counts), total) for key, (counts, total) in _histograms.items()}
+    samples = {}
+    for (name, labels), value in sorted(counters.items()):
+        samples.setdefault(name, []).append(f'{name}{_format_labels(labels)} {value}')
+    for (name, labels), (counts, total) in sorted(histograms.items()):
+        lines = samples.setdefault(name, [])
+        for bound, cumulative in zip(BUCKETS + ('+Inf',), itertools.accumulate(counts)):
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+        lines.append(f'{name}_count{_format_labels(labels)} {sum(counts)}')
+    for name, callback in _gauges:
+        lines = samples.setdefault(name, [])
+        for labels, value in sorted(callback().items()):
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+    output = []
+    for name in sorted(samples):
+        kind, description = _metrics.get(name, ('untyped', name))
+        output.append(f'# HELP {name} {description}')
+        output.append(f'# TYPE {name} {kind}')
+        output.extend(samples[name])
+    return '\n'.join(output) + '\n'
+
+describe('recommender_requests_total', 'counter', 'Recommendation requests by outcome.')
+describe('recommender_request_seconds', 'histogram', 'Recommendation request latency.')
+describe('recommender_stage_seconds', 'histogram', 'Time spent in each pipeline stage.')
+describe('recommender_events_total', 'counter', 'Pipeline events such as cache hits.')
+
+# ------------------------------------------------------------------------
+# Request traces
+# ------------------------------------------------------------------------
+
+_current = contextvars.ContextVar('recommender_trace', default=None)
+_last_trace = None
+_profile_lock = threading.Lock()
+_profile_ids = itertools.count()
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def _rss_bytes():
+    # Resident memory of the process, where /proc is available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+class Trace:
+    """Stage timings and counters of one recommendation request."""
+
+    def __init__(self, algorithm, n_seeds, top_n):
+        self.algorithm = algorithm
+        self.n_seeds = n_seeds
+        self.top_n = top_n
+        self.status = None
+        self.seconds = None
+        self.memory_bytes = None
+        self.profile = None
+        self.stages = {}
+        self.counters = {}
+
+    def as_dict(self):
+        """The trace as JSON-serialisable fields."""
+        return {'algorithm': self.algorithm,
+                'seeds': self.n_seeds,
+                'top_n': self.top_n,
+                'status': self.status,
+                'seconds': self.seconds,
+                'memory_bytes': self.memory_bytes,
+                'stages': {name: dict(values) for name, values in self.stages.items()},
+                'counters': dict(self.counters),
+                'profile': self.profile}
+
+def current_trace():
+    """The trace of the request being computed, or `None`."""
+    return _current.get()
+
+def last_trace():
+    """Fields of the most recently finished request, or `None`."""
+    return None if _last_trace is None else _last_trace.as_dict()
+
+@contextmanager
+def stage(name):
+    """Time a named stage of the pipeline.
+
+    The time is added to the current request's trace (a stage entered
+    repeatedly is summed) and to the stage latency histogram.
+
+    """
+    trace = _current.get()
+    tracing = trace is not None and tracemalloc.is_tracing()
+    memory = tracemalloc.get_traced_memory()[0] if tracing else 0
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        observe('recommender_stage_seconds', seconds,
+                algorithm=trace.algorithm if trace is not None else 'offline', stage=name)
+        if trace is None:
+            log_event('stage', logging.DEBUG, stage=name, seconds=seconds)
+        else:
+            entry = trace.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            entry['seconds'] += seconds
+            entry['calls'] += 1
+            if tracing:
+                entry['memory_bytes'] = (entry.get('memory_bytes', 0)
+                                         + tracemalloc.get_traced_memory()[0] - memory)
+
+def count(event, value=1):
+    """Increment an event counter, globally and on the current trace."""
+    increment('recommender_events_total', value, event=event)
+    trace = _current.get()
+    if trace is not None:
+        trace.counters[event] = trace.counters.get(event, 0) + value
+
+def _start_profile():
+    # One request is profiled at a time; concurrent ones are not
+    if PROFILE_MODE not in ('cprofile', 'tracemalloc') or not _profile_lock.acquire(blocking=False):
+        return None
+    if PROFILE_MODE == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    tracemalloc.start()
+    return tracemalloc
+
+def _stop_profile(profiler, trace):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stem = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+                                         f"{next(_profile_ids)}-{trace.algorithm}")
+        if profiler is tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            path = f'{stem}.txt'
+            with open(path, 'w') as f:
+                for statistic in snapshot.statistics('lineno')[:50]:
+                    f.write(f'{statistic}\n')
+        else:
+            profiler.disable()
+            path = f'{stem}.prof'
+            profiler.dump_stats(path)
+        return path
+    finally:
+        _profile_lock.release()
+
+@contextmanager
+def request(algorithm, movie_list, top_n):
+    """Trace one recommendation request.
+
+    Parameters
+    ----------
+    algorithm : str
+        Name of the algorithm.
+    movie_list : list (str)
+        Seed movies.
+    top_n : int
+        Number of recommendations.
+
+    Yields
+    ------
+    Trace
+        The request's trace, filled in as the stages run.
+
+    """
+    global _last_trace
+    trace = Trace(algorithm, len(movie_list), top_n)
+    token = _current.set(trace)
+    rss = _rss_bytes()
+    profiler = _start_profile()
+    start = time.perf_counter()
+    trace.status = 'ok'
+    try:
+        yield trace
+    except ValueError:
+        trace.status = 'invalid'
+        raise
+    except Exception:
+        trace.status = 'error'
+        raise
+    finally:
+        trace.seconds = time.perf_counter() - start
+        _current.reset(token)
+        if profiler is not None:
+            trace.profile = _stop_profile(profiler, trace)
+        end_rss = _rss_bytes()
+        if rss is not None and end_rss is not None:
+            trace.memory_bytes = end_rss - rss
+        increment('recommender_requests_total', algorithm=algorithm, status=trace.status)
+        observe('recommender_request_seconds', trace.seconds, algorithm=algorithm)
+        _last_trace = trace
+        log_event('recommendation', **trace.as_dict())
@@ -0,0 +1,206 @@
+"""
+
+    Genre and release year filter indexes.
+
+    Author: Explore Data Science Academy.
+
+    Description: Precomputed indexes over the movie catalogue, so that
+    recommendations can be restricted to e.g. "comedies released after
+    2000" while candidates are scored, rather than by post-filtering a
+    top-n which would then come up short:
+
+        - one bitmap per genre, with a bit per movie (in movieId order),
+        - the movies sorted by release year (parsed from the title), so a
+          year range is a single slice of a sorted id list.
+
+    A filter is a `MovieFilter`; selected genres are combined with OR,
+    and then with the year range with AND. `FilterIndex.mask_for` turns
+    a filter into a boolean mask over the rows of any model artifact
+    (content index, similarity store, SVD factors, popularity table);
+    masks and row alignments are cached, so a repeated filter costs a
+    single array gather. The index is built from `movies.csv` on first
+    use, and rebuilt when the catalogue changes.
+
+"""
+# Script dependencies
+import os
+import weakref
+import functools
+import threading
+from collections import namedtuple, OrderedDict
+
+# Data handling dependencies
+import numpy as np
+
+from utils import registry
+from utils.title_index import release_year
+
+FILTER_INDEX_PATH = 'resources/models/movie_filters.npz'
+NO_GENRE = '(no genres listed)'
+# Row alignments of artifact id arrays kept per process
+ALIGNMENT_CACHE_SIZE = 32
+
+MovieFilter = namedtuple('MovieFilter', ['genres', 'year_from', 'year_to'])
+
+def make_filter(genres=None, year_from=None, year_to=None):
+    """Normalise filter options into a hashable `MovieFilter`.
+
+    Parameters
+    ----------
+    genres : list (str), optional
+        Genres, any of which a movie must have.
+    year_from : int, optional
+        First release year, inclusive.
+    year_to : int, optional
+        Last release year, inclusive.
+
+    Returns
+    -------
+    MovieFilter or None
+        `None` when no option restricts the catalogue.
+
+    """
+    genres = tuple(sorted(set(genres or ())))
+    year_from = None if year_from is None else int(year_from)
+    year_to = None if year_to is None else int(year_to)
+    if not genres and year_from is None and year_to is None:
+        return None
+    return MovieFilter(genres, year_from, year_to)
+
+def build_filter_index(movies, save_path=FILTER_INDEX_PATH):
+    """Build and save the genre bitmaps and year ordering of a catalogue.
+
+    Parameters
+    ----------
+    movies : Pandas DataFrame
+        Movie catalogue with `movieId`, `title` and `genres` columns.
+    save_path : str
+        Location to write the `.npz` index.
+
+    """
+    movies = movies.drop_duplicates('movieId').sort_values('movieId')
+    movie_ids = movies['movieId'].to_numpy(dtype=np.int64)
+    genres = movies['genres'].astype(str).str.split('|')
+    names = sorted({genre for movie_genres in genres for genre in movie_genres} - {NO_GENRE})
+    columns = {name: i for i, name in enumerate(names)}
+    members = np.zeros((len(names), len(movie_ids)), dtype=bool)
+    for row, movie_genres in enumerate(genres):
+        for genre in movie_genres:
+            if genre in columns:
+                members[columns[genre], row] = True
+    # Movies without a year sort first, as year 0
+    years = np.array([release_year(title) or 0 for title in movies['title'].astype(str)],
+                     dtype=np.int16)
+    by_year = np.argsort(years, kind='stable').astype(np.int32)
+    with open(save_path, 'wb') as f:
+        np.savez(f, movie_ids=movie_ids, genre_names=np.array(names),
+                 genre_bitmaps=np.packbits(members, axis=1),
+                 by_year=by_year, sorted_years=years[by_year])
+
+class FilterIndex:
+    """Boolean masks of the movies matching a filter.
+
+    Parameters
+    ----------
+    path : str
+        Location of the `.npz` index written by `build_filter_index`.
+
+    """
+
+    def __init__(self, path=FILTER_INDEX_PATH):
+        with np.load(path) as f:
+            self.movie_ids = f['movie_ids']
+            self.genres = f['genre_names'].tolist()
+            self.bitmaps = f['genre_bitmaps']
+            self.by_year = f['by_year']
+            self.sorted_years = f['sorted_years']
+        self._genre_rows = {genre: i for i, genre in enumerate(self.genres)}
+        known = self.sorted_years[self.sorted_years > 0]
+        self.years = (int(known[0]), int(known[-1])) if len(known) else (0, 0)
+        self._lock = threading.Lock()
+        self._alignments = OrderedDict()
+        self.mask = functools.lru_cache(maxsize=256)(self._mask)
+
+    def _mask(self, movie_filter):
+        # Mask over `movie_ids`; cached by `mask`, hence read-only
+        n = len(self.movie_ids)
+        mask = np.ones(n, dtype=bool)
+        if movie_filter.genres:
+            unknown = [genre for genre in movie_filter.genres if genre not in self._genre_rows]
+            if unknown:
+                raise ValueError(f'Unknown genres {unknown}')
+            rows = [self._genre_rows[genre] for genre in movie_filter.genres]
+            bits = np.bitwise_or.reduce(self.bitmaps[rows], axis=0)
+            mask &= np.unpackbits(bits, count=n).astype(bool)
+        if movie_filter.year_from is not None or movie_filter.year_to is not None:
+            # Movies with an unknown year never match a year range
+            start = np.searchsorted(self.sorted_years, max(movie_filter.year_from or 1, 1), 'left')
+            stop = np.searchsorted(self.sorted_years, movie_filter.year_to or np.iinfo(np.int16).max,
+                                   'right')
+            in_range = np.zeros(n, dtype=bool)
+            in_range[self.by_year[start:stop]] = True
+            mask &= in_range
+        mask.flags.writeable = False
+        return mask
+
+    def _rows(self, item_ids):
+        # Row of each item in the index (-1 if unknown), per artifact.
+        # Alignments are held in a bounded LRU, keyed by the id of a live
+        # array: only a weak reference is kept, and the entry is dropped
+        # with the array, so a reused id never matches a stale entry.
+        key = id(item_ids)
+        with self._lock:
+            entry = self._alignments.get(key)
+            if entry is not None and entry[0]() is item_ids:
+                self._alignments.move_to_end(key)
+                return entry[1]
+        ids = np.asarray(item_ids)
+        rows = np.minimum(np.searchsorted(self.movie_ids, ids), len(self.movie_ids) - 1)
+        rows[self.movie_ids[rows] != ids] = -1
+        try:
+            reference = weakref.ref(item_ids, lambda _, key=key: self._forget(key))
+        except TypeError:
+            # e.g. a list: aligned again on every call
+            return rows
+        with self._lock:
+            self._alignments[key] = (reference, rows)
+            while len(self._alignments) > ALIGNMENT_CACHE_SIZE:
+                self._alignments.popitem(last=False)
+        return rows
+
+    def _forget(self, key):
+        with self._lock:
+            entry = self._alignments.get(key)
+            if entry is not None and entry[0]() is None:
+                del self._alignments[key]
+
+    def mask_for(self, item_ids, movie_filter):
+        """Mask of the items matching a filter.
+
+        Parameters
+        ----------
+        item_ids : numpy.ndarray
+            Movie IDs of the rows of a model artifact. The alignment of
+            the most recently used arrays is cached, so pass the same
+            array object on every call.
+        movie_filter : MovieFilter
+            The filter, see `make_filter`.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean mask aligned with `item_ids`. Movies missing from the
+            catalogue never match.
+
+        """
+        rows = self._rows(item_ids)
+        return self.mask(movie_filter)[rows] & (rows >= 0)
+
+def _load_filter_index():
+    # Built on first use, and again whenever the catalogue is newer
+    if (not os.path.exists(FILTER_INDEX_PATH)
+            or os.path.getmtime(FILTER_INDEX_PATH) < os.path.getmtime(registry.MOVIES_PATH)):
+        build_filter_index(registry.get('movies'), FILTER_INDEX_PATH)
+    return FilterIndex(FILTER_INDEX_PATH)
+
+registry.register('movie_filters', _load_filter_index)
@@ -0,0 +1,426 @@
+"""
+
+    Sparse top-K nearest-neighbour index.
+
+    Author: Explore Data Science Academy.
+
+    Description: Helper functions used to build, store and query a
+    truncated item-item similarity index. Row `i` of the index is a sparse
+    CSR row holding the positions and cosine scores of the `k` items most
+    similar to item `i`, so that a lookup costs O(k) rather than requiring
+    a dense N x N similarity matrix to be held in memory.
+
+    Building the index never materialises the N x N matrix either: rows
+    are scored in blocks, in parallel on a thread pool (the sparse
+    products and selections release the GIL), each block keeps only the
+    top k of its rows by partial selection, and writes them straight into
+    the preallocated sparse output. The block size follows from a memory
+    budget, set by the `RECOMMENDER_SIMILARITY_MEMORY_MB` environment
+    variable (default 1024), so the full 62k-movie catalogue builds on an
+    ordinary machine.
+
+"""
+# Script dependencies
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Data handling dependencies
+import numpy as np
+import scipy.sparse as sps
+from sklearn.preprocessing import normalize
+
+from utils.quantisation import quantise_sparse_rows
+
+# Memory (bytes) the score blocks of a build may use at once
+MEMORY_BUDGET = int(os.environ.get('RECOMMENDER_SIMILARITY_MEMORY_MB', 1024)) * 2**20
+# Working memory per scored row, per catalogue item: the float32 scores,
+# the sparse product they are expanded from, their negation and the
+# int64 positions of the partial selection
+BYTES_PER_SCORE = 24
+
+def block_size_for(n_items, workers=1, memory_budget=None):
+    """Rows scored per block so that `workers` blocks fit the budget.
+
+    Parameters
+    ----------
+    n_items : int
+        Number of items in the catalogue.
+    workers : int
+        Number of blocks scored at the same time.
+    memory_budget : int, optional
+        Bytes available. Defaults to `MEMORY_BUDGET`.
+
+    Returns
+    -------
+    int
+        Block size, at least 1.
+
+    """
+    memory_budget = MEMORY_BUDGET if memory_budget is None else memory_budget
+    rows = memory_budget // (max(workers, 1) * BYTES_PER_SCORE * max(n_items, 1))
+    return int(max(1, min(rows, n_items)))
+
+def _prepare(features):
+    # Unit-length rows, and their transpose for row-block products
+    features = normalize(sps.csr_matrix(features, dtype=np.float32), norm='l2', axis=1)
+    return features, features.T.tocsr()
+
+def _topk_block(features, features_t, rows, k):
+    # Scores of `rows` against every item, and the top-k of each row. A
+    # sparse product comes out row-major, so no transposed copy is made.
+    scores = (features[rows] @ features_t).toarray()
+    # An item is never its own neighbour
+    scores[np.arange(len(rows)), rows] = -np.inf
+    if k == 0:
+        top = np.empty((len(rows), 0), dtype=np.int64)
+    else:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    # Sort the k survivors only, breaking ties by catalogue position
+    order = np.lexsort((top, -top_scores), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    if k:
+        # The partition picks arbitrarily among items tied with the k-th
+        # score: those rows are re-ranked over every tied item
+        kth = top_scores[:, -1]
+        tied = np.flatnonzero((kth > 0) & ((scores >= kth[:, None]).sum(axis=1) > k))
+        for row in tied:
+            candidates = np.flatnonzero(scores[row] >= kth[row])
+            best = candidates[np.lexsort((candidates, -scores[row, candidates]))[:k]]
+            top[row], top_scores[row] = best, scores[row, best]
+    # Items with no overlap at all are not neighbours
+    keep = top_scores > 0
+    return scores, top, top_scores, keep
+
+def build_topk_index(features, k=50, block_size=None, workers=None, memory_budget=None):
+    """Build a top-k cosine neighbour index over the rows of a matrix.
+
+    Parameters
+    ----------
+    features : array-like or scipy.sparse matrix
+        Item feature matrix with one row per item.
+    k : int
+        Number of neighbours to retain for each item.
+    block_size : int, optional
+        Number of rows scored at once by each worker. Derived from the
+        memory budget when omitted.
+    workers : int, optional
+        Number of threads scoring blocks. Defaults to the number of CPUs.
+    memory_budget : int, optional
+        Bytes the blocks being scored may hold together. Defaults to
+        `MEMORY_BUDGET`.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Square (n_items x n_items) matrix whose row `i` contains the
+        scores of the `k` nearest neighbours of item `i`, sorted in
+        descending order of similarity. The item itself is excluded.
+
+    """
+    features, features_t = _prepare(features)
+    n_items = features.shape[0]
+    k = max(0, min(k, n_items - 1))
+    workers = workers or os.cpu_count()
+    if block_size is None:
+        block_size = block_size_for(n_items, workers, memory_budget)
+
+    # Each block writes its rows of the output in place
+    top = np.zeros((n_items, k), dtype=np.int32)
+    top_scores = np.zeros((n_items, k), dtype=np.float32)
+    keep = np.zeros((n_items, k), dtype=bool)
+
+    def score_block(start):
+        stop = min(start + block_size, n_items)
+        _, block_top, block_scores, block_keep = _topk_block(features, features_t,
+                                                             np.arange(start, stop), k)
+        top[start:stop] = block_top
+        top_scores[start:stop] = block_scores
+        keep[start:stop] = block_keep
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='similarity') as pool:
+        # Consumed so that a failing block raises here
+        list(pool.map(score_block, range(0, n_items, block_size)))
+
+    indptr = np.concatenate([[0], np.cumsum(keep.sum(axis=1), dtype=np.int64)])
+    return sps.csr_matrix((top_scores[keep], top[keep], indptr), shape=(n_items, n_items))
+
+def update_topk_index(neighbours, features, positions, k=50, block_size=None):
+    """Patch a top-k neighbour index after some items' features changed.
+
+    The rows of the changed items are recomputed in full. In every other
+    row, only the scores of the changed items are replaced, so a row
+    which loses a changed item may hold fewer than `k` neighbours (the
+    item which would take its place is not searched for) until the index
+    is next rebuilt with `build_topk_index`.
+
+    Parameters
+    ----------
+    neighbours : scipy.sparse.csr_matrix
+        Index produced by `build_topk_index` over the first rows of
+        `features`. Rows beyond its shape are new items.
+    features : array-like or scipy.sparse matrix
+        Current item feature matrix with one row per item.
+    positions : array-like (int)
+        Rows of `features` which changed or were added.
+    k : int
+        Number of neighbours retained for each item.
+    block_size : int, optional
+        Number of changed rows scored at once. Derived from the memory
+        budget when omitted.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        The patched (n_items x n_items) index.
+
+    """
+    features, features_t = _prepare(features)
+    n_items = features.shape[0]
+    k = max(0, min(k, n_items - 1))
+    block_size = block_size or block_size_for(n_items)
+    positions = np.unique(np.asarray(positions, dtype=np.int64))
+    changed = np.zeros(n_items, dtype=bool)
+    changed[positions] = True
+
+    # Stored pairs which involve no changed item remain valid
+    old = sps.coo_matrix(neighbours)
+    # Items missing from a full row scored at most its k-th score, so a
+    # changed item may only enter the row by beating that score
+    counts = np.bincount(old.row, minlength=n_items)
+    threshold = np.full(n_items, np.inf, dtype=np.float32)
+    np.minimum.at(threshold, old.row, old.data.astype(np.float32))
+    threshold[counts < k] = 0
+    keep = ~changed[old.row] & ~changed[old.col]
+    rows, cols, data = [old.row[keep]], [old.col[keep]], [old.data[keep].astype(np.float32)]
+
+    for start in range(0, len(positions), block_size):
+        block = positions[start:start + block_size]
+        scores, top, top_scores, keep = _topk_block(features, features_t, block, k)
+        rows.append(np.repeat(block, keep.sum(axis=1)))
+        cols.append(top[keep])
+        data.append(top_scores[keep].astype(np.float32))
+        # Similarity is symmetric: row i of the block is column i of the index
+        source, target = np.nonzero((scores > threshold) & ~changed)
+        rows.append(target)
+        cols.append(block[source])
+        data.append(scores[source, target].astype(np.float32))
+
+    rows, cols, data = np.concatenate(rows), np.concatenate(cols), np.concatenate(data)
+    # Order by row, then by descending score and position, and keep k per row
+    order = np.lexsort((cols, -data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    counts = np.bincount(rows, minlength=n_items)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    keep = np.arange(len(rows)) - starts < k
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows[keep], minlength=n_items))])
+    return sps.csr_matrix((data[keep], cols[keep].astype(np.int32), indptr),
+                          shape=(n_items, n_items))
+
+class QuantisedNeighbours:
+    """A read-only neighbour index with 8-bit scores and one scale per row.
+
+    Holds the `indptr`, `indices` and `data` arrays of the CSR index,
+    with `data` as uint8 codes (see `utils.quantisation`), so that it can
+    be queried in place of the `scipy.sparse.csr_matrix` index.
+
+    """
+
+    def __init__(self, data, indices, indptr, shape, scales):
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = shape
+        self.scales = scales
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def toarray(self):
+        """The dequantised index as a dense array."""
+        return self.tocsr().toarray()
+
+    def tocsr(self):
+        """The dequantised index as a float32 CSR matrix."""
+        rows = np.repeat(self.scales, np.diff(self.indptr))
+        return sps.csr_matrix((self.data * rows, self.indices, self.indptr), shape=self.shape)
+
+def _entry_scores(neighbours, entries, rows):
+    # Scores of stored entries, dequantised with their rows' scales
+    scores = neighbours.data[entries].astype(np.float64)
+    scales = getattr(neighbours, 'scales', None)
+    if scales is not None:
+        scores *= scales[rows]
+    return scores
+
+def save_index(path, neighbours, item_ids, precision='float32'):
+    """Persist a neighbour index and its item ids to a single `.npz` file.
+
+    Parameters
+    ----------
+    path : str
+        Destination file path.
+    neighbours : scipy.sparse.csr_matrix
+        Index produced by `build_topk_index`.
+    item_ids : array-like
+        Item id (e.g. MovieLens movieId) of each index row.
+    precision : str
+        'float32', or 'int8' to store the scores as 8-bit codes with one
+        scale per row.
+
+    """
+    neighbours = sps.csr_matrix(neighbours)
+    data, scales = neighbours.data, {}
+    if precision == 'int8':
+        data, scales['scales'] = quantise_sparse_rows(neighbours.data, neighbours.indptr)
+    with open(path, 'wb') as f:
+        np.savez(f,
+                 data=data,
+                 indices=neighbours.indices,
+                 indptr=neighbours.indptr,
+                 shape=np.asarray(neighbours.shape),
+                 item_ids=np.asarray(item_ids),
+                 **scales)
+
+def load_index(path):
+    """Load a neighbour index written by `save_index`.
+
+    Parameters
+    ----------
+    path : str
+        Path to the `.npz` index file.
+
+    Returns
+    -------
+    tuple (scipy.sparse.csr_matrix or QuantisedNeighbours, numpy.ndarray)
+        The neighbour matrix and the item id of each of its rows. An int8
+        index is returned as a `QuantisedNeighbours`.
+
+    """
+    with np.load(path) as f:
+        if 'scales' in f:
+            neighbours = QuantisedNeighbours(f['data'], f['indices'], f['indptr'],
+                                             tuple(f['shape']), f['scales'])
+        else:
+            neighbours = sps.csr_matrix((f['data'], f['indices'], f['indptr']),
+                                        shape=tuple(f['shape']))
+        item_ids = f['item_ids']
+    return neighbours, item_ids
+
+def query_neighbours(neighbours, position):
+    """Return the stored neighbours of a single item.
+
+    Parameters
+    ----------
+    neighbours : scipy.sparse.csr_matrix or QuantisedNeighbours
+        Index produced by `build_topk_index`, or loaded by `load_index`.
+    position : int
+        Row position of the item within the index.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        Neighbour positions and their similarity scores, most similar
+        first.
+
+    """
+    start, stop = neighbours.indptr[position], neighbours.indptr[position + 1]
+    scores = _entry_scores(neighbours, slice(start, stop), position)
+    return neighbours.indices[start:stop], scores.astype(np.float32)
+
+def fuse_neighbours(neighbours, positions, weights=None, method='sum', k=None, exclude=None,
+                    allowed=None):
+    """Fuse the stored neighbour lists of several seed items into one ranking.
+
+    Only the `len(positions) * k` stored entries are touched, so the cost
+    grows linearly with the number of seeds and does not depend on the
+    catalogue size.
+
+    Parameters
+    ----------
+    neighbours : scipy.sparse.csr_matrix or QuantisedNeighbours
+        Index produced by `build_topk_index`, or loaded by `load_index`.
+    positions : list (int)
+        Row positions of the seed items, in any number.
+    weights : list (float), optional
+        Weight of each seed, multiplying its similarity scores. Seeds
+        count equally when omitted.
+    method : str
+        'sum' adds up each candidate's weighted similarity to every seed,
+        favouring items close to several seeds; 'max' keeps its best one.
+    k : int, optional
+        Number of candidates returned. All of them are returned, ranked,
+        when omitted.
+    exclude : array-like, optional
+        Positions which may not appear in the result (typically the seeds).
+    allowed : numpy.ndarray, optional
+        Boolean mask of the positions which may appear in the result,
+        applied before the top-k selection (see `utils.movie_filters`).
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        Candidate positions and their fused scores, best first, ties
+        broken by position. Each candidate appears once, and the result
+        does not depend on the order of `positions`.
+
+    """
+    if method not in ('sum', 'max'):
+        raise ValueError(f"Unknown fusion method '{method}'")
+    positions = np.asarray(positions, dtype=np.int64)
+    starts, stops = neighbours.indptr[positions], neighbours.indptr[positions + 1]
+    lengths = stops - starts
+    # Offsets of every stored entry of the seed rows, gathered at once
+    entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    candidates = neighbours.indices[entries]
+    scores = _entry_scores(neighbours, entries, np.repeat(positions, lengths))
+    if weights is not None:
+        scores *= np.repeat(np.asarray(weights, dtype=np.float64), lengths)
+
+    unique, inverse = np.unique(candidates, return_inverse=True)
+    if method == 'sum':
+        fused = np.bincount(inverse, weights=scores, minlength=len(unique))
+    else:
+        fused = np.full(len(unique), -np.inf)
+        np.maximum.at(fused, inverse, scores)
+    if exclude is not None:
+        keep = ~np.isin(unique, exclude)
+        unique, fused = unique[keep], fused[keep]
+    if allowed is not None:
+        keep = allowed[unique]
+        unique, fused = unique[keep], fused[keep]
+    # A single partial selection, then a sort of the k winners only. Every
+    # candidate tied with the k-th score is kept for the sort, so ties at
+    # the cut-off are broken by position too
+    if k is not None and len(fused) > k:
+        kth = -np.partition(-fused, k - 1)[k - 1]
+        top = np.flatnonzero(fused >= kth)
+        unique, fused = unique[top], fused[top]
+    order = np.lexsort((unique, -fused))[:k]
+    return unique[order], fused[order].astype(np.float32)
+
+def merge_neighbours(neighbours, positions, exclude=None, allowed=None):
+    """Merge the stored neighbour lists of several items.
+
+    Parameters
+    ----------
+    neighbours : scipy.sparse.csr_matrix or QuantisedNeighbours
+        Index produced by `build_topk_index`, or loaded by `load_index`.
+    positions : list (int)
+        Row positions of the seed items.
+    exclude : array-like, optional
+        Positions which may not appear in the result (typically the seeds).
+    allowed : numpy.ndarray, optional
+        Boolean mask of the positions which may appear in the result.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        Candidate positions and their best similarity to any of the seed
+        items, most similar first. Each candidate appears once, and the
+        result does not depend on the order of `positions`.
+
+    """
+    return fuse_neighbours(neighbours, positions, method='max', exclude=exclude, allowed=allowed)
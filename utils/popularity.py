@@ -0,0 +1,197 @@
+"""
+
+    Precomputed popularity rankings.
+
+    Author: Explore Data Science Academy.
+
+    Description: Ranks every rated movie offline so that cold-start and
+    fallback recommendations are served by slicing small arrays instead
+    of aggregating the ratings on the request path. The table holds:
+
+        - all movies ordered by Bayesian-average rating, i.e. their mean
+          rating shrunk towards the global mean by `prior_count` virtual
+          ratings, so that a movie rated 5 once does not outrank one
+          rated 4.5 by thousands,
+        - all movies ordered by number of ratings,
+        - the top `list_size` movies of every genre and every decade,
+          by Bayesian average.
+
+    The per-movie aggregates are read from the ingested rating store,
+    see `utils.ratings_ingest`. To (re)build the table, run from the
+    root of the repository:
+
+        python -m utils.popularity
+
+"""
+# Data handling dependencies
+import numpy as np
+import pandas as pd
+
+from utils.title_index import release_year
+
+POPULARITY_PATH = 'resources/models/popularity.npz'
+# Movies kept in each genre and decade list
+LIST_SIZE = 200
+
+def bayesian_average(count, mean, prior_mean, prior_count):
+    """Mean ratings shrunk towards a prior mean.
+
+    Parameters
+    ----------
+    count : numpy.ndarray
+        Number of ratings of each movie.
+    mean : numpy.ndarray
+        Mean rating of each movie.
+    prior_mean : float
+        Rating assumed in the absence of evidence (the global mean).
+    prior_count : float
+        Number of virtual ratings at `prior_mean` added to every movie.
+
+    Returns
+    -------
+    numpy.ndarray
+        The Bayesian-average rating of each movie.
+
+    """
+    return (prior_count * prior_mean + count * mean) / (prior_count + count)
+
+def _ranked(ids, scores, tie_break):
+    # Highest score first, ties broken by the secondary key then movieId
+    return ids[np.lexsort((ids, -tie_break, -scores))]
+
+def build_popularity(stats, movies, save_path=POPULARITY_PATH, prior_count=None,
+                     list_size=LIST_SIZE):
+    """Rank the rated movies and save the popularity table.
+
+    Parameters
+    ----------
+    stats : Pandas DataFrame
+        Per-movie `count` and `mean` rating indexed by movieId, as
+        returned by `utils.ratings_ingest.load_stats`.
+    movies : Pandas DataFrame
+        Movie catalogue with `movieId`, `title` and `genres` columns.
+        Only rated movies of the catalogue are ranked.
+    save_path : str
+        Location to write the `.npz` table.
+    prior_count : float, optional
+        Weight of the prior in the Bayesian average. Defaults to the
+        median number of ratings per movie.
+    list_size : int
+        Number of movies kept in each genre and decade list.
+
+    """
+    movies = movies.drop_duplicates('movieId').set_index('movieId')
+    stats = stats[stats.index.isin(movies.index)]
+    ids = stats.index.to_numpy(dtype=np.int64)
+    count = stats['count'].to_numpy(dtype=np.float64)
+    mean = stats['mean'].to_numpy(dtype=np.float64)
+    prior_mean = np.average(mean, weights=count) if len(ids) else 0.0
+    if prior_count is None:
+        prior_count = float(np.median(count)) if len(ids) else 0.0
+    score = bayesian_average(count, mean, prior_mean, prior_count)
+    by_rating = _ranked(ids, score, count)
+    by_count = _ranked(ids, count, score)
+
+    # Genre and decade lists, each a slice of one flat array
+    ranked = movies.loc[by_rating]
+    genres = ranked['genres'].astype(str).str.split('|')
+    decades = [release_year(title) for title in ranked['title'].astype(str)]
+    groups = {}
+    for movie_id, movie_genres, year in zip(by_rating.tolist(), genres, decades):
+        keys = [f'genre:{genre}' for genre in movie_genres if genre != '(no genres listed)']
+        if year is not None:
+            keys.append(f'decade:{year // 10 * 10}')
+        for key in keys:
+            members = groups.setdefault(key, [])
+            if len(members) < list_size:
+                members.append(movie_id)
+    names = sorted(groups)
+    indptr = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum([len(groups[name]) for name in names], out=indptr[1:])
+    members = np.array([movie_id for name in names for movie_id in groups[name]], dtype=np.int64)
+
+    positions = pd.Index(ids).get_indexer(by_rating)
+    with open(save_path, 'wb') as f:
+        np.savez(f, by_rating=by_rating, score=score[positions].astype(np.float32),
+                 count=count[positions].astype(np.int64), by_count=by_count,
+                 group_names=np.array(names), group_indptr=indptr, group_items=members,
+                 prior=np.array([prior_mean, prior_count]))
+
+class PopularityTable:
+    """Constant-time access to a saved popularity table.
+
+    Parameters
+    ----------
+    path : str
+        Location of the `.npz` table written by `build_popularity`.
+
+    """
+
+    def __init__(self, path=POPULARITY_PATH):
+        with np.load(path) as f:
+            self.by_rating = f['by_rating']
+            self.score = f['score']
+            self.count = f['count']
+            self.by_count = f['by_count']
+            self.prior_mean, self.prior_count = f['prior'].tolist()
+            indptr, items = f['group_indptr'], f['group_items']
+            self.groups = {name: items[indptr[i]:indptr[i + 1]]
+                           for i, name in enumerate(f['group_names'].tolist())}
+
+    def genres(self):
+        """Genres with a ranked list."""
+        return [name.split(':', 1)[1] for name in self.groups if name.startswith('genre:')]
+
+    def decades(self):
+        """Decades with a ranked list."""
+        return [int(name.split(':', 1)[1]) for name in self.groups if name.startswith('decade:')]
+
+    def top(self, n=10, by='rating', genre=None, decade=None, exclude=None):
+        """Most popular movies, optionally within a genre and/or decade.
+
+        Parameters
+        ----------
+        n : int
+            Number of movies.
+        by : str
+            'rating' (Bayesian average) or 'count' (number of ratings).
+            Genre and decade lists are always ranked by rating.
+        genre : str, optional
+            Only movies of this genre, e.g. 'Comedy'.
+        decade : int, optional
+            Only movies released in this decade, e.g. 1990.
+        exclude : list (int), optional
+            Movie IDs which may not appear (typically the seeds).
+
+        Returns
+        -------
+        numpy.ndarray
+            Movie IDs, most popular first. Fewer than `n` when the lists
+            hold fewer movies.
+
+        """
+        if by not in ('rating', 'count'):
+            raise ValueError(f"Unknown popularity ranking '{by}'")
+        if genre is None and decade is None:
+            ranked = self.by_rating if by == 'rating' else self.by_count
+        else:
+            keys = []
+            if genre is not None:
+                keys.append(f'genre:{genre}')
+            if decade is not None:
+                keys.append(f'decade:{int(decade) // 10 * 10}')
+            lists = [self.groups.get(key, self.by_rating[:0]) for key in keys]
+            # Both lists are ranked by rating, so their intersection is too
+            ranked = lists[0] if len(lists) == 1 else lists[0][np.isin(lists[0], lists[1])]
+        if exclude is None or not len(exclude):
+            return ranked[:n]
+        # Only the head of the list is scanned
+        head = ranked[:n + len(exclude)]
+        return head[~np.isin(head, exclude)][:n]
+
+if __name__ == '__main__':
+    from utils import registry
+    from utils.ratings_ingest import ensure_ingested, load_stats
+    store = ensure_ingested([registry.RATINGS_PATH, registry.RATINGS_DELTA_PATH])
+    build_popularity(load_stats(store, 'item'), registry.get('movies'))
+    print(f"Popularity table built. Saved to: {POPULARITY_PATH}")
@@ -0,0 +1,195 @@
+"""
+
+    Reduced-precision model artifacts.
+
+    Author: Explore Data Science Academy.
+
+    Description: Helpers to store the SVD factors and the neighbour
+    similarity stores at a lower precision, so that each serving process
+    holds less memory:
+
+        float32  half the size of the float64 SVD factors,
+        int8     a quarter of float32: every row of a matrix is stored as
+                 signed 8-bit codes and one float32 scale, `row = codes *
+                 scale`, with the scale chosen so that the row's largest
+                 magnitude maps to 127 (255 for the neighbour scores,
+                 which are positive).
+
+    Reduced-precision variants are written next to the full-precision
+    artifact, with the precision as a suffix (`item_similarity.npz` ->
+    `item_similarity-int8.npz`), by `resources/models/quantise_models.py`.
+    Serving processes load them when `RECOMMENDER_MODEL_PRECISION` is set
+    to 'float32' or 'int8', and fall back to the full-precision artifact
+    when a variant is missing or older than it. Scores are computed from
+    the int8 codes, dequantising only the rows a request touches.
+
+"""
+# Script dependencies
+import os
+import logging
+
+# Data handling dependencies
+import numpy as np
+
+from utils import instrumentation
+
+FULL_PRECISION = 'float64'
+PRECISIONS = (FULL_PRECISION, 'float32', 'int8')
+# Precision of the artifacts loaded by this process
+MODEL_PRECISION = os.environ.get('RECOMMENDER_MODEL_PRECISION', FULL_PRECISION)
+if MODEL_PRECISION not in PRECISIONS:
+    raise ValueError(f"RECOMMENDER_MODEL_PRECISION must be one of {PRECISIONS}")
+
+def quantise_rows(matrix):
+    """Quantise each row of a matrix to int8 codes and a scale.
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray
+        Two-dimensional array.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        int8 codes of the shape of `matrix`, and the float32 scale of
+        each row. All-zero rows have a zero scale.
+
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    peak = np.abs(matrix).max(axis=1, initial=0)
+    scales = (peak / 127).astype(np.float32)
+    codes = np.rint(matrix / np.where(scales > 0, scales, 1)[:, None])
+    return np.clip(codes, -127, 127).astype(np.int8), scales
+
+def quantise_sparse_rows(data, indptr):
+    """Quantise the stored values of each row of a CSR matrix.
+
+    Neighbour scores are positive (items with no overlap are not stored),
+    so they are coded as unsigned 8-bit integers, which doubles the
+    resolution of signed codes.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Stored non-negative values of the matrix.
+    indptr : numpy.ndarray
+        Row pointers of the matrix.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        uint8 codes of `data`, and the float32 scale of each row.
+
+    """
+    data = np.clip(np.asarray(data, dtype=np.float32), 0, None)
+    lengths = np.diff(indptr)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    peak = np.zeros(len(lengths), dtype=np.float32)
+    np.maximum.at(peak, rows, data)
+    scales = peak / 255
+    codes = np.rint(data / np.where(scales > 0, scales, 1)[rows])
+    return np.clip(codes, 0, 255).astype(np.uint8), scales
+
+class QuantisedMatrix:
+    """A read-only matrix stored as int8 row codes and row scales.
+
+    Indexing rows (`matrix[rows]`) dequantises those rows only, to
+    float32, so code written for NumPy factor matrices can score from
+    it directly. Converting the whole matrix (`np.asarray`, `.T`) is
+    supported for offline jobs, at full float32 cost.
+
+    Parameters
+    ----------
+    codes : numpy.ndarray
+        int8 codes, one row per matrix row.
+    scales : numpy.ndarray
+        float32 scale of each row.
+
+    """
+
+    dtype = np.dtype(np.float32)
+    ndim = 2
+
+    def __init__(self, codes, scales):
+        self.codes = codes
+        self.scales = scales
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, rows):
+        return self.codes[rows].astype(np.float32) * np.asarray(self.scales[rows])[..., None]
+
+    def __array__(self, dtype=None, copy=None):
+        matrix = self[:]
+        return matrix if dtype is None else matrix.astype(dtype)
+
+    def astype(self, dtype):
+        """The dequantised matrix, as a NumPy array of the given type."""
+        return np.asarray(self, dtype=dtype)
+
+    @property
+    def T(self):
+        return self[:].T
+
+def precision_path(path, precision=MODEL_PRECISION):
+    """Location of the variant of an artifact stored at a given precision."""
+    if precision == FULL_PRECISION:
+        return path
+    stem, extension = os.path.splitext(path)
+    return f'{stem}-{precision}{extension}'
+
+def resolve_path(path, precision=MODEL_PRECISION):
+    """The artifact to load at a given precision.
+
+    Returns
+    -------
+    str
+        The reduced-precision variant of `path` when it exists and is
+        at least as recent as `path`, and `path` otherwise.
+
+    """
+    variant = precision_path(path, precision)
+    if variant == path or not os.path.exists(variant):
+        return path
+    if os.path.exists(path) and os.path.getmtime(variant) < os.path.getmtime(path):
+        # Rebuilt since it was quantised: the variant is out of date
+        instrumentation.log_event('stale_quantised_artifact', logging.WARNING,
+                                  path=variant, precision=precision)
+        return path
+    return variant
+
+def fingerprint_paths(path, precision=MODEL_PRECISION):
+    """An artifact and its variant at a given precision, for result cache
+    fingerprints (see `utils.result_cache.cached_recommender`)."""
+    variant = precision_path(path, precision)
+    return [path] if variant == path else [path, variant]
+
+def overlap_at_k(reference, other, k=10):
+    """Mean share of the top-k of `reference` also in the top-k of `other`.
+
+    Parameters
+    ----------
+    reference, other : numpy.ndarray
+        Arrays of shape (n, >= k) of ranked ids, padded with -1.
+    k : int
+        Cut-off rank.
+
+    Returns
+    -------
+    float
+        Agreement between the two rankings, from 0 to 1.
+
+    """
+    reference, other = np.asarray(reference)[:, :k], np.asarray(other)[:, :k]
+    shared = [len(np.intersect1d(a[a >= 0], b[b >= 0])) / max(int((a >= 0).sum()), 1)
+              for a, b in zip(reference, other)]
+    return float(np.mean(shared)) if shared else 1.0
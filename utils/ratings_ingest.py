@@ -0,0 +1,288 @@
+"""
+
+    Chunked ingestion of ratings files larger than memory.
+
+    Author: Explore Data Science Academy.
+
+    Description: Streams one or more ratings CSV files in chunks sized to
+    a memory ceiling and writes, without ever holding the full table:
+
+        - the (userId, movieId, rating) columns as flat binary files,
+        - per-user and per-item aggregates (count, mean, std, min, max),
+        - an item x user CSR rating matrix as `.npy` files, together with
+          the same matrix normalised per item as in
+          `collaborative_based.normalise_ratings`.
+
+    A first pass writes the columns and accumulates the aggregates; a
+    second pass scatters the ratings into their CSR rows, chunk by chunk,
+    using the item counts of the first pass. Everything is loaded back as
+    memory maps. Model training reads the columns and the similarity
+    store is built from the matrix. A store is rebuilt into a sibling
+    directory and swapped in atomically (see
+    `utils.columnar_cache.publish_dir`), never over the mapped files.
+
+    The memory ceiling bounds the heap memory of the ingestion (chunk
+    size and per-id aggregates); the memory-mapped outputs live in the
+    reclaimable page cache. It defaults to the
+    `RECOMMENDER_INGEST_MEMORY_MB` environment variable (256 MB).
+
+    To (re)build the store for the default ratings, run from the root of
+    the repository:
+
+        python -m utils.ratings_ingest
+
+"""
+# Script dependencies
+import os
+import json
+
+# Data handling dependencies
+import numpy as np
+import pandas as pd
+import scipy.sparse as sps
+
+from utils.columnar_cache import staging_dir, publish_dir
+
+COLUMNS = {'userId': np.int32, 'movieId': np.int32, 'rating': np.float32}
+
+MEMORY_LIMIT_MB = int(os.environ.get('RECOMMENDER_INGEST_MEMORY_MB', 256))
+# Peak bytes per CSV row while a chunk is parsed and scattered
+BYTES_PER_ROW = 160
+
+STATS = ('count', 'mean', 'std', 'min', 'max')
+
+def matrix_dir(csv_path):
+    """Default store location of a ratings file, inside its data cache."""
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(os.path.dirname(csv_path), 'cache', f'{stem}_matrix')
+
+def _signature(paths):
+    signature = []
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.append([os.path.abspath(path), stat.st_size, int(stat.st_mtime)])
+    return signature
+
+def is_fresh(paths, out_dir):
+    """Whether a store exists and was built from the current files."""
+    meta_path = os.path.join(out_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        return json.load(f)['source'] == _signature(paths)
+
+class _Aggregates:
+    # Running count, sum, sum of squares, min and max per raw id
+
+    def __init__(self):
+        self.count = np.zeros(0, dtype=np.int64)
+        self.total = np.zeros(0)
+        self.squares = np.zeros(0)
+        self.low = np.zeros(0, dtype=np.float32)
+        self.high = np.zeros(0, dtype=np.float32)
+
+    def _grow(self, size):
+        if size <= len(self.count):
+            return
+        size = max(size, 2 * len(self.count))
+        pad = size - len(self.count)
+        self.count = np.concatenate([self.count, np.zeros(pad, dtype=np.int64)])
+        self.total = np.concatenate([self.total, np.zeros(pad)])
+        self.squares = np.concatenate([self.squares, np.zeros(pad)])
+        self.low = np.concatenate([self.low, np.full(pad, np.inf, dtype=np.float32)])
+        self.high = np.concatenate([self.high, np.full(pad, -np.inf, dtype=np.float32)])
+
+    def add(self, ids, ratings):
+        if not len(ids):
+            return
+        self._grow(int(ids.max()) + 1)
+        size = len(self.count)
+        self.count += np.bincount(ids, minlength=size)
+        self.total += np.bincount(ids, weights=ratings, minlength=size)
+        self.squares += np.bincount(ids, weights=ratings.astype(np.float64) ** 2, minlength=size)
+        np.minimum.at(self.low, ids, ratings)
+        np.maximum.at(self.high, ids, ratings)
+
+    def save(self, path):
+        ids = np.flatnonzero(self.count)
+        count = self.count[ids]
+        mean = self.total[ids] / count
+        variance = np.maximum(self.squares[ids] / count - mean ** 2, 0)
+        np.savez(path, ids=ids.astype(np.int32), count=count, mean=mean,
+                 std=np.sqrt(variance), min=self.low[ids], max=self.high[ids])
+        return ids
+
+def ingest_ratings(paths, out_dir=None, memory_limit_mb=None):
+    """Stream ratings CSV files into a memory-mapped rating store.
+
+    Parameters
+    ----------
+    paths : list (str)
+        Ratings CSV files with `userId`, `movieId` and `rating` columns,
+        read in order. Missing files are skipped.
+    out_dir : str, optional
+        Store directory. Defaults to `matrix_dir` of the first file.
+    memory_limit_mb : int, optional
+        Approximate ceiling on the memory used while ingesting. Defaults
+        to `MEMORY_LIMIT_MB`.
+
+    Returns
+    -------
+    str
+        The store directory.
+
+    """
+    out_dir = out_dir or matrix_dir(paths[0])
+    memory_limit_mb = memory_limit_mb or MEMORY_LIMIT_MB
+    chunksize = max(10000, memory_limit_mb * 2 ** 20 // BYTES_PER_ROW)
+    # Written aside and swapped in: serving processes map the live files
+    build_dir = staging_dir(out_dir)
+
+    # Pass 1: columns to disk, aggregates in memory (one entry per id)
+    users, items = _Aggregates(), _Aggregates()
+    n_ratings = 0
+    files = {column: open(os.path.join(build_dir, f'{column}.bin'), 'wb') for column in COLUMNS}
+    try:
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            for chunk in pd.read_csv(path, usecols=list(COLUMNS), dtype=COLUMNS, chunksize=chunksize):
+                for column, f in files.items():
+                    chunk[column].to_numpy(dtype=COLUMNS[column]).tofile(f)
+                users.add(chunk['userId'].to_numpy(), chunk['rating'].to_numpy())
+                items.add(chunk['movieId'].to_numpy(), chunk['rating'].to_numpy())
+                n_ratings += len(chunk)
+    finally:
+        for f in files.values():
+            f.close()
+    user_ids = users.save(os.path.join(build_dir, 'user_stats.npz'))
+    item_ids = items.save(os.path.join(build_dir, 'item_stats.npz'))
+    item_mean = items.total[item_ids] / items.count[item_ids]
+    spread = (items.high[item_ids] - items.low[item_ids]).astype(np.float64)
+    item_scale = np.divide(1.0, spread, out=np.zeros_like(spread), where=spread > 0)
+
+    # Pass 2: scatter each chunk into its CSR rows, in file order
+    user_position = np.full(len(users.count), -1, dtype=np.int32)
+    user_position[user_ids] = np.arange(len(user_ids))
+    item_position = np.full(len(items.count), -1, dtype=np.int32)
+    item_position[item_ids] = np.arange(len(item_ids))
+    index_dtype = np.int32 if n_ratings < np.iinfo(np.int32).max else np.int64
+    indptr = np.zeros(len(item_ids) + 1, dtype=index_dtype)
+    np.cumsum(items.count[item_ids], out=indptr[1:])
+    indices = np.lib.format.open_memmap(os.path.join(build_dir, 'indices.npy'), mode='w+',
+                                        dtype=index_dtype, shape=(n_ratings,))
+    data = np.lib.format.open_memmap(os.path.join(build_dir, 'data.npy'), mode='w+',
+                                     dtype=np.float32, shape=(n_ratings,))
+    normalised = np.lib.format.open_memmap(os.path.join(build_dir, 'normalised.npy'), mode='w+',
+                                           dtype=np.float32, shape=(n_ratings,))
+    columns = load_columns(build_dir, n_ratings)
+    fill = indptr[:-1].astype(np.int64)
+    for start in range(0, n_ratings, chunksize):
+        stop = min(start + chunksize, n_ratings)
+        rows = item_position[columns['movieId'][start:stop]]
+        order = np.argsort(rows, kind='stable')
+        rows = rows[order]
+        counts = np.bincount(rows, minlength=len(item_ids))
+        rank = np.arange(len(rows)) - (np.cumsum(counts) - counts)[rows]
+        target = fill[rows] + rank
+        ratings = np.asarray(columns['rating'][start:stop])[order]
+        indices[target] = user_position[columns['userId'][start:stop]][order]
+        data[target] = ratings
+        normalised[target] = (ratings - item_mean[rows]) * item_scale[rows]
+        fill += counts
+    for array in (indices, data, normalised):
+        array.flush()
+    del indices, data, normalised, columns
+    np.save(os.path.join(build_dir, 'indptr.npy'), indptr)
+
+    with open(os.path.join(build_dir, 'meta.json'), 'w') as f:
+        json.dump({'n_ratings': n_ratings,
+                   'n_users': int(len(user_ids)),
+                   'n_items': int(len(item_ids)),
+                   'source': _signature(paths)}, f)
+    publish_dir(build_dir, out_dir)
+    return out_dir
+
+def ensure_ingested(paths, out_dir=None, memory_limit_mb=None):
+    """Ingest the ratings files unless an up-to-date store exists.
+
+    Returns
+    -------
+    str
+        The store directory.
+
+    """
+    out_dir = out_dir or matrix_dir(paths[0])
+    if not is_fresh(paths, out_dir):
+        print(f'... Ingesting {", ".join(p for p in paths if os.path.exists(p))}')
+        ingest_ratings(paths, out_dir, memory_limit_mb)
+    return out_dir
+
+def load_columns(out_dir, n_ratings=None):
+    """Memory-map the ingested rating columns.
+
+    Returns
+    -------
+    dict
+        `userId`, `movieId` and `rating` arrays, in file order.
+
+    """
+    if n_ratings is None:
+        with open(os.path.join(out_dir, 'meta.json')) as f:
+            n_ratings = json.load(f)['n_ratings']
+    return {column: np.memmap(os.path.join(out_dir, f'{column}.bin'), dtype=dtype,
+                              mode='r', shape=(n_ratings,))
+            for column, dtype in COLUMNS.items()}
+
+def load_ratings_table(out_dir):
+    """The ingested ratings as a DataFrame backed by memory maps."""
+    return pd.DataFrame(load_columns(out_dir), copy=False)
+
+def load_stats(out_dir, kind):
+    """Aggregates of every user (`kind='user'`) or item (`kind='item'`).
+
+    Returns
+    -------
+    Pandas DataFrame
+        Count, mean, (population) standard deviation, min and max
+        rating, indexed by raw id.
+
+    """
+    with np.load(os.path.join(out_dir, f'{kind}_stats.npz')) as f:
+        return pd.DataFrame({stat: f[stat] for stat in STATS},
+                            index=pd.Index(f['ids'], name='userId' if kind == 'user' else 'movieId'))
+
+def load_rating_matrix(out_dir, normalised=False):
+    """Memory-map the ingested item x user rating matrix.
+
+    Parameters
+    ----------
+    out_dir : str
+        Store directory.
+    normalised : bool
+        Return ratings normalised per item instead of raw ratings.
+
+    Returns
+    -------
+    tuple (scipy.sparse.csr_matrix, numpy.ndarray, numpy.ndarray)
+        The rating matrix, and the movieId and userId of each of its
+        rows and columns respectively (both sorted).
+
+    """
+    with np.load(os.path.join(out_dir, 'item_stats.npz')) as f:
+        item_ids = f['ids']
+    with np.load(os.path.join(out_dir, 'user_stats.npz')) as f:
+        user_ids = f['ids']
+    values = np.load(os.path.join(out_dir, 'normalised.npy' if normalised else 'data.npy'),
+                     mmap_mode='r')
+    matrix = sps.csr_matrix((values,
+                             np.load(os.path.join(out_dir, 'indices.npy'), mmap_mode='r'),
+                             np.load(os.path.join(out_dir, 'indptr.npy'))),
+                            shape=(len(item_ids), len(user_ids)), copy=False)
+    return matrix, item_ids, user_ids
+
+if __name__ == '__main__':
+    from utils import registry
+    out_dir = ingest_ratings([registry.RATINGS_PATH, registry.RATINGS_DELTA_PATH])
+    print(f"Ratings ingested. Saved to: {out_dir}")
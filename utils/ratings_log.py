@@ -0,0 +1,106 @@
+"""
+
+    Append-only log of new ratings.
+
+    Author: Explore Data Science Academy.
+
+    Description: New ratings are appended to a delta CSV next to
+    `ratings.csv` rather than rewriting the full ratings file. The
+    registry serves the base ratings plus the log, the models are updated
+    from the log incrementally (see `resources/models/update_models.py`),
+    and a periodic compaction folds the log back into the base file.
+
+"""
+# Script dependencies
+import os
+import time
+import shutil
+import threading
+
+# Data handling dependencies
+import pandas as pd
+
+from utils import registry
+from utils.columnar_cache import CACHE_DIR, convert_csv
+
+COLUMNS = ['userId', 'movieId', 'rating', 'timestamp']
+
+_lock = threading.Lock()
+
+def append_ratings(ratings, path=None):
+    """Append new ratings to the delta log.
+
+    Parameters
+    ----------
+    ratings : Pandas DataFrame
+        `userId`, `movieId` and `rating` columns, and optionally a
+        `timestamp` (defaults to now).
+    path : str, optional
+        Delta log location. Defaults to `registry.RATINGS_DELTA_PATH`.
+
+    Returns
+    -------
+    int
+        Number of ratings in the log after the append.
+
+    """
+    path = path or registry.RATINGS_DELTA_PATH
+    ratings = ratings.copy()
+    if 'timestamp' not in ratings:
+        ratings['timestamp'] = int(time.time())
+    with _lock:
+        exists = os.path.exists(path)
+        ratings[COLUMNS].to_csv(path, mode='a', header=not exists, index=False)
+        return len(read_delta(path))
+
+def read_delta(path=None, start=0):
+    """Ratings logged since the last compaction.
+
+    Parameters
+    ----------
+    path : str, optional
+        Delta log location. Defaults to `registry.RATINGS_DELTA_PATH`.
+    start : int
+        Number of leading log entries to skip (e.g. already applied).
+
+    Returns
+    -------
+    Pandas DataFrame
+        The logged ratings from entry `start` onwards.
+
+    """
+    path = path or registry.RATINGS_DELTA_PATH
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=COLUMNS)
+    return pd.read_csv(path, skiprows=range(1, start + 1))
+
+def compact(ratings_path=None, path=None):
+    """Fold the delta log into the base ratings file and clear the log.
+
+    The base file is replaced atomically, and its columnar cache is
+    rebuilt when one exists.
+
+    Returns
+    -------
+    int
+        Number of ratings folded in.
+
+    """
+    ratings_path = ratings_path or registry.RATINGS_PATH
+    path = path or registry.RATINGS_DELTA_PATH
+    with _lock:
+        delta = read_delta(path)
+        if len(delta):
+            # Appended to a copy, keeping the base file's existing lines as they are
+            with open(ratings_path, 'rb') as f:
+                line_end = '\r\n' if f.readline().endswith(b'\r\n') else '\n'
+            tmp_path = f'{ratings_path}.tmp'
+            shutil.copyfile(ratings_path, tmp_path)
+            delta[COLUMNS].to_csv(tmp_path, mode='a', header=False, index=False,
+                                  lineterminator=line_end)
+            os.replace(tmp_path, ratings_path)
+            if os.path.exists(os.path.join(CACHE_DIR, 'ratings')):
+                convert_csv(ratings_path, 'ratings')
+        if os.path.exists(path):
+            os.remove(path)
+    return len(delta)
@@ -0,0 +1,228 @@
+"""
+
+    Process-wide registry of datasets and model artifacts.
+
+    Author: Explore Data Science Academy.
+
+    Description: Every dataset and model used by the recommenders is
+    registered here under a short name together with a loader function.
+    Artifacts are loaded lazily, the first time `get` is called for them,
+    and are then held once per process. Because Streamlit re-executes only
+    the app script on each interaction (imported modules stay cached in
+    `sys.modules`), the artifacts are shared across script reruns, user
+    sessions and both recommenders.
+
+    Load timings and approximate memory footprints are recorded for each
+    artifact, can be inspected with `stats` and are exported as metrics
+    (see `utils.instrumentation`).
+
+"""
+# Script dependencies
+import os
+import sys
+import time
+import pickle
+import threading
+
+# Data handling dependencies
+import numpy as np
+import pandas as pd
+import scipy.sparse as sps
+from utils import instrumentation
+from utils.columnar_cache import load_table
+from utils.title_index import TitleIndex
+
+# Default artifact locations, relative to the root of the repository
+MOVIES_PATH = 'resources/data/movies.csv'
+RATINGS_PATH = 'resources/data/ratings.csv'
+TAGS_PATH = 'resources/data/tags.csv'
+# Ratings received since the last compaction, see `utils.ratings_log`
+RATINGS_DELTA_PATH = 'resources/data/ratings_delta.csv'
+MERGED_RATINGS_PATH = 'resources/data/df_new.csv'
+SVD_MODEL_PATH = 'resources/models/SVD.pkl'
+# Entries loaded from each dataset, reloaded when it changes (see
+# `utils.result_cache.cached_recommender`)
+DATASET_ENTRIES = {MOVIES_PATH: ['movies', 'title_index', 'movie_filters'],
+                   RATINGS_PATH: ['ratings'],
+                   RATINGS_DELTA_PATH: ['ratings']}
+
+_loaders = {}
+_artifacts = {}
+_stats = {}
+_lock = threading.Lock()
+_name_locks = {}
+
+def register(name, loader, replace=False):
+    """Register a loader for a named artifact.
+
+    Parameters
+    ----------
+    name : str
+        Name the artifact is requested by.
+    loader : callable
+        Zero-argument function returning the artifact.
+    replace : bool
+        Overwrite an existing registration (and drop any loaded value).
+
+    """
+    with _lock:
+        if name in _loaders and not replace:
+            return
+        _loaders[name] = loader
+        _name_locks.setdefault(name, threading.Lock())
+        _artifacts.pop(name, None)
+        _stats.pop(name, None)
+
+def get(name):
+    """Return a named artifact, loading it on first use.
+
+    Parameters
+    ----------
+    name : str
+        Name of a registered artifact.
+
+    Returns
+    -------
+    object
+        The loaded artifact. The same object is returned to every caller,
+        so it must be treated as read-only.
+
+    """
+    try:
+        return _artifacts[name]
+    except KeyError:
+        pass
+    with _lock:
+        if name not in _loaders:
+            raise KeyError(f"No artifact registered under '{name}'")
+        name_lock = _name_locks[name]
+    # Concurrent callers of the same artifact wait for a single load
+    with name_lock:
+        if name not in _artifacts:
+            start = time.perf_counter()
+            with instrumentation.stage('load'):
+                artifact = _loaders[name]()
+            _stats[name] = {'load_seconds': time.perf_counter() - start,
+                            'memory_bytes': memory_footprint(artifact)}
+            _artifacts[name] = artifact
+            instrumentation.count('artifact_load')
+            instrumentation.log_event('artifact_loaded', artifact=name, **_stats[name])
+    return _artifacts[name]
+
+def is_loaded(name):
+    """Whether a named artifact is currently held in memory."""
+    return name in _artifacts
+
+def unload(name=None):
+    """Drop one (or every) loaded artifact so that it is reloaded on next use.
+
+    Parameters
+    ----------
+    name : str, optional
+        Artifact to drop. All artifacts are dropped when omitted.
+
+    """
+    with _lock:
+        if name is None:
+            _artifacts.clear()
+            _stats.clear()
+        else:
+            _artifacts.pop(name, None)
+            _stats.pop(name, None)
+
+def stats():
+    """Load timings and memory footprints of the loaded artifacts.
+
+    Returns
+    -------
+    dict
+        Maps each loaded artifact name to a dict holding its
+        `load_seconds` and `memory_bytes`.
+
+    """
+    return {name: dict(values) for name, values in _stats.items()}
+
+instrumentation.register_gauge(
+    'recommender_artifact_memory_bytes', 'Approximate memory held by each loaded artifact.',
+    lambda: {(('artifact', name),): values['memory_bytes'] for name, values in stats().items()})
+instrumentation.register_gauge(
+    'recommender_artifact_load_seconds', 'Time taken to load each loaded artifact.',
+    lambda: {(('artifact', name),): values['load_seconds'] for name, values in stats().items()})
+
+def memory_footprint(obj):
+    """Approximate the number of bytes held by an artifact.
+
+    Parameters
+    ----------
+    obj : object
+        DataFrame, array, sparse matrix, container of these, or any
+        object whose attributes hold them (e.g. a fitted model).
+
+    Returns
+    -------
+    int
+        Estimated size in bytes.
+
+    """
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if sps.issparse(obj):
+        return int(sum(getattr(obj, part).nbytes
+                       for part in ('data', 'indices', 'indptr', 'row', 'col')
+                       if hasattr(obj, part)))
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(memory_footprint(item) for item in obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(memory_footprint(item) for item in obj.values())
+    if hasattr(obj, '__dict__') and not isinstance(obj, type):
+        return sys.getsizeof(obj) + sum(memory_footprint(value)
+                                        for value in vars(obj).values()
+                                        if isinstance(value, (np.ndarray, pd.DataFrame,
+                                                              pd.Series, list, tuple, dict)))
+    return sys.getsizeof(obj)
+
+def _load_movies():
+    # Read from the memory-mapped columnar cache when it has been built
+    movies = load_table(MOVIES_PATH, 'movies')
+    # Dropping rows copies every column, so only do so when needed
+    if movies.isna().any(axis=None):
+        movies = movies.dropna()
+    return movies
+
+def _load_ratings():
+    ratings = load_table(RATINGS_PATH, 'ratings')
+    # New ratings are served as soon as they are logged
+    if os.path.exists(RATINGS_DELTA_PATH):
+        delta = pd.read_csv(RATINGS_DELTA_PATH)
+        if len(delta):
+            ratings = pd.concat([ratings, delta.astype(ratings.dtypes.to_dict())], ignore_index=True)
+    return ratings
+
+def _load_tags():
+    # User tags are optional; without them the tag features are empty
+    if not os.path.exists(TAGS_PATH):
+        return pd.DataFrame(columns=['userId', 'movieId', 'tag', 'timestamp'])
+    return load_table(TAGS_PATH, 'tags')
+
+def _load_merged_ratings():
+    # Ratings joined to their movie titles. Built from the raw tables when
+    # a pre-merged file has not been produced.
+    if os.path.exists(MERGED_RATINGS_PATH):
+        return pd.read_csv(MERGED_RATINGS_PATH)
+    ratings = get('ratings')[['userId', 'movieId', 'rating']]
+    return pd.merge(ratings, get('movies')[['movieId', 'title']], on='movieId', how='inner')
+
+def _load_svd_model():
+    # We make use of an SVD model trained on a subset of the MovieLens 10k dataset.
+    with open(SVD_MODEL_PATH, 'rb') as f:
+        return pickle.load(f)
+
+register('movies', _load_movies)
+register('ratings', _load_ratings)
+register('tags', _load_tags)
+register('merged_ratings', _load_merged_ratings)
+register('svd_model', _load_svd_model)
+register('title_index', lambda: TitleIndex(get('movies')))
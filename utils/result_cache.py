@@ -0,0 +1,360 @@
+"""
+
+    Recommendation result cache.
+
+    Author: Explore Data Science Academy.
+
+    Description: Recommendations are a pure function of the algorithm, the
+    set of seed movies, the number of results and the model artifacts
+    they are computed from. This module caches them under exactly that key
+    in a bounded LRU store with a time-to-live, optionally persisted to
+    disk so that a restarted app starts warm. The model version is a
+    fingerprint (size and modification time) of the artifact files, so
+    rebuilding a model automatically invalidates its cached results, and
+    the registry entries loaded from the rebuilt files are reloaded
+    before anything is recomputed.
+
+    The process-wide cache is configured through environment variables:
+
+        RECOMMENDER_CACHE_SIZE  Maximum number of entries (default 4096).
+        RECOMMENDER_CACHE_TTL   Entry lifetime in seconds (default 86400).
+        RECOMMENDER_CACHE_PATH  File to persist the cache to (default none).
+        RECOMMENDER_CACHE_SAVE_INTERVAL
+                                Seconds between saves of a changed cache
+                                (default 60). It is also saved at exit.
+
+    Results for common seed sets can also be pre-rendered offline by
+    `resources/models/prerender.py` into a read-only store, which is
+    consulted on a cache miss before the model is run. Its location is
+    set by `RECOMMENDER_PRERENDERED_PATH` (default
+    `resources/models/prerendered.pkl`).
+
+"""
+# Script dependencies
+import os
+import time
+import atexit
+import pickle
+import functools
+import threading
+from collections import OrderedDict
+
+from utils import instrumentation, registry
+
+def _algorithm(key):
+    # Filtered results are keyed by (algorithm, filters)
+    return key[0][0] if isinstance(key[0], tuple) else key[0]
+
+def model_version(paths):
+    """Fingerprint a set of artifact files.
+
+    Parameters
+    ----------
+    paths : list (str)
+        Files the recommendations are computed from.
+
+    Returns
+    -------
+    tuple
+        (path, size, mtime) for each file, `None` for missing files.
+
+    """
+    version = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            version.append((path, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            version.append((path, None, None))
+    return tuple(version)
+
+class RecommendationCache:
+    """Bounded LRU + TTL cache of recommendation lists.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of cached results. The least recently used entry
+        is evicted first.
+    ttl : float
+        Seconds after which an entry expires.
+    path : str, optional
+        File the cache is loaded from and saved to.
+    save_interval : float
+        Seconds a change waits before the cache is saved, in the
+        background, so that requests never wait on a save. Changes
+        within the interval are saved together.
+
+    """
+
+    def __init__(self, maxsize=4096, ttl=86400, path=None, save_interval=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.save_interval = save_interval
+        self._save_timer = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+        if path:
+            atexit.register(self.flush)
+
+    @staticmethod
+    def make_key(algorithm, movie_list, top_n, version):
+        """Cache key of a request. Seed order and repeats do not matter."""
+        return (algorithm, tuple(sorted(set(movie_list))), top_n, version)
+
+    def get(self, key):
+        """Cached recommendations for a key, or `None` on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def put(self, key, recommendations):
+        """Store the recommendations of a key, evicting as required."""
+        with self._lock:
+            algorithm, version = _algorithm(key), key[3]
+            if self._versions.get(algorithm) != version:
+                # The algorithm's model changed: its old results, filtered
+                # or not, are stale
+                for stale in [k for k in self._entries
+                              if _algorithm(k) == algorithm and k[3] != version]:
+                    del self._entries[stale]
+                self._versions[algorithm] = version
+            self._entries[key] = (time.time(), list(recommendations))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            if self.path and self._save_timer is None:
+                self._save_timer = threading.Timer(self.save_interval, self._save_pending)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def _save_pending(self):
+        with self._lock:
+            self._save_timer = None
+        self.save()
+
+    def flush(self):
+        """Save pending changes now, e.g. at shutdown."""
+        with self._lock:
+            timer, self._save_timer = self._save_timer, None
+        if timer is not None:
+            timer.cancel()
+            self.save()
+
+    def clear(self):
+        """Drop every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Hit, miss and eviction counts and the current size."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self._entries),
+                    'hit_rate': self.hits / total if total else 0.0}
+
+    def save(self, path=None):
+        """Write the cache atomically to disk."""
+        path = path or self.path
+        with self._lock:
+            snapshot = (dict(self._entries), dict(self._versions))
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path=None):
+        """Merge entries from a cache file, skipping expired ones."""
+        path = path or self.path
+        with open(path, 'rb') as f:
+            entries, versions = pickle.load(f)
+        now = time.time()
+        with self._lock:
+            for key, entry in sorted(entries.items(), key=lambda item: item[1][0]):
+                if now - entry[0] <= self.ttl:
+                    self._entries[key] = entry
+            self._versions.update(versions)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+class PrerenderedResults:
+    """Read-only store of recommendations computed offline.
+
+    The store is (re)loaded lazily whenever its file changes, so a newly
+    pre-rendered store is picked up without restarting the app. Entries
+    are keyed like `RecommendationCache`, model version included, so the
+    results of a rebuilt model are simply never found.
+
+    Parameters
+    ----------
+    path : str
+        File written by `save`.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self._entries = {}
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            stamp = None
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            if stamp is None:
+                self._entries = {}
+            else:
+                with open(self.path, 'rb') as f:
+                    self._entries = pickle.load(f)
+            self._stamp = stamp
+
+    def get(self, key):
+        """Pre-rendered recommendations for a key, or `None`."""
+        self._refresh()
+        recommendations = self._entries.get(key)
+        if recommendations is None:
+            return None
+        self.hits += 1
+        return list(recommendations)
+
+    def __len__(self):
+        self._refresh()
+        return len(self._entries)
+
+    @staticmethod
+    def save(entries, path):
+        """Write a store atomically.
+
+        Parameters
+        ----------
+        entries : dict
+            Maps cache keys (see `RecommendationCache.make_key`) to lists
+            of recommendations.
+        path : str
+            File to write.
+
+        """
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(dict(entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+recommendation_cache = RecommendationCache(
+    maxsize=int(os.environ.get('RECOMMENDER_CACHE_SIZE', 4096)),
+    ttl=float(os.environ.get('RECOMMENDER_CACHE_TTL', 86400)),
+    path=os.environ.get('RECOMMENDER_CACHE_PATH'),
+    save_interval=float(os.environ.get('RECOMMENDER_CACHE_SAVE_INTERVAL', 60)))
+
+prerendered_results = PrerenderedResults(
+    os.environ.get('RECOMMENDER_PRERENDERED_PATH', 'resources/models/prerendered.pkl'))
+
+instrumentation.register_gauge(
+    'recommender_cache', 'Result cache hits, misses, evictions and size.',
+    lambda: {(('stat', stat),): value for stat, value in recommendation_cache.stats().items()})
+
+def cached_recommender(algorithm, artifacts, cache=None, filtered=None, reload=None):
+    """Decorate a `(movie_list, top_n)` recommender with the result cache.
+
+    Parameters
+    ----------
+    algorithm : str
+        Name of the algorithm, part of the cache key.
+    artifacts : list (str)
+        Files whose fingerprint forms the model version.
+    cache : RecommendationCache, optional
+        Cache to use. Defaults to the process-wide cache.
+    filtered : callable, optional
+        `(movie_list, top_n, filters)` recommender serving requests with
+        genre or release year filters (see `utils.movie_filters`). The
+        decorated function then accepts a `filters` argument.
+    reload : dict, optional
+        Maps artifact files to the registry entries loaded from them.
+        When the fingerprint of a file changes, its entries are unloaded
+        (see `utils.registry.unload`) before any recommendation is
+        computed, so results cached under the new model version come
+        from the new model.
+
+    Returns
+    -------
+    callable
+        Decorator preserving the wrapped function's name and signature.
+        The wrapped function is always called with the seeds in a
+        canonical (sorted, de-duplicated) order. The decorated function
+        exposes `algorithm`, `artifacts` and `reload`, read on every call
+        so that they can be repointed, and the undecorated one as
+        `__wrapped__`.
+
+    """
+    # Entries are loaded after this point, from the files as they are now
+    seen = {'version': model_version(artifacts)}
+    seen_lock = threading.Lock()
+
+    def refresh(version, reload):
+        # Unloads the entries of changed files. Callers wait on the lock
+        # until the unloading is done, so none computes from stale entries
+        with seen_lock:
+            previous, seen['version'] = seen['version'], version
+            if previous == version:
+                return
+            changed = [new[0] for old, new in zip(previous, version) if old != new]
+            for path in changed:
+                for name in reload.get(path, ()):
+                    registry.unload(name)
+            instrumentation.log_event('model_changed', algorithm=algorithm, paths=changed)
+
+    def decorator(recommender):
+        @functools.wraps(recommender)
+        def wrapper(movie_list, top_n=10, filters=None):
+            if filters is not None and filtered is None:
+                raise ValueError(f'The {algorithm} algorithm does not support filters')
+            store = cache if cache is not None else recommendation_cache
+            version = model_version(wrapper.artifacts)
+            refresh(version, wrapper.reload)
+            # Filtered results are cached apart from the unfiltered ones
+            name = algorithm if filters is None else (algorithm, filters)
+            key = store.make_key(name, movie_list, top_n, version)
+            recommendations = store.get(key)
+            if recommendations is not None:
+                instrumentation.count('cache_hit')
+                return recommendations
+            recommendations = prerendered_results.get(key)
+            if recommendations is not None:
+                instrumentation.count('prerendered_hit')
+            else:
+                instrumentation.count('cache_miss')
+                recommendations = (recommender(list(key[1]), top_n) if filters is None
+                                   else filtered(list(key[1]), top_n, filters=filters))
+            store.put(key, recommendations)
+            return recommendations
+        wrapper.algorithm = algorithm
+        wrapper.artifacts = artifacts
+        wrapper.reload = reload or {}
+        return wrapper
+    return decorator
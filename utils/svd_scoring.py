@@ -0,0 +1,387 @@
+"""
+
+    Vectorised scoring for trained SVD models.
+
+    Author: Explore Data Science Academy.
+
+    Description: Helper functions which pull the learnt parameters out of
+    a fitted `surprise.SVD` model into plain NumPy arrays, and then score
+    many (user, item) pairs with a single matrix product. Estimates are
+    identical to those of `SVD.predict`: the global mean plus the known
+    user and item biases plus the dot product of their latent factors,
+    clipped to the rating scale.
+
+"""
+# Script dependencies
+import os
+import json
+import time
+
+# Data handling dependencies
+import numpy as np
+import pandas as pd
+
+from utils.quantisation import QuantisedMatrix, quantise_rows, resolve_path
+
+def extract_factors(model):
+    """Extract the parameters of a fitted SVD model into NumPy arrays.
+
+    Parameters
+    ----------
+    model : surprise.SVD
+        A fitted SVD model.
+
+    Returns
+    -------
+    dict
+        `pu`, `qi`, `bu` and `bi` arrays indexed by inner id, the
+        `global_mean`, `rating_scale` and `biased` flag, and `user_index`
+        and `item_index` (pandas Index objects mapping raw ids to inner
+        ids).
+
+    """
+    trainset = model.trainset
+    user_ids = [trainset.to_raw_uid(inner) for inner in range(trainset.n_users)]
+    item_ids = [trainset.to_raw_iid(inner) for inner in range(trainset.n_items)]
+    return {'pu': np.asarray(model.pu),
+            'qi': np.asarray(model.qi),
+            'bu': np.asarray(model.bu),
+            'bi': np.asarray(model.bi),
+            'global_mean': float(trainset.global_mean),
+            'rating_scale': tuple(trainset.rating_scale),
+            'biased': bool(model.biased),
+            'user_index': pd.Index(user_ids),
+            'item_index': pd.Index(item_ids)}
+
+def score_items(factors, item_ids, user_ids=None):
+    """Estimate the ratings given by many users to many items.
+
+    Parameters
+    ----------
+    factors : dict
+        Model parameters returned by `extract_factors`.
+    item_ids : list
+        Raw ids of the items to score.
+    user_ids : list, optional
+        Raw ids of the users to score. Every user known to the model is
+        scored, in inner-id order, when omitted.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (len(item_ids), n_users) of estimated ratings.
+
+    """
+    items = factors['item_index'].get_indexer(list(item_ids))
+    if user_ids is None:
+        users = np.arange(len(factors['user_index']))
+    else:
+        users = factors['user_index'].get_indexer(list(user_ids))
+    known_items = items >= 0
+    known_users = users >= 0
+
+    # Unknown ids contribute no bias and no interaction term
+    qi = np.where(known_items[:, None], factors['qi'][items], 0.0)
+    pu = np.where(known_users[:, None], factors['pu'][users], 0.0)
+    scores = qi @ pu.T
+    if factors['biased']:
+        bi = np.where(known_items, factors['bi'][items], 0.0)
+        bu = np.where(known_users, factors['bu'][users], 0.0)
+        scores += factors['global_mean'] + bi[:, None] + bu[None, :]
+    else:
+        # An unbiased SVD can only fall back to the global mean
+        both = known_items[:, None] & known_users[None, :]
+        scores = np.where(both, scores, factors['global_mean'])
+    low, high = factors['rating_scale']
+    return np.clip(scores, low, high, out=scores)
+
+def predict_ratings(factors, user_ids, item_ids):
+    """Estimate the ratings of (user, item) pairs.
+
+    Parameters
+    ----------
+    factors : dict
+        Model parameters returned by `extract_factors`.
+    user_ids : list
+        Raw user id of each pair.
+    item_ids : list
+        Raw item id of each pair.
+
+    Returns
+    -------
+    numpy.ndarray
+        Estimated rating of each pair, as by `score_items`.
+
+    """
+    users = factors['user_index'].get_indexer(list(user_ids))
+    items = factors['item_index'].get_indexer(list(item_ids))
+    known_users = users >= 0
+    known_items = items >= 0
+    pu = np.where(known_users[:, None], factors['pu'][users], 0.0)
+    qi = np.where(known_items[:, None], factors['qi'][items], 0.0)
+    estimates = np.einsum('ij,ij->i', pu, qi)
+    if factors['biased']:
+        estimates += (factors['global_mean']
+                      + np.where(known_users, factors['bu'][users], 0.0)
+                      + np.where(known_items, factors['bi'][items], 0.0))
+    else:
+        estimates = np.where(known_users & known_items, estimates, factors['global_mean'])
+    low, high = factors['rating_scale']
+    return np.clip(estimates, low, high)
+
+def top_k(scores, k):
+    """Positions of the k largest scores along the last axis of an array.
+
+    Only the k winners of each row are sorted. Ties are broken in favour
+    of the lower position, matching a stable descending sort.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray
+        One- or two-dimensional array of scores.
+    k : int
+        Number of positions to return per row.
+
+    Returns
+    -------
+    numpy.ndarray
+        Positions of the top-k scores, best first.
+
+    """
+    scores = np.asarray(scores)
+    k = min(k, scores.shape[-1])
+    if k == 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.intp)
+    # Value of the k-th best score in each row, found by partial selection
+    kth = -np.partition(-scores, k - 1, axis=-1)[..., k - 1:k]
+    above = scores > kth
+    tied = scores == kth
+    # Ties straddling the cut resolve to the lowest positions
+    room = k - above.sum(axis=-1, keepdims=True)
+    mask = above | (tied & (np.cumsum(tied, axis=-1) <= room))
+    top = np.nonzero(mask)[-1].reshape(scores.shape[:-1] + (k,))
+    top_scores = np.take_along_axis(scores, top, axis=-1)
+    order = np.argsort(-top_scores, axis=-1, kind='stable')
+    return np.take_along_axis(top, order, axis=-1)
+
+def _solve_ridge(rows, others, ratings, vectors, biases, other_vectors, other_biases,
+                 global_mean, biased, reg):
+    # Least-squares fit of the parameters of each row against the frozen
+    # parameters of the rows it is paired with, in place
+    order = np.argsort(rows, kind='stable')
+    rows, others, ratings = rows[order], others[order], ratings[order]
+    targets, starts = np.unique(rows, return_index=True)
+    n_factors = vectors.shape[1]
+    for target, group in zip(targets, np.split(np.arange(len(rows)), starts[1:])):
+        x = other_vectors[others[group]]
+        y = ratings[group]
+        if biased:
+            x = np.hstack([x, np.ones((len(group), 1))])
+            y = y - global_mean - other_biases[others[group]]
+        # SGD applies the regularisation once per rating
+        weights = np.linalg.solve(x.T @ x + reg * len(group) * np.eye(x.shape[1]), x.T @ y)
+        vectors[target] = weights[:n_factors]
+        if biased:
+            biases[target] = weights[n_factors]
+
+def fold_in(factors, ratings, reg=0.02, n_rounds=3):
+    """Fit new and changed users, and new items, into a trained model.
+
+    Every user in `ratings` is re-estimated, as is every item unknown to
+    the model. The factors of known items are shared by every user and
+    stay frozen. Each round solves, in closed form, the regularised
+    least-squares objective that SGD training minimises: users against
+    fixed item parameters, then new items against fixed user parameters.
+
+    Parameters
+    ----------
+    factors : dict
+        Model parameters returned by `extract_factors`.
+    ratings : Pandas DataFrame
+        `userId`, `movieId` and `rating` columns. Must hold the complete
+        rating history of every user and new item to be fitted.
+    reg : float
+        Regularisation term, as `reg_all` of `surprise.SVD`.
+    n_rounds : int
+        Number of alternating user and item passes.
+
+    Returns
+    -------
+    dict
+        Updated model parameters, with new users and items appended.
+
+    """
+    user_index = factors['user_index']
+    item_index = factors['item_index']
+    new_users = pd.Index(ratings['userId'].unique()).difference(user_index)
+    new_items = pd.Index(ratings['movieId'].unique()).difference(item_index)
+    n_factors = factors['qi'].shape[1]
+    n_known_items = len(item_index)
+    user_index = user_index.append(new_users)
+    item_index = item_index.append(new_items)
+    # New rows start at zero, i.e. from the global mean
+    pu = np.vstack([factors['pu'], np.zeros((len(new_users), n_factors))])
+    qi = np.vstack([factors['qi'], np.zeros((len(new_items), n_factors))])
+    bu = np.concatenate([factors['bu'], np.zeros(len(new_users))])
+    bi = np.concatenate([factors['bi'], np.zeros(len(new_items))])
+
+    users = user_index.get_indexer(ratings['userId'])
+    items = item_index.get_indexer(ratings['movieId'])
+    values = ratings['rating'].to_numpy(dtype=np.float64)
+    fresh = items >= n_known_items
+    for _ in range(n_rounds):
+        _solve_ridge(users, items, values, pu, bu, qi, bi,
+                     factors['global_mean'], factors['biased'], reg)
+        if fresh.any():
+            _solve_ridge(items[fresh], users[fresh], values[fresh], qi, bi, pu, bu,
+                         factors['global_mean'], factors['biased'], reg)
+    return {**factors,
+            'pu': pu, 'qi': qi, 'bu': bu, 'bi': bi,
+            'user_index': user_index,
+            'item_index': item_index}
+
+def save_factors(path, factors, precision='float64'):
+    """Write model parameters to a single `.npz` file.
+
+    Parameters
+    ----------
+    path : str
+        Destination file path.
+    factors : dict
+        Model parameters returned by `extract_factors`.
+    precision : str
+        'float64', 'float32', or 'int8' to store the latent factors as
+        int8 codes with one scale per row (see `utils.quantisation`).
+        Biases are kept in float32 at reduced precisions.
+
+    """
+    arrays = {name: np.asarray(factors[name]) for name in ('pu', 'qi', 'bu', 'bi')}
+    if precision == 'int8':
+        for name in ('pu', 'qi'):
+            arrays[name], arrays[f'{name}_scales'] = quantise_rows(arrays[name])
+    elif precision != 'float64':
+        arrays['pu'] = arrays['pu'].astype(precision)
+        arrays['qi'] = arrays['qi'].astype(precision)
+    if precision != 'float64':
+        arrays['bu'] = arrays['bu'].astype(np.float32)
+        arrays['bi'] = arrays['bi'].astype(np.float32)
+    with open(path, 'wb') as f:
+        np.savez(f,
+                 global_mean=factors['global_mean'],
+                 rating_scale=np.asarray(factors['rating_scale'], dtype=np.float64),
+                 biased=factors['biased'],
+                 user_ids=np.asarray(factors['user_index']),
+                 item_ids=np.asarray(factors['item_index']),
+                 **arrays)
+
+def load_factors(path):
+    """Load model parameters written by `save_factors`.
+
+    Parameters
+    ----------
+    path : str
+        Path to the `.npz` file.
+
+    Returns
+    -------
+    dict
+        Model parameters in the format of `extract_factors`. Factors
+        stored as int8 are returned as `QuantisedMatrix` objects, which
+        the scoring functions accept in place of arrays.
+
+    """
+    with np.load(path) as f:
+        factors = {'pu': f['pu'],
+                   'qi': f['qi'],
+                   'bu': f['bu'],
+                   'bi': f['bi'],
+                   'global_mean': float(f['global_mean']),
+                   'rating_scale': tuple(f['rating_scale'].tolist()),
+                   'biased': bool(f['biased']),
+                   'user_index': pd.Index(f['user_ids']),
+                   'item_index': pd.Index(f['item_ids'])}
+        for name in ('pu', 'qi'):
+            if f'{name}_scales' in f:
+                factors[name] = QuantisedMatrix(factors[name], f[f'{name}_scales'])
+    return factors
+
+def is_quantised(factors):
+    """Whether model parameters were loaded at a reduced precision."""
+    return factors['qi'].dtype != np.float64
+
+def latest_factors_path(artifact_dir, precision='float64'):
+    """Path of the most recently exported factor artifact, if any.
+
+    Parameters
+    ----------
+    artifact_dir : str
+        Directory holding versioned exports and a `LATEST` pointer file,
+        as written by `resources/models/train_pipeline.py`.
+    precision : str
+        Precision of the artifact. A reduced-precision variant (see
+        `utils.quantisation.resolve_path`) is returned when one was
+        exported for the latest version.
+
+    Returns
+    -------
+    str or None
+        Path to the `factors.npz` of the latest version, or its variant.
+
+    """
+    pointer = os.path.join(artifact_dir, 'LATEST')
+    if not os.path.exists(pointer):
+        return None
+    with open(pointer) as f:
+        version = f.read().strip()
+    path = os.path.join(artifact_dir, version, 'factors.npz')
+    return resolve_path(path, precision) if os.path.exists(path) else None
+
+def export_factors(artifact_dir, factors, metadata):
+    """Write model parameters as a new version and point `LATEST` at it.
+
+    Parameters
+    ----------
+    artifact_dir : str
+        Directory holding the versioned exports.
+    factors : dict
+        Model parameters returned by `extract_factors`.
+    metadata : dict
+        JSON-serialisable description of the model, written alongside.
+
+    Returns
+    -------
+    str
+        Directory of the new version.
+
+    """
+    version_dir = new_version_dir(artifact_dir)
+    save_factors(os.path.join(version_dir, 'factors.npz'), factors)
+    with open(os.path.join(version_dir, 'metadata.json'), 'w') as f:
+        json.dump({'version': os.path.basename(version_dir), **metadata}, f, indent=2)
+    set_latest(artifact_dir, version_dir)
+    return version_dir
+
+def new_version_dir(artifact_dir):
+    """Create an empty, timestamped version directory.
+
+    Returns
+    -------
+    str
+        The new directory, e.g. `<artifact_dir>/v20240101120000`.
+
+    """
+    version = time.strftime('v%Y%m%d%H%M%S')
+    suffix = 0
+    while os.path.exists(os.path.join(artifact_dir, version + (f'-{suffix}' if suffix else ''))):
+        suffix += 1
+    version_dir = os.path.join(artifact_dir, version + (f'-{suffix}' if suffix else ''))
+    os.makedirs(version_dir)
+    return version_dir
+
+def set_latest(artifact_dir, version_dir):
+    """Atomically point `<artifact_dir>/LATEST` at a complete version."""
+    # Readers only ever see a complete version through the pointer
+    pointer = os.path.join(artifact_dir, 'LATEST')
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(os.path.basename(version_dir))
+    os.replace(pointer + '.tmp', pointer)
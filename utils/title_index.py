@@ -0,0 +1,216 @@
+"""
+
+    Title to movieId lookup service.
+
+    Author: Explore Data Science Academy.
+
+    Description: A prebuilt index over the movie catalogue which resolves
+    user-supplied titles to MovieLens movie ids. Exact titles are found
+    with a dictionary lookup. Titles which do not match exactly are
+    normalised (case, accents, punctuation, the release year and trailing
+    articles such as ", The" are ignored) and looked up again, and a
+    sorted key list supports type-ahead prefix search. A token index
+    narrows the candidates for typo-tolerant fuzzy matching.
+
+"""
+# Script dependencies
+import re
+import bisect
+import difflib
+import unicodedata
+
+# Data handling dependencies
+import numpy as np
+
+_YEAR = re.compile(r'\s*\((\d{4})(?:-\d{0,4})?\)\)?\s*$')
+_ARTICLE = re.compile(r'^(.*), (the|a|an|les|la|le|el|il|der|die|das)$')
+_LEADING_ARTICLE = re.compile(r'^(the|a|an) ')
+_PUNCTUATION = re.compile(r'[^\w\s]')
+
+def _split_title(title):
+    # Canonical form of a title and its release year (or None)
+    title = str(title)
+    if not title.isascii():
+        title = unicodedata.normalize('NFKD', title)
+        title = ''.join(c for c in title if not unicodedata.combining(c))
+    title = title.lower().strip()
+    year = _YEAR.search(title)
+    title = _YEAR.sub('', title)
+    # Alternative titles in parentheses are kept, so only the main title
+    # has its trailing article moved to the front
+    main, bracket, rest = title.partition(' (')
+    match = _ARTICLE.match(main)
+    if match:
+        main = f'{match.group(2)} {match.group(1)}'
+    title = main + (bracket + rest if bracket else '')
+    title = ' '.join(_PUNCTUATION.sub(' ', title).split())
+    return title, (year.group(1) if year else None)
+
+def normalise_title(title, keep_year=False):
+    """Reduce a title to a canonical lookup key.
+
+    Parameters
+    ----------
+    title : str
+        Movie title, e.g. "Usual Suspects, The (1995)".
+    keep_year : bool
+        Whether a trailing release year is kept as part of the key.
+
+    Returns
+    -------
+    str
+        Lookup key, e.g. "the usual suspects" (or "the usual suspects
+        1995" when keeping the year).
+
+    """
+    key, year = _split_title(title)
+    if keep_year and year:
+        return f'{key} {year}'
+    return key
+
+def release_year(title):
+    """Release year in a title such as "Heat (1995)", or None."""
+    year = _YEAR.search(str(title))
+    return int(year.group(1)) if year else None
+
+class TitleIndex:
+    """Exact, normalised, prefix and fuzzy lookup of movie titles.
+
+    Parameters
+    ----------
+    movies : Pandas DataFrame
+        Movie catalogue with `movieId` and `title` columns.
+
+    """
+
+    def __init__(self, movies):
+        self.titles = movies['title'].astype(str).tolist()
+        self.movie_ids = np.asarray(movies['movieId'])
+        self._exact = {}
+        # Normalised keys (with and without the year) map to the distinct
+        # titles sharing them, in catalogue order
+        self._normalised = {}
+        for title, movie_id in zip(self.titles, self.movie_ids.tolist()):
+            if title not in self._exact:
+                key, year = _split_title(title)
+                keys = {key, f'{key} {year}' if year else key}
+                # Also findable without a leading article
+                keys.add(_LEADING_ARTICLE.sub('', key))
+                for alias in keys:
+                    self._normalised.setdefault(alias, []).append(title)
+            self._exact.setdefault(title, []).append(movie_id)
+        self._tokens = {}
+        for key in self._normalised:
+            for token in set(key.split()):
+                if len(token) >= 3 and not token.isdigit():
+                    self._tokens.setdefault(token, []).append(key)
+        self._sorted_keys = sorted(self._normalised)
+        self._title_of = dict(zip(self.movie_ids.tolist(), self.titles))
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __contains__(self, title):
+        return title in self._exact
+
+    def title(self, movie_id):
+        """Title of a movie id."""
+        return self._title_of[movie_id]
+
+    def lookup(self, title):
+        """Movie ids carrying exactly this title (several for duplicates).
+
+        Parameters
+        ----------
+        title : str
+            Title as listed in the catalogue.
+
+        Returns
+        -------
+        list (int)
+            Matching movie ids in catalogue order. Empty if unknown.
+
+        """
+        return list(self._exact.get(title, []))
+
+    def resolve(self, title, fuzzy=True):
+        """Movie ids for a title, tolerating formatting differences and typos.
+
+        Tries, in order: an exact match, a match of the normalised title
+        (ignoring case, punctuation and trailing articles, and the year if
+        none was given), and optionally the closest fuzzy match. When a
+        year-less title matches several releases, the first listed in the
+        catalogue is used.
+
+        Parameters
+        ----------
+        title : str
+            Title supplied by the user.
+        fuzzy : bool
+            Whether to fall back to fuzzy matching.
+
+        Returns
+        -------
+        list (int)
+            Movie ids of the matched title (several for duplicate
+            catalogue entries). Empty if the title cannot be resolved.
+
+        """
+        if title in self._exact:
+            return self.lookup(title)
+        for key in (normalise_title(title, keep_year=True), normalise_title(title)):
+            if key in self._normalised:
+                return self.lookup(self._normalised[key][0])
+        if fuzzy:
+            matches = self.fuzzy(title, limit=1)
+            if matches:
+                return self.lookup(self._normalised[matches[0]][0])
+        return []
+
+    def search(self, query, limit=50):
+        """Type-ahead search of catalogue titles.
+
+        Parameters
+        ----------
+        query : str
+            Partial title as typed by the user.
+        limit : int
+            Maximum number of titles returned.
+
+        Returns
+        -------
+        list (str)
+            Distinct titles whose normalised form starts with the
+            normalised query, followed by fuzzy matches if fewer than
+            `limit` were found.
+
+        """
+        key = normalise_title(query, keep_year=True)
+        results = {}
+        start = bisect.bisect_left(self._sorted_keys, key)
+        for candidate in self._sorted_keys[start:]:
+            if not candidate.startswith(key) or len(results) >= limit:
+                break
+            results.update(dict.fromkeys(self._normalised[candidate]))
+        if len(results) < limit:
+            for candidate in self.fuzzy(query, limit=limit - len(results)):
+                results.update(dict.fromkeys(self._normalised[candidate]))
+        return list(results)[:limit]
+
+    def fuzzy(self, query, limit=5, cutoff=0.75):
+        """Normalised catalogue keys closest to a (possibly misspelt) title.
+
+        Only keys sharing at least one word with the query are compared,
+        which keeps matching fast on large catalogues.
+
+        """
+        key = normalise_title(query)
+        candidates = set()
+        for token in key.split():
+            candidates.update(self._tokens.get(token, ()))
+        if not candidates:
+            # Every word may be misspelt; compare against close words instead
+            for token in key.split():
+                for close in difflib.get_close_matches(token, self._tokens, n=3, cutoff=0.8):
+                    candidates.update(self._tokens[close])
+        return difflib.get_close_matches(key, list(candidates), n=limit, cutoff=cutoff)
@@ -0,0 +1,257 @@
+"""
+
+    Precomputed personalised top-N recommendations.
+
+    Author: Explore Data Science Academy.
+
+    Description: Scores every user known to an SVD model against every
+    item, in blocks of users with one matrix product per block, masks the
+    items each user has already rated with a sparse matrix and keeps the
+    top N. Blocks are sharded across a process pool, and every worker
+    writes its rows straight into memory-mapped output arrays, so the
+    results never pass through the parent process. Each export is a
+    version directory (see `utils.svd_scoring.new_version_dir`) holding:
+
+        users.npy      user id of each row,
+        positions.npy  row of each user id (-1 for unknown ids), so that
+                       a lookup is a single array read,
+        items.npy      (users x N) recommended movie ids, -1 padded,
+        scores.npy     (users x N) estimated ratings,
+        meta.json      N, model and timing details.
+
+    `UserTopN` memory-maps the latest export for constant-time lookups.
+    See `resources/models/export_user_topn.py` for the batch job.
+
+"""
+# Script dependencies
+import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Data handling dependencies
+import numpy as np
+import scipy.sparse as sps
+
+from utils.svd_scoring import save_factors, load_factors, new_version_dir, set_latest, top_k
+
+USER_TOPN_DIR = 'resources/models/user_topn'
+
+# Model parameters and masks of one worker process
+_worker = None
+
+def rated_mask(factors, ratings):
+    """Sparse user x item mask of the rated pairs, in model order.
+
+    Parameters
+    ----------
+    factors : dict
+        Model parameters returned by `utils.svd_scoring.extract_factors`.
+    ratings : Pandas DataFrame
+        `userId` and `movieId` columns.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Boolean matrix with one row per model user and one column per
+        model item. Pairs unknown to the model are left out.
+
+    """
+    rows = factors['user_index'].get_indexer(ratings['userId'])
+    columns = factors['item_index'].get_indexer(ratings['movieId'])
+    known = (rows >= 0) & (columns >= 0)
+    mask = sps.csr_matrix((np.ones(int(known.sum()), dtype=bool), (rows[known], columns[known])),
+                          shape=(len(factors['user_index']), len(factors['item_index'])))
+    mask.sum_duplicates()
+    return mask
+
+def score_users(factors, rows, n, rated=None, allowed=None):
+    """Top-n unrated items of a block of users.
+
+    Parameters
+    ----------
+    factors : dict
+        Model parameters.
+    rows : numpy.ndarray
+        Inner ids (model rows) of the users.
+    n : int
+        Number of items per user.
+    rated : scipy.sparse.csr_matrix, optional
+        Mask of rated pairs, see `rated_mask`.
+    allowed : numpy.ndarray, optional
+        Boolean mask of the items which may be recommended.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        Inner ids of the items, -1 where a user has fewer than n
+        candidates, and their estimated ratings; best first.
+
+    """
+    scores = factors['pu'][rows] @ factors['qi'].T
+    if factors['biased']:
+        scores += factors['global_mean'] + factors['bu'][rows][:, None] + factors['bi'][None, :]
+    low, high = factors['rating_scale']
+    np.clip(scores, low, high, out=scores)
+    if allowed is not None:
+        scores[:, ~allowed] = -np.inf
+    if rated is not None:
+        block = rated[rows].tocoo()
+        scores[block.row, block.col] = -np.inf
+    top = top_k(scores, n)
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    top[np.isneginf(top_scores)] = -1
+    return top, top_scores
+
+def _init_worker(version_dir, n, allowed):
+    global _worker
+    factors = load_factors(os.path.join(version_dir, 'factors.npz'))
+    # Single precision halves the memory traffic of the products
+    for name in ('pu', 'qi', 'bu', 'bi'):
+        factors[name] = factors[name].astype(np.float32)
+    _worker = {'factors': factors,
+               'rated': sps.load_npz(os.path.join(version_dir, 'rated.npz')).tocsr(),
+               'allowed': allowed,
+               'n': n,
+               'items': np.load(os.path.join(version_dir, 'items.npy'), mmap_mode='r+'),
+               'scores': np.load(os.path.join(version_dir, 'scores.npy'), mmap_mode='r+')}
+
+def _score_shard(start, stop, block_size):
+    # Rows [start, stop) of the output, one block of users at a time
+    factors = _worker['factors']
+    item_ids = np.asarray(factors['item_index'])
+    for block_start in range(start, stop, block_size):
+        rows = np.arange(block_start, min(block_start + block_size, stop))
+        top, top_scores = score_users(factors, rows, _worker['n'], _worker['rated'],
+                                      _worker['allowed'])
+        _worker['items'][rows] = np.where(top >= 0, item_ids[np.maximum(top, 0)], -1)
+        _worker['scores'][rows] = np.where(top >= 0, top_scores, np.nan)
+    _worker['items'].flush()
+    _worker['scores'].flush()
+    return stop - start
+
+def export_user_topn(factors, ratings, artifact_dir=USER_TOPN_DIR, n=50, allowed_items=None,
+                     block_size=512, workers=None, metadata=None):
+    """Compute and save the top-n unrated movies of every model user.
+
+    Parameters
+    ----------
+    factors : dict
+        Model parameters returned by `utils.svd_scoring.extract_factors`.
+    ratings : Pandas DataFrame
+        Ratings whose movies are not recommended again to their user.
+    artifact_dir : str
+        Directory of the versioned exports.
+    n : int
+        Number of recommendations per user.
+    allowed_items : list (int), optional
+        Movie IDs which may be recommended (e.g. those with a title).
+    block_size : int
+        Users scored per matrix product.
+    workers : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    metadata : dict, optional
+        Extra fields recorded in `meta.json`.
+
+    Returns
+    -------
+    str
+        Directory of the new version.
+
+    """
+    start = time.perf_counter()
+    user_ids = np.asarray(factors['user_index'], dtype=np.int64)
+    n_users = len(user_ids)
+    allowed = None
+    if allowed_items is not None:
+        allowed = np.asarray(factors['item_index'].isin(allowed_items))
+
+    version_dir = new_version_dir(artifact_dir)
+    # Inputs shared with the workers through the version directory
+    save_factors(os.path.join(version_dir, 'factors.npz'), factors)
+    sps.save_npz(os.path.join(version_dir, 'rated.npz'), rated_mask(factors, ratings))
+    np.lib.format.open_memmap(os.path.join(version_dir, 'items.npy'), mode='w+',
+                              dtype=np.int32, shape=(n_users, n))[:] = -1
+    np.lib.format.open_memmap(os.path.join(version_dir, 'scores.npy'), mode='w+',
+                              dtype=np.float32, shape=(n_users, n))[:] = np.nan
+
+    workers = workers or os.cpu_count()
+    # A few shards per worker balance the load without tiny tasks
+    shard_size = max(block_size, -(-n_users // (4 * workers)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(version_dir, n, allowed)) as pool:
+        futures = [pool.submit(_score_shard, shard, min(shard + shard_size, n_users), block_size)
+                   for shard in range(0, n_users, shard_size)]
+        scored = sum(future.result() for future in futures)
+
+    os.remove(os.path.join(version_dir, 'factors.npz'))
+    os.remove(os.path.join(version_dir, 'rated.npz'))
+    positions = np.full(int(user_ids.max(initial=-1)) + 1, -1, dtype=np.int32)
+    positions[user_ids] = np.arange(n_users, dtype=np.int32)
+    np.save(os.path.join(version_dir, 'users.npy'), user_ids)
+    np.save(os.path.join(version_dir, 'positions.npy'), positions)
+    with open(os.path.join(version_dir, 'meta.json'), 'w') as f:
+        json.dump({'n': n, 'n_users': int(scored),
+                   'seconds': time.perf_counter() - start,
+                   **(metadata or {})}, f, indent=2)
+    set_latest(artifact_dir, version_dir)
+    return version_dir
+
+class UserTopN:
+    """Constant-time lookups in the latest personalised top-N export.
+
+    Parameters
+    ----------
+    artifact_dir : str
+        Directory of the versioned exports.
+
+    """
+
+    def __init__(self, artifact_dir=USER_TOPN_DIR):
+        self.pointer = os.path.join(artifact_dir, 'LATEST')
+        if not os.path.exists(self.pointer):
+            raise FileNotFoundError(f'No personalised recommendations exported to {artifact_dir}; '
+                                    'run resources/models/export_user_topn.py')
+        with open(self.pointer) as f:
+            self.version_dir = os.path.join(artifact_dir, f.read().strip())
+        with open(os.path.join(self.version_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.n = self.meta['n']
+        self.positions = np.load(os.path.join(self.version_dir, 'positions.npy'))
+        self.items = np.load(os.path.join(self.version_dir, 'items.npy'), mmap_mode='r')
+        self.scores = np.load(os.path.join(self.version_dir, 'scores.npy'), mmap_mode='r')
+
+    def is_stale(self):
+        """Whether a newer export has been published since loading."""
+        try:
+            with open(self.pointer) as f:
+                latest = f.read().strip()
+        except FileNotFoundError:
+            return False
+        return os.path.join(os.path.dirname(self.pointer), latest) != self.version_dir
+
+    def __contains__(self, user_id):
+        return 0 <= user_id < len(self.positions) and self.positions[user_id] >= 0
+
+    def top(self, user_id, n=None):
+        """Precomputed recommendations of a user.
+
+        Parameters
+        ----------
+        user_id : int
+            MovieLens user id.
+        n : int, optional
+            Number of recommendations, at most the exported N.
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray)
+            Movie IDs and estimated ratings, best first.
+
+        """
+        if user_id not in self:
+            raise KeyError(user_id)
+        row = self.positions[user_id]
+        items = np.asarray(self.items[row, :n])
+        found = items >= 0
+        return items[found], np.asarray(self.scores[row, :n])[found]
@@ -0,0 +1,189 @@
+"""
+
+    Recommendation worker pool.
+
+    Author: Explore Data Science Academy.
+
+    Description: A bounded pool of worker threads computing recommendation
+    jobs off the caller's thread (e.g. the Streamlit script thread), with:
+
+        - single-flight coalescing: identical jobs submitted while one is
+          in flight share its future, so a burst of sessions asking for
+          the same seeds runs the model once,
+        - backpressure: at most `max_pending` distinct jobs are queued or
+          running; further submissions fail fast with `PoolBusy` rather
+          than piling up work the CPUs cannot absorb,
+        - per-request timeouts: callers wait on the returned future for a
+          bounded time. A job which times out keeps running, and its
+          result still fills the result cache for the next request.
+
+    Threads are used rather than processes so that the workers share the
+    models loaded once through the artifact registry; the scoring kernels
+    spend their time in numpy, which releases the GIL.
+
+    The process-wide pool is configured through environment variables:
+
+        RECOMMENDER_POOL_WORKERS  Worker threads (default: number of CPUs).
+        RECOMMENDER_POOL_PENDING  Maximum jobs queued or running (default 64).
+        RECOMMENDER_POOL_TIMEOUT  Seconds a caller waits (default 30).
+
+"""
+# Script dependencies
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import instrumentation
+
+class PoolBusy(RuntimeError):
+    """Raised when a job is submitted to a pool whose queue is full."""
+
+class WorkerPool:
+    """Bounded thread pool coalescing identical in-flight jobs.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Number of worker threads. Defaults to the number of CPUs.
+    max_pending : int
+        Maximum number of distinct jobs queued or running.
+    timeout : float
+        Default number of seconds `result` waits for a job.
+
+    """
+
+    def __init__(self, workers=None, max_pending=64, timeout=30):
+        self.workers = workers or os.cpu_count()
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix='recommend-pool')
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def submit(self, key, function, *args):
+        """Run `function(*args)` on the pool, once per in-flight key.
+
+        Parameters
+        ----------
+        key : hashable
+            Identity of the job. A job whose key is already in flight is
+            not run again: the running job's future is returned.
+        function : callable
+            The job.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future of the job's result.
+
+        Raises
+        ------
+        PoolBusy
+            When `max_pending` jobs are already queued or running.
+
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                instrumentation.count('pool_coalesced')
+                return future
+            if len(self._inflight) >= self.max_pending:
+                self.rejected += 1
+                instrumentation.count('pool_rejected')
+                raise PoolBusy(f'{len(self._inflight)} recommendation jobs already pending')
+            future = self._executor.submit(function, *args)
+            self._inflight[key] = future
+            self.submitted += 1
+        # Outside the lock: the callback runs at once if the job is done
+        future.add_done_callback(lambda done: self._release(key, done))
+        return future
+
+    def _release(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def result(self, future, timeout=None):
+        """Wait for a job's result.
+
+        Parameters
+        ----------
+        future : concurrent.futures.Future
+            Future returned by `submit`.
+        timeout : float, optional
+            Seconds to wait. Defaults to the pool's timeout.
+
+        Raises
+        ------
+        TimeoutError
+            When the job is not done in time. It is not cancelled.
+
+        """
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            instrumentation.count('pool_timeout')
+            raise
+
+    def stats(self):
+        """Pool size, pending jobs and job counters."""
+        with self._lock:
+            return {'workers': self.workers,
+                    'pending': len(self._inflight),
+                    'submitted': self.submitted,
+                    'coalesced': self.coalesced,
+                    'rejected': self.rejected,
+                    'timeouts': self.timeouts}
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads once the pending jobs are done."""
+        self._executor.shutdown(wait=wait)
+
+recommendation_pool = WorkerPool(
+    workers=int(os.environ.get('RECOMMENDER_POOL_WORKERS', 0)) or None,
+    max_pending=int(os.environ.get('RECOMMENDER_POOL_PENDING', 64)),
+    timeout=float(os.environ.get('RECOMMENDER_POOL_TIMEOUT', 30)))
+
+instrumentation.register_gauge(
+    'recommender_pool', 'Worker pool size, pending jobs and job counters.',
+    lambda: {(('stat', stat),): value for stat, value in recommendation_pool.stats().items()})
+
+def submit_recommendation(engine, algorithm, movie_list, top_n=10, pool=None, filters=None):
+    """Compute recommendations on the worker pool.
+
+    Requests for the same algorithm, set of seeds, number of results and
+    filters are coalesced while one of them is being computed.
+
+    Parameters
+    ----------
+    engine : LocalEngine or HttpEngine
+        Engine computing the recommendations, see `recommenders.engine`.
+    algorithm : str
+        Name of the algorithm.
+    movie_list : list (str)
+        Favourite movie titles.
+    top_n : int
+        Number of recommendations.
+    pool : WorkerPool, optional
+        Pool to use. Defaults to the process-wide pool.
+    filters : MovieFilter, optional
+        Genres and release years the recommendations must match, see
+        `utils.movie_filters.make_filter`.
+
+    Returns
+    -------
+    concurrent.futures.Future
+        Future of the recommended titles; wait on it with `pool.result`.
+
+    """
+    pool = pool if pool is not None else recommendation_pool
+    key = (algorithm, tuple(sorted(set(movie_list))), top_n, filters)
+    return pool.submit(key, engine.recommend, algorithm, list(movie_list), top_n, filters)